@@ -15,6 +15,25 @@ CREATE SCHEMA IF NOT EXISTS staging_raw;
 CREATE SCHEMA IF NOT EXISTS staging_clean;
 
 -- Raw : miroir brut des donnees extraites de l'API ERP
+-- Partitionne par run (LIST sur etl_run_id) : chaque extraction attache sa propre
+-- partition, complete ; les anciens runs sont supprimes par DROP de leur partition.
+
+-- Migration : les anciennes tables non partitionnees sont supprimees (zone
+-- d'atterrissage transitoire, rechargee par l'extraction complete suivante)
+DO $$
+DECLARE
+  t TEXT;
+BEGIN
+  FOREACH t IN ARRAY ARRAY['customers_raw', 'suppliers_raw', 'products_raw', 'orders_raw',
+                           'order_lines_raw', 'order_status_history_raw'] LOOP
+    IF EXISTS (
+      SELECT 1 FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+      WHERE n.nspname = 'staging_raw' AND c.relname = t AND c.relkind = 'r'
+    ) THEN
+      EXECUTE format('DROP TABLE staging_raw.%I', t);
+    END IF;
+  END LOOP;
+END $$;
 
 CREATE TABLE IF NOT EXISTS staging_raw.customers_raw (
   customer_id TEXT,
@@ -27,8 +46,8 @@ CREATE TABLE IF NOT EXISTS staging_raw.customers_raw (
   created_at TIMESTAMP,
   updated_at TIMESTAMP,
   etl_loaded_at TIMESTAMP NOT NULL DEFAULT NOW(),
-  etl_run_id TEXT
-);
+  etl_run_id TEXT NOT NULL
+) PARTITION BY LIST (etl_run_id);
 
 CREATE TABLE IF NOT EXISTS staging_raw.suppliers_raw (
   supplier_id TEXT,
@@ -43,8 +62,8 @@ CREATE TABLE IF NOT EXISTS staging_raw.suppliers_raw (
   created_at TIMESTAMP,
   updated_at TIMESTAMP,
   etl_loaded_at TIMESTAMP NOT NULL DEFAULT NOW(),
-  etl_run_id TEXT
-);
+  etl_run_id TEXT NOT NULL
+) PARTITION BY LIST (etl_run_id);
 
 CREATE TABLE IF NOT EXISTS staging_raw.products_raw (
   product_id TEXT,
@@ -61,8 +80,8 @@ CREATE TABLE IF NOT EXISTS staging_raw.products_raw (
   created_at TIMESTAMP,
   updated_at TIMESTAMP,
   etl_loaded_at TIMESTAMP NOT NULL DEFAULT NOW(),
-  etl_run_id TEXT
-);
+  etl_run_id TEXT NOT NULL
+) PARTITION BY LIST (etl_run_id);
 
 CREATE TABLE IF NOT EXISTS staging_raw.orders_raw (
   order_id TEXT,
@@ -79,8 +98,8 @@ CREATE TABLE IF NOT EXISTS staging_raw.orders_raw (
   created_at TIMESTAMP,
   updated_at TIMESTAMP,
   etl_loaded_at TIMESTAMP NOT NULL DEFAULT NOW(),
-  etl_run_id TEXT
-);
+  etl_run_id TEXT NOT NULL
+) PARTITION BY LIST (etl_run_id);
 
 CREATE TABLE IF NOT EXISTS staging_raw.order_lines_raw (
   row_id INTEGER,
@@ -95,8 +114,8 @@ CREATE TABLE IF NOT EXISTS staging_raw.order_lines_raw (
   created_at TIMESTAMP,
   updated_at TIMESTAMP,
   etl_loaded_at TIMESTAMP NOT NULL DEFAULT NOW(),
-  etl_run_id TEXT
-);
+  etl_run_id TEXT NOT NULL
+) PARTITION BY LIST (etl_run_id);
 
 CREATE TABLE IF NOT EXISTS staging_raw.order_status_history_raw (
   id BIGINT,
@@ -106,7 +125,44 @@ CREATE TABLE IF NOT EXISTS staging_raw.order_status_history_raw (
   updated_by TEXT,
   created_at TIMESTAMP,
   etl_loaded_at TIMESTAMP NOT NULL DEFAULT NOW(),
-  etl_run_id TEXT
+  etl_run_id TEXT NOT NULL
+) PARTITION BY LIST (etl_run_id);
+
+-- Runs disponibles dans staging_raw (une partition par table raw) ; le plus
+-- recent des runs `published` est celui que lit la transformation. Un run
+-- `loading` est en cours de chargement (partitions encore detachees).
+CREATE TABLE IF NOT EXISTS staging_raw.etl_run (
+  etl_run_id TEXT PRIMARY KEY,
+  source TEXT,
+  incremental BOOLEAN NOT NULL DEFAULT FALSE,
+  status TEXT NOT NULL DEFAULT 'published' CHECK (status IN ('loading', 'published')),
+  loaded_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+ALTER TABLE staging_raw.etl_run
+  ADD COLUMN IF NOT EXISTS status TEXT NOT NULL DEFAULT 'published'
+  CHECK (status IN ('loading', 'published'));
+
+-- Run publie juste avant celui-ci : `row_changeset` du run decrit les
+-- differences avec ce run-la (normalisation incrementale de staging_clean)
+ALTER TABLE staging_raw.etl_run ADD COLUMN IF NOT EXISTS changeset_base TEXT;
+
+-- Empreintes par ligne (cle naturelle -> hash du contenu) du dernier etat extrait
+CREATE TABLE IF NOT EXISTS staging_raw.row_fingerprint (
+  entity TEXT NOT NULL,
+  natural_key TEXT NOT NULL,
+  row_hash TEXT NOT NULL,
+  etl_run_id TEXT,
+  PRIMARY KEY (entity, natural_key)
+);
+
+-- Changeset explicite (insert / update / delete) du dernier run d'extraction
+CREATE TABLE IF NOT EXISTS staging_raw.row_changeset (
+  etl_run_id TEXT NOT NULL,
+  entity TEXT NOT NULL,
+  natural_key TEXT NOT NULL,
+  change_type TEXT NOT NULL CHECK (change_type IN ('insert', 'update', 'delete')),
+  PRIMARY KEY (etl_run_id, entity, natural_key)
 );
 
 -- Clean : donnees normalisees, deduplicees, pretes pour le DWH
@@ -184,15 +240,63 @@ CREATE TABLE IF NOT EXISTS staging_clean.order_lines_clean (
 );
 
 CREATE TABLE IF NOT EXISTS staging_clean.order_status_history_clean (
-  id BIGINT PRIMARY KEY,
+  id BIGINT,
   order_id TEXT,
   status TEXT,
   status_date TIMESTAMP,
   updated_by TEXT,
   source_updated_at TIMESTAMP,
-  etl_run_id TEXT
+  etl_run_id TEXT,
+  PRIMARY KEY (order_id, status, status_date)
+);
+
+-- Run de staging_raw que reflete staging_clean (une seule ligne)
+CREATE TABLE IF NOT EXISTS staging_clean.clean_state (
+  singleton BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (singleton),
+  staging_run TEXT NOT NULL,
+  normalized_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- Doublons approches a revoir (transform, phase 2) : un membre de cluster par
+-- ligne, avec son meilleur candidat ; reecrit par entite a chaque run
+CREATE TABLE IF NOT EXISTS staging_clean.duplicate_review (
+  entity TEXT NOT NULL,                 -- customers | products
+  record_id TEXT NOT NULL,              -- cle metier
+  cluster_id TEXT NOT NULL,             -- plus petite cle du cluster
+  cluster_size INTEGER NOT NULL,
+  matched_id TEXT NOT NULL,             -- candidat le plus proche
+  score NUMERIC(5,4) NOT NULL,          -- score de la paire (0-1)
+  blocking_key TEXT NOT NULL,           -- bloc ayant produit la paire : phonetique, minhash, email
+  etl_run_id TEXT,
+  detected_at TIMESTAMP NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (entity, record_id)
+);
+
+-- Commandes a resynchroniser (lignes, historique) lors d'une normalisation
+-- incrementale ; reecrite a chaque run, partagee par les connexions du transform
+CREATE UNLOGGED TABLE IF NOT EXISTS staging_clean.changed_orders (
+  order_id TEXT PRIMARY KEY
 );
 
+-- Migration : l'historique etait cle par son id, synthetique et renumerote a
+-- chaque extraction API complete ; la cle devient (order_id, status,
+-- status_date). La table est videe et la prochaine normalisation est complete.
+DO $$
+BEGIN
+  IF EXISTS (
+    SELECT 1 FROM pg_constraint c
+    JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = ANY (c.conkey)
+    WHERE c.conrelid = 'staging_clean.order_status_history_clean'::regclass
+      AND c.contype = 'p' AND a.attname = 'id'
+  ) THEN
+    TRUNCATE staging_clean.order_status_history_clean, staging_clean.clean_state;
+    ALTER TABLE staging_clean.order_status_history_clean
+      DROP CONSTRAINT order_status_history_clean_pkey;
+    ALTER TABLE staging_clean.order_status_history_clean
+      ADD PRIMARY KEY (order_id, status, status_date);
+  END IF;
+END $$;
+
 -- ===================== 2. DIMENSIONS (schema etoile) =====================
 
 CREATE SCHEMA IF NOT EXISTS dwh;
@@ -220,7 +324,8 @@ CREATE TABLE IF NOT EXISTS dwh.dim_geography (
   geography_hash TEXT UNIQUE
 );
 
--- dim_customer : SCD2-ready (valid_from/valid_to/is_current)
+-- dim_customer : SCD2 (valid_from/valid_to/is_current). Une version couvre
+-- [valid_from, valid_to[ ; la premiere version d'une cle part de 1900-01-01.
 CREATE TABLE IF NOT EXISTS dwh.dim_customer (
   customer_key BIGSERIAL PRIMARY KEY,
   customer_id TEXT NOT NULL,
@@ -230,14 +335,14 @@ CREATE TABLE IF NOT EXISTS dwh.dim_customer (
   state TEXT,
   region TEXT,
   email TEXT,
-  valid_from TIMESTAMP NOT NULL,
+  valid_from TIMESTAMP NOT NULL DEFAULT '1900-01-01',
   valid_to TIMESTAMP,
   is_current BOOLEAN NOT NULL DEFAULT TRUE,
   customer_hash TEXT NOT NULL,
   UNIQUE (customer_id, valid_from)
 );
 
--- dim_supplier : SCD2-ready
+-- dim_supplier : SCD2
 CREATE TABLE IF NOT EXISTS dwh.dim_supplier (
   supplier_key BIGSERIAL PRIMARY KEY,
   supplier_id TEXT NOT NULL,
@@ -247,14 +352,14 @@ CREATE TABLE IF NOT EXISTS dwh.dim_supplier (
   rating NUMERIC(4,2),
   lead_time_days INTEGER,
   active BOOLEAN,
-  valid_from TIMESTAMP NOT NULL,
+  valid_from TIMESTAMP NOT NULL DEFAULT '1900-01-01',
   valid_to TIMESTAMP,
   is_current BOOLEAN NOT NULL DEFAULT TRUE,
   supplier_hash TEXT NOT NULL,
   UNIQUE (supplier_id, valid_from)
 );
 
--- dim_product : SCD2-ready
+-- dim_product : SCD2
 CREATE TABLE IF NOT EXISTS dwh.dim_product (
   product_key BIGSERIAL PRIMARY KEY,
   product_id TEXT NOT NULL,
@@ -264,13 +369,37 @@ CREATE TABLE IF NOT EXISTS dwh.dim_product (
   unit_cost NUMERIC(14,4),
   unit_price NUMERIC(14,4),
   supplier_id TEXT,
-  valid_from TIMESTAMP NOT NULL,
+  valid_from TIMESTAMP NOT NULL DEFAULT '1900-01-01',
   valid_to TIMESTAMP,
   is_current BOOLEAN NOT NULL DEFAULT TRUE,
   product_hash TEXT NOT NULL,
   UNIQUE (product_id, valid_from)
 );
 
+-- Migration : les dimensions etaient inserees en Type-1 avec valid_from =
+-- date du chargement, si bien qu'aucun fait anterieur ne trouvait de version
+-- valide a sa date. La premiere version de chaque cle part desormais de
+-- 1900-01-01 (defaut de la colonne, pose une seule fois).
+DO $$
+DECLARE
+  dim TEXT;
+  bk TEXT;
+BEGIN
+  FOREACH dim IN ARRAY ARRAY['customer', 'supplier', 'product'] LOOP
+    bk := dim || '_id';
+    IF (SELECT column_default FROM information_schema.columns
+        WHERE table_schema = 'dwh' AND table_name = 'dim_' || dim
+          AND column_name = 'valid_from') IS NULL THEN
+      EXECUTE format(
+        'UPDATE dwh.%I d SET valid_from = TIMESTAMP ''1900-01-01''
+         WHERE d.valid_from = (SELECT MIN(f.valid_from) FROM dwh.%I f WHERE f.%I = d.%I)',
+        'dim_' || dim, 'dim_' || dim, bk, bk);
+      EXECUTE format('ALTER TABLE dwh.%I ALTER COLUMN valid_from SET DEFAULT ''1900-01-01''',
+                     'dim_' || dim);
+    END IF;
+  END LOOP;
+END $$;
+
 -- dim_order_status : statuts de commande
 CREATE TABLE IF NOT EXISTS dwh.dim_order_status (
   status_key BIGSERIAL PRIMARY KEY,
@@ -348,6 +477,16 @@ CREATE INDEX IF NOT EXISTS idx_dim_product_bk_current
 CREATE INDEX IF NOT EXISTS idx_dim_supplier_bk_current
   ON dwh.dim_supplier(supplier_id, is_current);
 
+-- Au plus une version courante par cle metier (garde-fou du SCD2)
+CREATE UNIQUE INDEX IF NOT EXISTS uq_dim_customer_current
+  ON dwh.dim_customer(customer_id) WHERE is_current;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_dim_product_current
+  ON dwh.dim_product(product_id) WHERE is_current;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_dim_supplier_current
+  ON dwh.dim_supplier(supplier_id) WHERE is_current;
+
 CREATE INDEX IF NOT EXISTS idx_fact_sales_order_date
   ON dwh.fact_sales_order_line(order_date_key);
 
@@ -14,23 +14,104 @@ Justification :
   L'extraction passe par l'API REST (et non par acces direct a la base OLTP)
   pour respecter l'architecture SOA du projet et la separation des couches.
   Le gateway assure l'authentification et le routage vers les micro-services.
+  Pour les gros volumes, les sources `csv` (data/*.csv) et `db` (lecture
+  directe, en lecture seule, de la base OLTP) produisent les memes colonnes.
 
 Destination : tables staging_raw.* dans la base DWH.
 """
 
+import base64
+import codecs
+import contextlib
+import gzip
 import hashlib
+import itertools
 import json
+import math
 import os
 import pathlib
-from typing import Dict, List, Optional, Tuple
-from urllib.error import HTTPError, URLError
-from urllib.parse import urlencode
-from urllib.request import Request, urlopen
+import queue
+import random
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from email.utils import parsedate_to_datetime
+from operator import itemgetter
+from http.client import HTTPConnection, HTTPException, HTTPSConnection, RemoteDisconnected
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
 
 import psycopg2
 
 CHECKSUM_FILE = pathlib.Path(__file__).resolve().parent.parent / ".etl_checksums.json"
 ORCHESTRATOR_STATE_FILE = pathlib.Path(__file__).resolve().parent.parent / ".orchestrator_state.json"
+WATERMARK_FILE = pathlib.Path(__file__).resolve().parent.parent / ".etl_watermarks.json"
+CHECKPOINT_DIR = pathlib.Path(__file__).resolve().parent.parent / ".etl_checkpoints"
+RESPONSE_CACHE_DIR = pathlib.Path(__file__).resolve().parent.parent / ".etl_cache"
+METRICS_FILE = pathlib.Path(__file__).resolve().parent.parent / ".etl_metrics.json"
+PROBE_FILE = pathlib.Path(__file__).resolve().parent.parent / ".etl_probe.json"
+ORDER_DETAIL_CACHE_FILE = pathlib.Path(__file__).resolve().parent.parent / ".etl_order_details.sqlite"
+# Ancien format (un JSON gzip charge en entier), supprime a l'ouverture du cache
+LEGACY_ORDER_DETAIL_CACHE_FILE = ORDER_DETAIL_CACHE_FILE.with_name(".etl_order_details.json.gz")
+CSV_DATA_DIR = pathlib.Path(__file__).resolve().parent.parent.parent / "data"
+CSV_BATCH_ROWS = 50_000
+DB_FETCH_ROWS = 10_000
+COPY_BUFFER_SIZE = 1 << 16
+
+# Colonnes chargees dans chaque table staging_raw (hors etl_run_id)
+STAGING_COLUMNS = {
+    "customers": ("staging_raw.customers_raw",
+        ["customer_id","customer_name","segment","city","state","region","email","created_at","updated_at"]),
+    "suppliers": ("staging_raw.suppliers_raw",
+        ["supplier_id","supplier_name","country","contact_email","contact_phone",
+         "rating","lead_time_days","payment_terms","active","created_at","updated_at"]),
+    "products": ("staging_raw.products_raw",
+        ["product_id","product_name","category","sub_category","unit_cost","unit_price",
+         "supplier_id","stock_quantity","reorder_level","reorder_quantity","warehouse_location",
+         "created_at","updated_at"]),
+    "orders": ("staging_raw.orders_raw",
+        ["order_id","customer_id","order_date","ship_date","current_status","ship_mode",
+         "country","city","state","postal_code","region","created_at","updated_at"]),
+    "order_lines": ("staging_raw.order_lines_raw",
+        ["row_id","order_id","product_id","quantity","discount","sales","unit_price","cost","profit",
+         "created_at","updated_at"]),
+    "order_status_history": ("staging_raw.order_status_history_raw",
+        ["id","order_id","status","status_date","updated_by","created_at"]),
+}
+
+# Cle naturelle de chaque entite pour les empreintes par ligne. L'id de
+# l'historique de statut est synthetique (positionnel) : on utilise le contenu.
+NATURAL_KEYS = {
+    "customers": ("customer_id",),
+    "suppliers": ("supplier_id",),
+    "products": ("product_id",),
+    "orders": ("order_id",),
+    "order_lines": ("row_id",),
+    "order_status_history": ("order_id", "status", "status_date"),
+}
+
+# Colonnes synthetiques exclues des empreintes et de l'upsert incremental du
+# transform (qui importe cette definition) : l'id de l'historique est
+# renumerote par l'API selon la position de la ligne dans la liste.
+SYNTHETIC_COLUMNS = {
+    "order_status_history": ("id",),
+}
+
+# Endpoints de liste acceptant le filtre incremental `updated_since`
+LIST_ENDPOINTS = {
+    "customers": "/api/v1/customers",
+    "suppliers": "/api/v1/suppliers",
+    "products": "/api/v1/catalog/products",
+    "orders": "/api/v1/sales/orders",
+}
 
 
 # ---------------------------------------------------------------------------
@@ -48,77 +129,816 @@ def get_dwh_conn():
 
 
 # ---------------------------------------------------------------------------
-# Helpers API REST
+# Metriques d'extraction
+# ---------------------------------------------------------------------------
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    """Percentile au rang le plus proche d'une liste triee."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, math.ceil(pct / 100 * len(values)) - 1))]
+
+
+class ExtractMetrics:
+    """Instrumentation d'un run d'extraction, partagee par les threads du client.
+
+    Par endpoint (query string retiree, id de commande generalise) : requetes,
+    erreurs, retries, pages, lignes, octets recus (sur le reseau et apres
+    decompression), latence totale et temps jusqu'aux en-tetes (le reste de la
+    latence est la lecture et le decodage JSON du corps). Par table
+    staging_raw : lignes, duree et debit du COPY. Le document est ecrit dans
+    BI/.etl_metrics.json, a cote de .orchestrator_state.json.
+    """
+
+    def __init__(self):
+        self.endpoints: Dict[str, Dict] = {}
+        self.phases: Dict[str, float] = {}
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def endpoint(path: str) -> str:
+        path = path.split("?", 1)[0]
+        orders = LIST_ENDPOINTS["orders"]
+        if path.startswith(orders + "/"):
+            return orders + "/:id"
+        return path
+
+    def _stats(self, path: str) -> Dict:
+        return self.endpoints.setdefault(self.endpoint(path), {
+            "requests": 0, "errors": 0, "retries": 0, "pages": 0, "rows": 0,
+            "bytes": 0, "bytes_decoded": 0, "latency": [], "ttfb": [],
+        })
+
+    def request(self, path: str, latency: float, ttfb: Optional[float], received: int,
+                decoded: int, ok: bool):
+        with self._lock:
+            stats = self._stats(path)
+            stats["requests"] += 1
+            stats["errors"] += 0 if ok else 1
+            stats["bytes"] += received
+            stats["bytes_decoded"] += decoded
+            stats["latency"].append(latency)
+            if ttfb is not None:
+                stats["ttfb"].append(ttfb)
+
+    def retry(self, path: str):
+        with self._lock:
+            self._stats(path)["retries"] += 1
+
+    def page(self, path: str, rows: int):
+        with self._lock:
+            stats = self._stats(path)
+            stats["pages"] += 1
+            stats["rows"] += rows
+
+    def phase(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @staticmethod
+    def _summary(values: List[float]) -> Dict[str, Optional[float]]:
+        values = sorted(values)
+        return {name: None if v is None else round(v * 1000, 1)
+                for name, v in (("p50", _percentile(values, 50)), ("p95", _percentile(values, 95)),
+                                ("p99", _percentile(values, 99)),
+                                ("max", values[-1] if values else None))}
+
+    def document(self, run_id: str, source: str, status: str,
+                 load_stats: Dict[str, List]) -> Dict:
+        with self._lock:
+            endpoints = {
+                name: {**{k: v for k, v in stats.items() if k not in ("latency", "ttfb")},
+                       "latency_ms": self._summary(stats["latency"]),
+                       "ttfb_ms": self._summary(stats["ttfb"])}
+                for name, stats in sorted(self.endpoints.items())
+            }
+        return {
+            "run_id": run_id,
+            "source": source,
+            "status": status,
+            "generated_at": datetime.now(timezone.utc).isoformat(),
+            "duration_s": round(time.perf_counter() - self._started, 3),
+            "phases_s": {k: round(v, 3) for k, v in self.phases.items()},
+            "endpoints": endpoints,
+            "staging": {
+                table: {"rows": rows, "seconds": round(seconds, 3),
+                        "rows_per_s": round(rows / seconds) if seconds > 0 else None}
+                for table, (rows, seconds) in load_stats.items()
+            },
+        }
+
+    def save(self, run_id: str, source: str, status: str, load_stats: Dict[str, List]):
+        METRICS_FILE.write_text(
+            json.dumps(self.document(run_id, source, status, load_stats), indent=2),
+            encoding="utf-8")
+
+
+# ---------------------------------------------------------------------------
+# Client API REST (gateway)
 # ---------------------------------------------------------------------------
 
-def api_request(method: str, path: str, token: Optional[str] = None,
-                payload: Optional[Dict] = None) -> Dict:
-    base_url = os.getenv("GATEWAY_BASE_URL", "http://localhost:4000").rstrip("/")
-    url = f"{base_url}{path}"
+class AdaptiveLimiter:
+    """Limiteur de concurrence AIMD partage par tous les threads du client.
+
+    Chaque requete reussie sous la latence cible augmente la limite d'environ
+    une unite par fenetre (+1/limite) ; une erreur (5xx, 429, timeout) ou une
+    latence excessive la divise par deux, au plus une fois par fenetre.
+    """
+
+    def __init__(self, max_limit: int, latency_target: float, min_limit: int = 1):
+        self.max_limit = max(max_limit, min_limit)
+        self.min_limit = min_limit
+        self.latency_target = latency_target
+        self.limit = float(self.max_limit)
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self._in_flight >= int(self.limit):
+                self._cond.wait()
+            self._in_flight += 1
+
+    def release(self, latency: float, ok: bool):
+        with self._cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if not ok or latency > self.latency_target:
+                if now - self._last_decrease >= self.latency_target:
+                    self.limit = max(float(self.min_limit), self.limit / 2)
+                    self._last_decrease = now
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+class ResponseCache:
+    """Cache local des reponses brutes de l'API (BI/.etl_cache/<run_id>/).
+
+    Chaque reponse GET est stockee compressee (gzip) sous l'empreinte SHA-256
+    de l'endpoint et de sa query string. `run.json` (parametres du run) n'est
+    ecrit qu'en fin d'extraction : seul un run complet peut etre rejoue.
+    En mode `offline`, les reponses sont lues dans le cache, sans reseau.
+    """
+
+    def __init__(self, run_id: str, offline: bool = False):
+        self.run_id = run_id
+        self.path = RESPONSE_CACHE_DIR / run_id
+        self.offline = offline
+        if not offline:
+            self.path.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def _runs() -> List[pathlib.Path]:
+        """Runs complets en cache, du plus ancien au plus recent."""
+        return sorted((p.parent for p in RESPONSE_CACHE_DIR.glob("*/run.json")),
+                      key=lambda p: (p / "run.json").stat().st_mtime)
+
+    @classmethod
+    def latest_run_id(cls) -> Optional[str]:
+        runs = cls._runs()
+        return runs[-1].name if runs else None
+
+    @classmethod
+    def prune(cls, keep: int, current: str):
+        """Ne conserve que les `keep` runs les plus recents (run courant inclus) ;
+        les extractions incompletes d'autres runs sont supprimees."""
+        runs = [p for p in cls._runs() if p.name != current]
+        stale = runs[:max(len(runs) - keep + 1, 0)]
+        if RESPONSE_CACHE_DIR.exists():
+            stale += [p for p in RESPONSE_CACHE_DIR.iterdir()
+                      if p.name != current and not (p / "run.json").exists()]
+        for old in stale:
+            shutil.rmtree(old, ignore_errors=True)
+
+    def _file(self, path: str) -> pathlib.Path:
+        return self.path / (hashlib.sha256(f"GET {path}".encode("utf-8")).hexdigest() + ".json.gz")
+
+    def chunks(self, path: str) -> Iterator[bytes]:
+        """Reponse en cache, decompressee par morceaux."""
+        try:
+            f = gzip.open(self._file(path), "rb")
+        except FileNotFoundError:
+            raise RuntimeError(f"Reponse absente du cache {self.run_id} : GET {path}") from None
+        with f:
+            yield from iter(lambda: f.read(COPY_BUFFER_SIZE), b"")
+
+    def put(self, path: str, raw: bytes):
+        with self.writer(path) as sink:
+            sink.reset()
+            sink.write(raw)
+            sink.commit()
+
+    def writer(self, path: str) -> "_CacheWriter":
+        """Ecriture d'une reponse au fil de sa reception (voir _iter_body)."""
+        target = self._file(path)
+        return _CacheWriter(target, target.with_name(f"{target.name}.{threading.get_ident()}.tmp"))
+
+    def settings(self) -> Optional[Dict]:
+        run_file = self.path / "run.json"
+        return json.loads(run_file.read_text(encoding="utf-8")) if run_file.exists() else None
+
+    def save_settings(self, settings: Dict):
+        (self.path / "run.json").write_text(json.dumps(settings, indent=2), encoding="utf-8")
+
+
+class _CacheWriter:
+    """Fichier de cache en cours d'ecriture : publie (os.replace) par
+    `commit`, supprime sinon."""
+
+    def __init__(self, target: pathlib.Path, tmp: pathlib.Path):
+        self.target = target
+        self.tmp = tmp
+        self._file = None
+
+    def reset(self):
+        """(Re)commence l'ecriture, par exemple apres une tentative echouee."""
+        self._close()
+        self._file = gzip.open(self.tmp, "wb", compresslevel=6)
+
+    def write(self, data: bytes):
+        self._file.write(data)
+
+    def commit(self):
+        if self._file is not None:
+            self._close()
+            os.replace(self.tmp, self.target)
+
+    def discard(self):
+        if self._file is not None:
+            self._close()
+            self.tmp.unlink(missing_ok=True)
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.discard()
+
+
+class GatewayClient:
+    """Client HTTP du gateway ERP.
+
+    - Pool de connexions keep-alive (http.client) partage entre threads :
+      une connexion TCP/TLS est reutilisee pour plusieurs requetes.
+    - Le token JWT est reutilise jusqu'a son expiration (claim `exp`),
+      puis renouvele ; un 401 declenche une re-authentification transparente.
+    - Les reponses sont demandees compressees (gzip) et decompressees a la
+      volee ; le JSON est analyse au fil de la lecture (_JsonStream).
+    - Les GET (idempotents) sont rejoues sur erreur reseau, corps tronque
+      (gzip ou JSON illisible), 5xx ou 429, avec backoff exponentiel a
+      jitter (ou le delai `Retry-After` du serveur).
+    - Le nombre de requetes simultanees est regule par un AdaptiveLimiter.
+    - Avec un ResponseCache, les reponses GET sont enregistrees, ou servies
+      depuis le cache en mode offline.
+    - Avec un ExtractMetrics, chaque requete, page et retry est mesure.
+    """
+
+    LOGIN_PATH = "/api/v1/auth/login"
+    TOKEN_EXPIRY_MARGIN = 60  # secondes
+    RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+    # Erreurs de transport ; un corps coupe en cours de lecture echoue au
+    # decodage gzip (zlib.error, EOFError) ou JSON (ValueError)
+    RETRYABLE_ERRORS = (OSError, HTTPException, ValueError, EOFError, zlib.error)
+    BACKOFF_BASE = 0.5  # secondes
+    BACKOFF_MAX = 30.0
+
+    def __init__(self, base_url: Optional[str] = None, username: Optional[str] = None,
+                 password: Optional[str] = None, pool_size: int = 8, timeout: float = 30,
+                 cache: Optional[ResponseCache] = None,
+                 metrics: Optional[ExtractMetrics] = None, max_retries: Optional[int] = None):
+        base_url = (base_url or os.getenv("GATEWAY_BASE_URL", "http://localhost:4000")).rstrip("/")
+        parsed = urlsplit(base_url)
+        self.scheme = parsed.scheme or "http"
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port
+        self.base_path = parsed.path.rstrip("/")
+        self.username = username or os.getenv("ETL_API_USERNAME")
+        self.password = password or os.getenv("ETL_API_PASSWORD")
+        self.timeout = timeout
+
+        self._pool: "queue.LifoQueue[HTTPConnection]" = queue.LifoQueue(maxsize=pool_size)
+        self._token: Optional[str] = None
+        self._token_exp: Optional[float] = None
+        self._auth_lock = threading.Lock()
+
+        # Mode de pagination utilise par endpoint ("keyset" ou "offset")
+        self.keyset = os.getenv("ETL_PAGINATION", "auto").lower() != "offset"
+        self.pagination_modes: Dict[str, str] = {}
+        # Pages demandees en parallele sur un endpoint pagine par offset
+        self.page_prefetch = int(os.getenv("ETL_PAGE_PREFETCH", "4"))
+
+        # Resilience : retries, backoff et limiteur de concurrence adaptatif
+        self.max_retries = (int(os.getenv("ETL_API_MAX_RETRIES", "4"))
+                            if max_retries is None else max_retries)
+        self.limiter = AdaptiveLimiter(
+            int(os.getenv("ETL_API_MAX_CONCURRENCY", "16")),
+            float(os.getenv("ETL_API_LATENCY_TARGET_MS", "2000")) / 1000,
+        )
+        self.retry_count = 0
+        self._stats_lock = threading.Lock()
+        self.cache = cache
+        self.metrics = metrics
+
+    # -- connexions -----------------------------------------------------
+
+    def _new_connection(self) -> HTTPConnection:
+        cls = HTTPSConnection if self.scheme == "https" else HTTPConnection
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def _acquire(self) -> Tuple[HTTPConnection, bool]:
+        """Retourne (connexion, reutilisee)."""
+        try:
+            return self._pool.get_nowait(), True
+        except queue.Empty:
+            return self._new_connection(), False
+
+    def _release(self, conn: HTTPConnection):
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # -- transport ------------------------------------------------------
+
+    def _send(self, method: str, path: str, body: Optional[bytes], headers: Dict[str, str],
+              sink: Optional[_CacheWriter] = None, meter: Optional[Dict] = None
+              ) -> Tuple[int, object, Optional[str]]:
+        url = f"{self.base_path}{path}"
+        conn, reused = self._acquire()
+        try:
+            try:
+                resp = self._roundtrip(conn, method, url, body, headers, sink, meter)
+            except (RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                if not reused:
+                    raise
+                # Connexion keep-alive fermee cote serveur : on retente une fois
+                conn.close()
+                conn = self._new_connection()
+                resp = self._roundtrip(conn, method, url, body, headers, sink, meter)
+        except BaseException:
+            conn.close()
+            raise
+        status, payload, will_close, retry_after = resp
+        if will_close:
+            conn.close()
+        else:
+            self._release(conn)
+        return status, payload, retry_after
+
+    @staticmethod
+    def _roundtrip(conn: HTTPConnection, method: str, url: str, body: Optional[bytes],
+                   headers: Dict[str, str], sink: Optional[_CacheWriter] = None,
+                   meter: Optional[Dict] = None) -> Tuple[int, object, bool, Optional[str]]:
+        """Retourne (status, payload, will_close, retry_after) : le JSON decode
+        pour une reponse 2xx, le corps brut sinon. `meter` recoit l'instant de
+        reception des en-tetes et les octets lus."""
+        conn.request(method, url, body=body, headers=headers)
+        resp = conn.getresponse()
+        if meter is not None:
+            meter["headers_at"] = time.monotonic()
+        if 200 <= resp.status < 300:
+            if sink is not None:
+                sink.reset()
+            payload = _JsonStream(_iter_body(resp, sink, meter)).parse()
+        else:
+            payload = b"".join(_iter_body(resp, meter=meter))
+        return resp.status, payload, resp.will_close, resp.getheader("retry-after")
+
+    def _limited_send(self, method: str, path: str, body: Optional[bytes], headers: Dict[str, str],
+                      sink: Optional[_CacheWriter] = None) -> Tuple[int, object, Optional[str]]:
+        self.limiter.acquire()
+        start = time.monotonic()
+        status = None
+        meter = {"received": 0, "decoded": 0}
+        try:
+            status, payload, retry_after = self._send(method, path, body, headers, sink, meter)
+            return status, payload, retry_after
+        finally:
+            latency = time.monotonic() - start
+            self.limiter.release(latency, status is not None
+                                 and status not in self.RETRYABLE_STATUSES)
+            if self.metrics is not None:
+                ttfb = meter["headers_at"] - start if "headers_at" in meter else None
+                self.metrics.request(path, latency, ttfb, meter["received"], meter["decoded"],
+                                     status is not None and status < 400)
+
+    def _backoff(self, attempt: int, retry_after: Optional[str], method: str, path: str, reason):
+        """Attend avant un nouvel essai : `Retry-After` si fourni, sinon backoff
+        exponentiel avec full jitter."""
+        delay = _parse_retry_after(retry_after)
+        if delay is None:
+            delay = random.uniform(0, min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2 ** attempt))
+        delay = min(delay, self.BACKOFF_MAX)
+        with self._stats_lock:
+            self.retry_count += 1
+        if self.metrics is not None:
+            self.metrics.retry(path)
+        print(f"[extract] Retry {attempt}/{self.max_retries} {method} {path} ({reason}) "
+              f"dans {delay:.1f}s")
+        time.sleep(delay)
+
+    def request(self, method: str, path: str, payload: Optional[Dict] = None,
+                auth: bool = True) -> Dict:
+        if self.cache is not None and method == "GET":
+            if self.cache.offline:
+                result = _JsonStream(self.cache.chunks(path)).parse()
+            else:
+                with self.cache.writer(path) as sink:
+                    result = self._request(method, path, payload, auth, sink)
+                    sink.commit()
+        else:
+            result = self._request(method, path, payload, auth)
+        if self.metrics is not None and isinstance(result, dict) and "items" in result:
+            self.metrics.page(path, len(result["items"]))
+        return result
+
+    def _request(self, method: str, path: str, payload: Optional[Dict], auth: bool,
+                 sink: Optional[_CacheWriter] = None) -> Dict:
+        headers = {"content-type": "application/json", "connection": "keep-alive",
+                   "accept-encoding": "gzip"}
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        # Seuls les GET sont idempotents et donc rejoues
+        retries = self.max_retries if method == "GET" else 0
+        attempt = 0
+        reauthenticated = False
+
+        while True:
+            if auth:
+                headers["authorization"] = f"Bearer {self.token()}"
+            try:
+                status, result, retry_after = self._limited_send(method, path, body, headers, sink)
+            except self.RETRYABLE_ERRORS as e:
+                if attempt < retries:
+                    attempt += 1
+                    self._backoff(attempt, None, method, path, e)
+                    continue
+                raise RuntimeError(f"API error on {path}: {e}") from e
+
+            if status == 401 and auth and not reauthenticated:
+                reauthenticated = True
+                self._invalidate_token(headers["authorization"][7:])
+                continue
+            if status in self.RETRYABLE_STATUSES and attempt < retries:
+                attempt += 1
+                self._backoff(attempt, retry_after, method, path, status)
+                continue
+            if status >= 400:
+                text = result.decode("utf-8", errors="replace")
+                raise RuntimeError(f"API {status} on {path}: {text}")
+            return result
+
+    # -- authentification -----------------------------------------------
+
+    def login(self) -> str:
+        """Authentification via le gateway - retourne un token JWT."""
+        if not self.username or not self.password:
+            raise RuntimeError("ETL_API_USERNAME / ETL_API_PASSWORD requis")
+
+        resp = self.request("POST", self.LOGIN_PATH, auth=False,
+                            payload={"username": self.username, "password": self.password})
+        token = resp.get("token")
+        if not token:
+            raise RuntimeError("Login OK mais pas de token dans la reponse")
+        self._token = token
+        self._token_exp = _jwt_expiry(token)
+        return token
+
+    def token(self) -> str:
+        """Token courant, renouvele s'il est absent ou proche de l'expiration."""
+        with self._auth_lock:
+            expired = (self._token_exp is not None
+                       and time.time() >= self._token_exp - self.TOKEN_EXPIRY_MARGIN)
+            if self._token is None or expired:
+                self.login()
+            return self._token
+
+    def _invalidate_token(self, rejected: str):
+        with self._auth_lock:
+            # Un autre thread a peut-etre deja renouvele le token
+            if self._token == rejected:
+                self._token = None
+
+    # -- endpoints --------------------------------------------------------
 
-    data = None
-    headers = {"content-type": "application/json"}
-    if token:
-        headers["authorization"] = f"Bearer {token}"
-    if payload is not None:
-        data = json.dumps(payload).encode("utf-8")
+    def get(self, path: str) -> Dict:
+        return self.request("GET", path)
 
-    req = Request(url=url, data=data, headers=headers, method=method)
+    def iter_pages(self, path: str, page_size: int = 200, params: Optional[Dict] = None,
+                   start_after: str = "", start_offset: int = 0) -> Iterator[List[Dict]]:
+        """Parcourt un endpoint pagine, une page (liste d'items) a la fois.
+
+        Pagination keyset (`after=<derniere cle>`) si l'endpoint la supporte
+        (sa reponse contient `pagination.next_cursor`), sinon limit/offset.
+        Le mode retenu est memorise par endpoint dans `pagination_modes`.
+        En mode offset, les pages suivant la premiere sont demandees par
+        fenetres de `page_prefetch` requetes paralleles.
+        `start_after` / `start_offset` permettent de reprendre en cours de route.
+        """
+        mode = self.pagination_modes.get(path)
+        if mode is None and not self.keyset:
+            mode = self.pagination_modes[path] = "offset"
+        cursor, offset = start_after, start_offset
+        while True:
+            paging = {"offset": offset} if mode == "offset" else {"after": cursor}
+            qs = urlencode({**(params or {}), "limit": page_size, **paging})
+            resp = self.get(f"{path}?{qs}")
+            batch = resp.get("items", [])
+            pagination = resp.get("pagination") or {}
+            if mode is None:
+                # Un endpoint sans keyset ignore `after` et renvoie la premiere page
+                mode = "keyset" if "next_cursor" in pagination else "offset"
+                self.pagination_modes[path] = mode
+            if not batch:
+                break
+            yield batch
+            if len(batch) < page_size:
+                break
+            if mode == "keyset":
+                cursor = pagination.get("next_cursor")
+                if not cursor:
+                    break
+            offset += len(batch)
+            if mode == "offset" and self.page_prefetch > 1:
+                yield from self._iter_offset_parallel(path, page_size, params, offset)
+                return
+
+    def _iter_offset_parallel(self, path: str, page_size: int, params: Optional[Dict],
+                              offset: int) -> Iterator[List[Dict]]:
+        """Pages limit/offset en parallele (fenetre glissante), restituees dans
+        l'ordre ; s'arrete a la premiere page courte ou vide. Les requetes deja
+        lancees au-dela de la fin sont simplement ignorees."""
+        def _get_page(page_offset: int) -> List[Dict]:
+            qs = urlencode({**(params or {}), "limit": page_size, "offset": page_offset})
+            return self.get(f"{path}?{qs}").get("items", [])
+
+        with ThreadPoolExecutor(max_workers=self.page_prefetch) as pool:
+            window = deque()
+            for _ in range(self.page_prefetch):
+                window.append(pool.submit(_get_page, offset))
+                offset += page_size
+            try:
+                while window:
+                    batch = window.popleft().result()
+                    if not batch:
+                        break
+                    yield batch
+                    if len(batch) < page_size:
+                        break
+                    window.append(pool.submit(_get_page, offset))
+                    offset += page_size
+            finally:
+                for future in window:
+                    future.cancel()
+
+    def fetch_paginated(self, path: str, page_size: int = 200,
+                        params: Optional[Dict] = None) -> List[Dict]:
+        """Recupere toutes les pages d'un endpoint pagine."""
+        items: List[Dict] = []
+        for batch in self.iter_pages(path, page_size, params):
+            items.extend(batch)
+        return items
+
+    def fetch_order_details(self, order_ids: List[str], concurrency: int = 8) -> List[Dict]:
+        """Recupere le detail de chaque commande en parallele (pool de threads).
+
+        L'ordre du resultat suit celui de `order_ids`, quel que soit l'ordre de
+        completion des requetes, pour garder des checksums et des ids stables.
+        """
+        def _get(oid: str) -> Dict:
+            return self.get(f"/api/v1/sales/orders/{oid}")
+
+        if concurrency <= 1:
+            return [_get(oid) for oid in order_ids]
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return list(pool.map(_get, order_ids))
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """En-tete `Retry-After` : nombre de secondes ou date HTTP."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def _iter_body(resp, sink: Optional[_CacheWriter] = None,
+               meter: Optional[Dict] = None) -> Iterator[bytes]:
+    """Corps de la reponse par morceaux, decompresse a la volee si gzip ;
+    chaque morceau decompresse est aussi ecrit dans `sink` (cache) et compte
+    dans `meter` (octets recus / decompresses)."""
+    gzipped = (resp.getheader("content-encoding") or "").lower() == "gzip"
+    decoder = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+    pending = True
+    while pending:
+        chunk = resp.read(COPY_BUFFER_SIZE)
+        pending = bool(chunk)
+        if meter is not None:
+            meter["received"] += len(chunk)
+        if decoder is not None:
+            chunk = decoder.decompress(chunk) if pending else decoder.flush()
+            if not pending and not decoder.eof:
+                raise EOFError("corps gzip tronque")
+        if chunk:
+            if meter is not None:
+                meter["decoded"] += len(chunk)
+            if sink is not None:
+                sink.write(chunk)
+            yield chunk
+
+
+class _JsonStream:
+    """Analyse incrementale d'un objet JSON recu par morceaux.
+
+    Les elements du tableau `items` sont decodes un par un des qu'ils sont
+    complets (a la maniere d'ijson) : ni le corps brut ni le texte complet
+    d'une page ne sont conserves en memoire, seulement les lignes decodees.
+    """
+
+    _WHITESPACE = " \t\n\r"
+    _DELIMITERS = _WHITESPACE + ",:]}"
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._decoder = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def parse(self):
+        """Valeur JSON complete (`{}` pour un corps vide)."""
+        first = self._peek()
+        if first == "{":
+            value = self._parse_object()
+        elif first == "":
+            value = {}
+        else:
+            value = self._value()
+        if self._peek() != "":
+            raise ValueError("JSON invalide : donnees apres la valeur")
+        return value
+
+    def iter_items(self) -> Iterator:
+        """Elements d'un tableau JSON, un a la fois."""
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self._value()
+            sep = self._peek()
+            self._pos += 1
+            if sep == "]":
+                return
+            if sep != ",":
+                raise ValueError("JSON invalide : ',' ou ']' attendu")
+
+    def _parse_object(self) -> Dict:
+        self._expect("{")
+        result = {}
+        while self._peek() != "}":
+            if result:
+                self._expect(",")
+            key = self._value()
+            self._expect(":")
+            if key == "items" and self._peek() == "[":
+                result[key] = list(self.iter_items())
+            else:
+                result[key] = self._value()
+        self._pos += 1
+        return result
+
+    def _fill(self) -> bool:
+        """Ajoute le morceau suivant au tampon ; False en fin de flux."""
+        if self._eof:
+            return False
+        chunk = next(self._chunks, None)
+        self._eof = chunk is None
+        text = self._utf8.decode(chunk or b"", final=self._eof)
+        self._buf = self._buf[self._pos:] + text
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        """Prochain caractere significatif ('' en fin de flux)."""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in self._WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, char: str):
+        if self._peek() != char:
+            raise ValueError(f"JSON invalide : '{char}' attendu")
+        self._pos += 1
+
+    def _value(self):
+        """Decode la valeur suivante, en lisant la suite du flux si elle est incomplete."""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+                # Un nombre coupe en fin de tampon ("3." -> 3) se decode sans erreur :
+                # la valeur n'est complete que si un separateur la suit
+                if self._eof or (end < len(self._buf) and self._buf[end] in self._DELIMITERS):
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill()
+
+
+def _jwt_expiry(token: str) -> Optional[float]:
+    """Lit le claim `exp` du JWT (sans verifier la signature)."""
     try:
-        with urlopen(req, timeout=30) as resp:
-            raw = resp.read().decode("utf-8")
-            return json.loads(raw) if raw else {}
-    except HTTPError as e:
-        body = e.read().decode("utf-8", errors="replace")
-        raise RuntimeError(f"API {e.code} on {path}: {body}") from e
-    except URLError as e:
-        raise RuntimeError(f"API error on {path}: {e}") from e
-
-
-def api_login() -> str:
-    """Authentification via le gateway - retourne un token JWT."""
-    username = os.getenv("ETL_API_USERNAME")
-    password = os.getenv("ETL_API_PASSWORD")
-    if not username or not password:
-        raise RuntimeError("ETL_API_USERNAME / ETL_API_PASSWORD requis")
-
-    resp = api_request("POST", "/api/v1/auth/login",
-                       payload={"username": username, "password": password})
-    token = resp.get("token")
-    if not token:
-        raise RuntimeError("Login OK mais pas de token dans la reponse")
-    return token
-
-
-def fetch_paginated(token: str, path: str, page_size: int = 200) -> List[Dict]:
-    """Recupere toutes les pages d'un endpoint pagine."""
-    offset = 0
-    items: List[Dict] = []
-    while True:
-        qs = urlencode({"limit": page_size, "offset": offset})
-        resp = api_request("GET", f"{path}?{qs}", token=token)
-        batch = resp.get("items", [])
-        if not batch:
-            break
-        items.extend(batch)
-        if len(batch) < page_size:
-            break
-        offset += page_size
-    return items
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get("exp")
+        return float(exp) if exp is not None else None
+    except (IndexError, ValueError, TypeError):
+        return None
 
 
 # ---------------------------------------------------------------------------
 # Insertion staging_raw
 # ---------------------------------------------------------------------------
 
-def insert_rows(cur, table: str, rows: List[Dict], cols: List[str], run_id: str) -> int:
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def _copy_value(value) -> str:
+    """Encode une valeur au format texte de COPY (NULL = \\N)."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (int, float, Decimal)):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, default=str)
+    return str(value).translate(_COPY_ESCAPES)
+
+
+class _CopyStream:
+    """Fichier en lecture seule produisant les lignes COPY a la demande,
+    pour que `copy_expert` ne materialise jamais tout le lot en memoire."""
+
+    def __init__(self, rows: Iterable[Dict], cols: List[str], run_id: Optional[str] = None):
+        extra = [] if run_id is None else [_copy_value(run_id)]
+        self._lines = ("\t".join([_copy_value(row.get(c)) for c in cols] + extra) + "\n"
+                       for row in rows)
+        self._buffer = ""
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self._buffer += line
+        if size < 0:
+            size = len(self._buffer)
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+
+def copy_rows(cur, table: str, rows: List[Dict], cols: List[str], run_id: str) -> int:
+    """Chargement en masse via `COPY ... FROM STDIN` (un aller-retour par lot)."""
     if not rows:
         return 0
-    placeholders = ",".join(["%s"] * (len(cols) + 1))
     col_list = ",".join(cols + ["etl_run_id"])
-    sql = f"INSERT INTO {table} ({col_list}) VALUES ({placeholders})"
-    for row in rows:
-        cur.execute(sql, tuple(row.get(c) for c in cols) + (run_id,))
+    cur.copy_expert(f"COPY {table} ({col_list}) FROM STDIN", _CopyStream(rows, cols, run_id),
+                    size=COPY_BUFFER_SIZE)
     return len(rows)
 
 
@@ -130,34 +950,271 @@ def insert_rows(cur, table: str, rows: List[Dict], cols: List[str], run_id: str)
 # Change detection (checksums)
 # ---------------------------------------------------------------------------
 
+# Empreinte de ligne : blake2b 128 bits sur une forme canonique (cles triees,
+# tuple des valeurs encode par `repr()`, type compris : None n'est pas 'None'
+# ni 1 '1') ; l'empreinte d'une entite est la somme modulo
+# 2^128 des empreintes de ses lignes, donc independante de l'ordre et des pages.
+CHECKSUM_VERSION = 3
+CHECKSUM_ALGORITHM = "blake2b-128-sum"
+_DIGEST_MOD = 1 << 128
+_ROW_LAYOUTS: Dict[Tuple[str, ...], Tuple] = {}
+
+
+def _row_layout(row: Dict) -> Tuple:
+    """(getter des valeurs en ordre de cles trie, prefixe des noms de cles), en cache par jeu de cles."""
+    columns = tuple(row)
+    layout = _ROW_LAYOUTS.get(columns)
+    if layout is None:
+        keys = sorted(columns)
+        if len(keys) == 1:
+            getter = lambda r, k=keys[0]: (r[k],)
+        else:
+            getter = itemgetter(*keys)
+        layout = _ROW_LAYOUTS[columns] = (getter, "\x1f".join(keys) + "\x1d")
+    return layout
+
+
+def row_hash(row: Dict) -> bytes:
+    """Empreinte blake2b (16 octets) d'une ligne, independante de l'ordre des cles."""
+    getter, prefix = _row_layout(row)
+    canonical = prefix + repr(getter(row))
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).digest()
+
+
+class EntityTracker:
+    """Suivi incremental d'une entite extraite, page apres page.
+
+    Chaque ligne est hachee une seule fois (`row_hash`) ; le checksum de
+    l'entite est la somme de ces empreintes. Il ne depend ni de l'ordre des
+    lignes ni du decoupage en pages. Le hachage reste sur le thread
+    consommateur (environ 3 us par ligne, negligeable devant l'extraction).
+    Le tracker suit aussi le nombre
+    de lignes, le `updated_at` max et, si `key_cols` est fourni, l'empreinte
+    (cle naturelle -> hex) de chaque ligne. Ces empreintes sont ecrites au
+    format COPY dans un fichier temporaire (`fingerprints`), pas gardees en
+    memoire : elles sont O(lignes), lignes de commande comprises. Les colonnes
+    `synthetic_cols` ne participent pas aux empreintes.
+    """
+
+    def __init__(self, since: Optional[str] = None, key_cols: Optional[Tuple[str, ...]] = None):
+        self.since = since
+        self.count = 0
+        self.max_updated_at = since
+        self.has_newer = False
+        self.at_boundary = False
+        self.key_cols = key_cols
+        self.synthetic_cols: Tuple[str, ...] = ()
+        self.fingerprints = None
+        self._digest = 0
+
+    def update(self, rows: List[Dict]):
+        digest = 0
+        lines = []
+        for row in rows:
+            if self.synthetic_cols:
+                h = row_hash({k: v for k, v in row.items() if k not in self.synthetic_cols})
+            else:
+                h = row_hash(row)
+            digest += int.from_bytes(h, "big")
+            if self.key_cols:
+                key = "|".join(str(row.get(c)) for c in self.key_cols)
+                lines.append(f"{_copy_value(key)}\t{h.hex()}\n")
+
+            updated_at = row.get("updated_at")
+            if updated_at:
+                updated_at = str(updated_at)
+                if self.max_updated_at is None or updated_at > self.max_updated_at:
+                    self.max_updated_at = updated_at
+            # Le filtre `updated_since` est inclusif (>=) : les lignes a la borne
+            # exacte reviennent a chaque run. Elles ne comptent comme changement
+            # que si leur empreinte differe de row_fingerprint (modification dans
+            # la meme milliseconde que le watermark), voir _detect_changes.
+            if not self.since or not updated_at or updated_at > self.since:
+                self.has_newer = True
+            elif updated_at == self.since:
+                self.at_boundary = True
+        if lines:
+            if self.fingerprints is None:
+                self.fingerprints = tempfile.TemporaryFile("w+", encoding="utf-8", newline="")
+            self.fingerprints.writelines(lines)
+        self._digest = (self._digest + digest) % _DIGEST_MOD
+        self.count += len(rows)
+
+    def close(self):
+        if self.fingerprints is not None:
+            self.fingerprints.close()
+            self.fingerprints = None
+
+    def hexdigest(self) -> str:
+        return f"{self._digest:032x}"
+
+
 def _compute_checksum(data: List[Dict]) -> str:
-    """Calcule un hash MD5 stable d'une liste de dicts (tri par cles + valeurs)."""
-    canonical = json.dumps(data, sort_keys=True, default=str)
-    return hashlib.md5(canonical.encode("utf-8")).hexdigest()
+    """Calcule l'empreinte d'une liste de dicts, independante de l'ordre des lignes."""
+    tracker = EntityTracker()
+    tracker.update(data)
+    return tracker.hexdigest()
+
+
+def _load_checksums(engine: str = "sql") -> Dict[str, str]:
+    """Checksums du dernier run ; un fichier d'un autre format est ignore (tout a change).
 
+    Ceux d'un run de l'autre moteur de transform aussi : le moteur memoire
+    n'alimente pas staging_raw, et le moteur SQL ne laisse pas de lignes
+    extraites au moteur memoire.
+    """
+    if not CHECKSUM_FILE.exists():
+        return {}
+    stored = json.loads(CHECKSUM_FILE.read_text(encoding="utf-8"))
+    if stored.get("version") != CHECKSUM_VERSION or stored.get("algorithm") != CHECKSUM_ALGORITHM:
+        print(f"[extract] {CHECKSUM_FILE.name} : format anterieur, checksums ignores pour ce run")
+        return {}
+    if stored.get("engine", "sql") != engine:
+        print(f"[extract] {CHECKSUM_FILE.name} : run du moteur {stored.get('engine', 'sql')}, "
+              "checksums ignores pour ce run")
+        return {}
+    return {entity: state["digest"] for entity, state in stored["entities"].items()}
+
+
+def _save_checksums(trackers: Dict[str, EntityTracker], engine: str = "sql"):
+    CHECKSUM_FILE.write_text(json.dumps({
+        "version": CHECKSUM_VERSION,
+        "algorithm": CHECKSUM_ALGORITHM,
+        "engine": engine,
+        "entities": {k: {"rows": trackers[k].count, "digest": trackers[k].hexdigest()}
+                     for k in ENTITIES},
+    }, indent=2), encoding="utf-8")
 
-def _load_checksums() -> Dict[str, str]:
-    if CHECKSUM_FILE.exists():
-        return json.loads(CHECKSUM_FILE.read_text(encoding="utf-8"))
+
+# ---------------------------------------------------------------------------
+# Extraction incrementale (high-water marks)
+# ---------------------------------------------------------------------------
+
+def _load_watermarks() -> Dict:
+    if WATERMARK_FILE.exists():
+        return json.loads(WATERMARK_FILE.read_text(encoding="utf-8"))
     return {}
 
 
-def _save_checksums(checksums: Dict[str, str]):
-    CHECKSUM_FILE.write_text(json.dumps(checksums, indent=2), encoding="utf-8")
+def _save_watermarks(watermarks: Dict):
+    WATERMARK_FILE.write_text(json.dumps(watermarks, indent=2), encoding="utf-8")
+
+
+def _invalidate_change_state():
+    """Efface checksums et watermarks : le run suivant fait une extraction
+    complete et recharge tout (staging_raw ne reflete plus l'etat live)."""
+    CHECKSUM_FILE.unlink(missing_ok=True)
+    WATERMARK_FILE.unlink(missing_ok=True)
+
+
+class OrderDetailCache:
+    """Cache persistant du detail des commandes (lignes + historique de statut).
+
+    Indexe par order_id et `updated_at` du resume de la commande : cote ERP,
+    toute modification d'une commande (statut compris) met a jour son
+    `updated_at`, le detail n'est donc re-telecharge que pour les commandes
+    nouvelles ou modifiees.
+
+    Stocke dans une base SQLite (cle primaire order_id) : chaque commande est
+    lue ou upsertee a la demande, le cache n'est jamais charge en memoire ni
+    reecrit en entier. Les commandes vues pendant le run sont marquees du
+    jeton du run, pour retirer les autres a la fin d'une extraction complete.
+    """
+
+    def __init__(self, path: pathlib.Path = ORDER_DETAIL_CACHE_FILE):
+        self.path = path
+        self.conn: Optional[sqlite3.Connection] = None
+        self.token = f"{os.getpid()}:{time.time_ns()}"
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def open(self, reset: bool = False) -> "OrderDetailCache":
+        """Ouvre la base ; `reset` (--full) vide le cache. Les ecritures ne
+        sont validees que par `save`, a la fin d'une extraction reussie."""
+        LEGACY_ORDER_DETAIL_CACHE_FILE.unlink(missing_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS order_detail (
+                order_id TEXT PRIMARY KEY,
+                updated_at TEXT NOT NULL,
+                detail BLOB NOT NULL,
+                seen_run TEXT NOT NULL
+            )
+        """)
+        self.conn.commit()
+        if reset:
+            self.conn.execute("DELETE FROM order_detail")
+        return self
+
+    def get(self, order_id: str, updated_at: Optional[str]) -> Optional[Dict]:
+        with self._lock:
+            self.conn.execute("UPDATE order_detail SET seen_run = ? WHERE order_id = ?",
+                              (self.token, order_id))
+            row = self.conn.execute("SELECT updated_at, detail FROM order_detail "
+                                    "WHERE order_id = ?", (order_id,)).fetchone()
+        if updated_at and row and row[0] == updated_at:
+            self.hits += 1
+            return json.loads(zlib.decompress(row[1]))
+        self.misses += 1
+        return None
+
+    def put(self, order_id: str, updated_at: Optional[str], detail: Dict):
+        if not updated_at:
+            return
+        blob = zlib.compress(json.dumps(detail, default=str).encode("utf-8"))
+        with self._lock:
+            self.conn.execute("""
+                INSERT INTO order_detail (order_id, updated_at, detail, seen_run)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (order_id) DO UPDATE SET
+                    updated_at = excluded.updated_at,
+                    detail = excluded.detail,
+                    seen_run = excluded.seen_run
+            """, (order_id, updated_at, blob, self.token))
+
+    def save(self, prune: bool):
+        """Valide les ecritures du run ; `prune` (extraction complete) retire
+        les commandes absentes de la liste, supprimees cote ERP."""
+        with self._lock:
+            if prune:
+                self.conn.execute("DELETE FROM order_detail WHERE seen_run <> ?", (self.token,))
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
+    def close(self):
+        """Ferme la base sans valider (extraction en echec) : le lot en cours
+        est annule. Sans effet apres `save`."""
+        with self._lock:
+            if self.conn is not None:
+                self.conn.rollback()
+                self.conn.close()
+                self.conn = None
+
+
+def _reconciliation_due(watermarks: Dict) -> bool:
+    """Une extraction complete est requise periodiquement pour capter les suppressions."""
+    last_full = watermarks.get("last_full_run_at")
+    if not last_full or not watermarks.get("entities"):
+        return True
+    max_age = timedelta(days=float(os.getenv("ETL_FULL_RECONCILE_DAYS", "7")))
+    return datetime.now(timezone.utc) - datetime.fromisoformat(last_full) >= max_age
 
 
 # ---------------------------------------------------------------------------
 # Main
 # ---------------------------------------------------------------------------
 
-def _notify_orchestrator(data_changed: bool, counts: Dict):
+def _notify_orchestrator(data_changed: bool, counts: Dict, details: Optional[Dict] = None):
     """Notifie l'orchestrateur des changements de données"""
     try:
         state = {
             "timestamp": os.getenv("ETL_RUN_ID", "manual"),
             "data_changed": data_changed,
             "counts": counts,
-            "last_run": pathlib.Path(__file__).resolve().parent.parent.name
+            "last_run": pathlib.Path(__file__).resolve().parent.parent.name,
+            **(details or {}),
         }
         
         # Écrire l'état pour l'orchestrateur
@@ -173,119 +1230,1301 @@ def _notify_orchestrator(data_changed: bool, counts: Dict):
         print(f"[extract] Erreur notification orchestrateur: {e}")
 
 
-def run(run_id: str) -> Tuple[Dict[str, int], bool]:
-    """Extrait les donnees API et les charge dans staging_raw.
+# ---------------------------------------------------------------------------
+# Extraction (generateur de pages) et chargement staging_raw
+# ---------------------------------------------------------------------------
+
+ENTITIES = list(STAGING_COLUMNS)
+
+# Cle naturelle utilisee pour remplacer les versions precedentes (mode incremental).
+# Lignes et historique sont re-extraits en entier pour chaque commande modifiee :
+# ils sont supprimes avec la commande.
+DELTA_KEYS = {
+    "customers": ("customer_id", ["customers"]),
+    "suppliers": ("supplier_id", ["suppliers"]),
+    "products": ("product_id", ["products"]),
+    "orders": ("order_id", ["orders", "order_lines", "order_status_history"]),
+}
+
+
+# Listes extraites avant les commandes, dans l'ordre de _iter_extract
+CHECKPOINT_LISTS = ("customers", "suppliers", "products")
+
+
+class ExtractCheckpoint:
+    """Points de reprise d'une extraction (BI/.etl_checkpoints/<run_id>/).
+
+    Chaque page extraite est ecrite dans un segment NDJSON compresse (gzip).
+    Le manifeste (`manifest.json`, remplace atomiquement) ne reference que
+    les segments de blocs termines : une liste complete (clients,
+    fournisseurs, produits) ou une page de commandes avec ses details. Il
+    memorise aussi la position de reprise dans la liste des commandes.
+    Au chargement, l'empreinte SHA-256 et le nombre de lignes de chaque
+    segment sont verifies ; un point de reprise invalide est ignore.
+    """
+
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        self.path = CHECKPOINT_DIR / run_id
+        self.manifest: Dict = {}
+        self._pending: List[Dict] = []
+        self._current: Optional[str] = None
+        self._summaries: List[Dict] = []
+
+    @staticmethod
+    def latest_run_id() -> Optional[str]:
+        """Run id du point de reprise le plus recent, s'il en existe un."""
+        manifests = sorted(CHECKPOINT_DIR.glob("*/manifest.json"),
+                           key=lambda p: p.stat().st_mtime)
+        return manifests[-1].parent.name if manifests else None
+
+    def start(self, settings: Dict):
+        """Demarre un nouveau point de reprise (supprime ceux des autres runs)."""
+        if CHECKPOINT_DIR.exists():
+            shutil.rmtree(CHECKPOINT_DIR)
+        self.path.mkdir(parents=True)
+        self.manifest = {
+            "run_id": self.run_id,
+            "settings": settings,
+            "segments": [],
+            "completed": [],
+            "order_summaries_done": 0,
+            "last_order_id": None,
+            "next_synth_id": 1,
+            "pagination_modes": {},
+        }
+        self._save()
+
+    def load(self) -> bool:
+        """Charge et verifie le point de reprise du run. False si absent ou invalide."""
+        manifest_path = self.path / "manifest.json"
+        if not manifest_path.exists():
+            return False
+        try:
+            manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+            for segment in manifest["segments"]:
+                raw = (self.path / segment["file"]).read_bytes()
+                if hashlib.sha256(raw).hexdigest() != segment["sha256"]:
+                    raise ValueError(f"empreinte invalide : {segment['file']}")
+                if gzip.decompress(raw).count(b"\n") != segment["rows"]:
+                    raise ValueError(f"nombre de lignes invalide : {segment['file']}")
+        except (OSError, ValueError, KeyError, EOFError) as e:
+            print(f"[extract] Point de reprise {self.run_id} ignore ({e})")
+            return False
+        self.manifest = manifest
+        # Segments ecrits apres le dernier bloc termine : inutilisables
+        referenced = {s["file"] for s in manifest["segments"]} | {"manifest.json"}
+        for orphan in self.path.iterdir():
+            if orphan.name not in referenced:
+                orphan.unlink()
+        return True
+
+    def resume_state(self) -> Dict:
+        """Position de reprise, au format attendu par _iter_extract."""
+        m = self.manifest
+        keyset = m["pagination_modes"].get(LIST_ENDPOINTS["orders"]) == "keyset"
+        return {
+            "completed": m["completed"],
+            "order_summaries_done": m["order_summaries_done"],
+            "last_order_id": m["last_order_id"] if keyset else None,
+            "next_synth_id": m["next_synth_id"],
+        }
+
+    def replay(self) -> Iterator[Tuple[str, List[Dict]]]:
+        """Relit les pages deja extraites, dans l'ordre d'origine."""
+        for segment in self.manifest["segments"]:
+            with gzip.open(self.path / segment["file"], "rt", encoding="utf-8") as f:
+                yield segment["entity"], [json.loads(line) for line in f]
+
+    def track(self, stream: Iterable[Tuple[str, List[Dict]]],
+              pagination_modes: Dict[str, str]) -> Iterator[Tuple[str, List[Dict]]]:
+        """Enregistre chaque page du flux avant de la transmettre."""
+        for entity, batch in stream:
+            if entity != self._current:
+                if self._current in CHECKPOINT_LISTS:
+                    self.manifest["completed"].append(self._current)
+                    self._commit(pagination_modes)
+                self._current = entity
+            if batch:
+                self._write_segment(entity, batch)
+            if entity == "order_summaries":
+                self._summaries = batch
+            elif entity == "order_status_history":
+                # Fin d'une page de commandes (resume, commandes, lignes, historique)
+                m = self.manifest
+                m["order_summaries_done"] += len(self._summaries)
+                if self._summaries:
+                    m["last_order_id"] = self._summaries[-1].get("order_id")
+                m["next_synth_id"] += len(batch)
+                self._commit(pagination_modes)
+            yield entity, batch
+
+    def discard(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _write_segment(self, entity: str, batch: List[Dict]):
+        seq = len(self.manifest["segments"]) + len(self._pending)
+        name = f"{seq:06d}_{entity}.ndjson.gz"
+        payload = "".join(json.dumps(row, default=str) + "\n" for row in batch)
+        raw = gzip.compress(payload.encode("utf-8"))
+        (self.path / name).write_bytes(raw)
+        self._pending.append({"file": name, "entity": entity, "rows": len(batch),
+                              "sha256": hashlib.sha256(raw).hexdigest()})
+
+    def _commit(self, pagination_modes: Dict[str, str]):
+        self.manifest["segments"].extend(self._pending)
+        self.manifest["pagination_modes"] = dict(pagination_modes)
+        self._pending = []
+        self._save()
+
+    def _save(self):
+        tmp = self.path / "manifest.json.tmp"
+        tmp.write_text(json.dumps(self.manifest, indent=2), encoding="utf-8")
+        os.replace(tmp, self.path / "manifest.json")
+
+
+class BackgroundPages:
+    """Iterateur de pages alimente par un thread dedie.
+
+    Les pages sont bufferisees dans une file bornee (`depth` pages) : le
+    producteur se bloque quand le consommateur est en retard, la memoire
+    reste donc bornee. Une exception du producteur est relancee cote
+    consommateur.
+    """
+
+    _DONE = object()
+
+    def __init__(self, pages: Iterator[List[Dict]], depth: int = 4):
+        self._queue: queue.Queue = queue.Queue(maxsize=max(depth, 1))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._produce, args=(pages,), daemon=True)
+        self._thread.start()
+
+    def _produce(self, pages: Iterator[List[Dict]]):
+        try:
+            for page in pages:
+                if not self._put(page):
+                    return
+            self._put(self._DONE)
+        except BaseException as e:
+            self._put(e)
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __iter__(self) -> Iterator[List[Dict]]:
+        while True:
+            item = self._queue.get()
+            if item is self._DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    def close(self):
+        self._stop.set()
+
+
+def _iter_extract(client: GatewayClient, since: Dict[str, str], page_size: int,
+                  detail_concurrency: int, resume: Optional[Dict] = None,
+                  detail_cache: Optional[OrderDetailCache] = None
+                  ) -> Iterator[Tuple[str, List[Dict]]]:
+    """Produit les lignes extraites sous forme de (entite, page).
+
+    Les quatre listes (clients, fournisseurs, produits, commandes) sont
+    parcourues en parallele, chacune dans son thread, puis restituees dans
+    un ordre fixe. Les details commande sont recuperes page de commandes
+    par page de commandes : la memoire reste bornee par quelques pages. Les
+    ids synthetiques de l'historique suivent l'ordre de la liste des
+    commandes. L'entite `order_summaries` (liste des commandes) sert au
+    suivi des watermarks et n'est pas chargee.
+
+    `resume` (voir ExtractCheckpoint.resume_state) indique les listes deja
+    extraites et la position de reprise dans la liste des commandes.
+    Avec `detail_cache`, seul le detail des commandes nouvelles ou modifiees
+    est demande a l'API.
+    """
+    resume = resume or {}
+    completed = set(resume.get("completed", []))
+
+    def _params(entity: str) -> Dict:
+        return {"updated_since": since[entity]} if since.get(entity) else {}
+
+    def _suppliers() -> Iterator[List[Dict]]:
+        qs = urlencode(_params("suppliers"))
+        yield client.get(LIST_ENDPOINTS["suppliers"] + (f"?{qs}" if qs else "")).get("items", [])
+
+    def _pages(entity: str) -> Iterator[List[Dict]]:
+        if entity == "suppliers":
+            return _suppliers()
+        if entity == "orders":
+            return client.iter_pages(LIST_ENDPOINTS["orders"], page_size, _params("orders"),
+                                     start_after=resume.get("last_order_id") or "",
+                                     start_offset=resume.get("order_summaries_done", 0))
+        return client.iter_pages(LIST_ENDPOINTS[entity], page_size, _params(entity))
+
+    depth = max(client.page_prefetch, 1)
+    sources = {entity: BackgroundPages(_pages(entity), depth)
+               for entity in LIST_ENDPOINTS if entity not in completed}
+    try:
+        print("[extract] Fetching customers, suppliers, products...")
+        for entity in ("customers", "suppliers", "products"):
+            for batch in sources.get(entity, ()):
+                yield entity, batch
+
+        print("[extract] Fetching orders + details (lines, status history)...")
+        yield from _iter_orders(client, sources["orders"], detail_concurrency,
+                                resume.get("next_synth_id", 1), detail_cache)
+    finally:
+        for source in sources.values():
+            source.close()
+
+
+def _iter_orders(client: GatewayClient, summary_pages: Iterable[List[Dict]],
+                 detail_concurrency: int, first_synth_id: int = 1,
+                 detail_cache: Optional[OrderDetailCache] = None
+                 ) -> Iterator[Tuple[str, List[Dict]]]:
+    synth_id = first_synth_id
+    for summaries in summary_pages:
+        yield "order_summaries", summaries
+
+        versions = {s["order_id"]: s.get("updated_at") for s in summaries if s.get("order_id")}
+        order_ids = list(versions)
+        if detail_cache is None:
+            details = client.fetch_order_details(order_ids, detail_concurrency)
+        else:
+            cached = {oid: detail_cache.get(oid, versions[oid]) for oid in order_ids}
+            if client.cache is not None and not client.cache.offline:
+                # Le replay hors ligne doit retrouver le detail de toutes les commandes
+                for oid, detail in cached.items():
+                    if detail is not None:
+                        client.cache.put(f"/api/v1/sales/orders/{oid}",
+                                         json.dumps(detail, default=str).encode("utf-8"))
+            missing = [oid for oid in order_ids if cached[oid] is None]
+            for oid, detail in zip(missing, client.fetch_order_details(missing, detail_concurrency)):
+                detail_cache.put(oid, versions[oid], detail)
+                cached[oid] = detail
+            details = [cached[oid] for oid in order_ids]
+
+        orders: List[Dict] = []
+        order_lines: List[Dict] = []
+        order_status_history: List[Dict] = []
+        for oid, detail in zip(order_ids, details):
+            orders.append(detail.get("order") or {})
+            for line in detail.get("lines", []):
+                line["order_id"] = oid
+                order_lines.append(line)
+            for st in detail.get("status_history", []):
+                st["order_id"] = oid
+                st["id"] = synth_id
+                synth_id += 1
+                order_status_history.append(st)
+
+        yield "orders", orders
+        yield "order_lines", order_lines
+        yield "order_status_history", order_status_history
+
+
+# ---------------------------------------------------------------------------
+# Source CSV (jeux de donnees data/*.csv, backfills)
+# ---------------------------------------------------------------------------
+
+SOURCES = ("api", "csv", "db")
+
+
+def _csv_text(series):
+    """Equivalent de toNullable (import-csv.js) : texte sans espaces, vide -> NULL."""
+    series = series.str.strip()
+    return series.where(series != "")
+
+
+def _csv_number(series):
+    """Nombre valide conserve sous sa forme texte (NUMERIC exact), sinon NULL."""
+    import pandas as pd
+    series = _csv_text(series)
+    return series.where(pd.to_numeric(series, errors="coerce").notna())
+
+
+def _csv_integer(series):
+    import numpy as np
+    import pandas as pd
+    return np.trunc(pd.to_numeric(_csv_text(series), errors="coerce")).astype("Int64")
+
+
+def _csv_boolean(series):
+    series = _csv_text(series)
+    return (series.str.lower() == "true").astype(object).where(series.notna())
+
+
+def _read_csv_frames(data_dir: pathlib.Path) -> Dict:
+    """Lit les CSV de data/ et les projette sur les colonnes staging_raw.
+
+    Memes regles que erp-api/scripts/import-csv.js (upsert : la derniere
+    occurrence d'une cle l'emporte ; produits = consolide + inventaire ;
+    statut courant = dernier statut de l'historique, 'Draft' a defaut).
+    Les colonnes created_at / updated_at, propres a l'ERP, restent NULL.
+    """
+    import pandas as pd
+
+    def _read(name: str):
+        return pd.read_csv(data_dir / name, dtype=str, keep_default_na=False)
+
+    frames = {}
+
+    df = _read("customers_enriched.csv").drop_duplicates("Customer_ID", keep="last")
+    frames["customers"] = pd.DataFrame({
+        "customer_id": _csv_text(df["Customer_ID"]),
+        "customer_name": _csv_text(df["Customer_Name"]),
+        "segment": _csv_text(df["Segment"]),
+        "city": _csv_text(df["City"]),
+        "state": _csv_text(df["State"]),
+        "region": _csv_text(df["Region"]),
+        "email": _csv_text(df["Email"]),
+    })
+
+    df = _read("suppliers.csv").drop_duplicates("Supplier_ID", keep="last")
+    frames["suppliers"] = pd.DataFrame({
+        "supplier_id": _csv_text(df["Supplier_ID"]),
+        "supplier_name": _csv_text(df["Supplier_Name"]),
+        "country": _csv_text(df["Country"]),
+        "contact_email": _csv_text(df["Contact_Email"]),
+        "contact_phone": _csv_text(df["Contact_Phone"]),
+        "rating": _csv_number(df["Rating"]),
+        "lead_time_days": _csv_integer(df["Lead_Time_Days"]),
+        "payment_terms": _csv_text(df["Payment_Terms"]),
+        "active": _csv_boolean(df["Active"]),
+    })
+
+    df = _read("products_consolidated.csv").drop_duplicates("Product_ID", keep="last")
+    products = pd.DataFrame({
+        "product_id": _csv_text(df["Product_ID"]),
+        "product_name": _csv_text(df["Product_Name"]),
+        "category": _csv_text(df["Category"]),
+        "sub_category": _csv_text(df["Sub_Category"]),
+        "unit_cost": _csv_number(df["Unit_Cost"]),
+        "unit_price": _csv_number(df["Unit_Price"]),
+        "supplier_id": _csv_text(df["Supplier_ID"]),
+        "stock_quantity": _csv_integer(df["Stock_Quantity"]),
+    }).set_index("product_id")
+    df = _read("products_inventory.csv").drop_duplicates("Product_ID", keep="last")
+    inventory = pd.DataFrame({
+        "product_id": _csv_text(df["Product_ID"]),
+        "product_name": _csv_text(df["Product_Name"]),
+        "category": _csv_text(df["Category"]),
+        "sub_category": _csv_text(df["Sub_Category"]),
+        "stock_quantity": _csv_integer(df["Stock_Quantity"]),
+        "reorder_level": _csv_integer(df["Reorder_Level"]),
+        "reorder_quantity": _csv_integer(df["Reorder_Quantity"]),
+        "unit_cost": _csv_number(df["Unit_Cost"]),
+        "warehouse_location": _csv_text(df["Warehouse_Location"]),
+        "supplier_id": _csv_text(df["Supplier_ID"]),
+    }).set_index("product_id")
+    # L'inventaire est importe apres le consolide : ses colonnes l'emportent
+    products = products.reindex(products.index.append(inventory.index.difference(products.index)))
+    for col in inventory.columns:
+        if col not in products.columns:
+            products[col] = None
+        products[col] = products[col].astype(object)
+        products.loc[inventory.index, col] = inventory[col].astype(object)
+    frames["products"] = products.reset_index()
+
+    history = _read("order_status.csv")
+    history = pd.DataFrame({
+        "order_id": _csv_text(history["Order_ID"]),
+        "status": _csv_text(history["Status"]),
+        "status_date": _csv_text(history["Status_Date"]),
+        "updated_by": _csv_text(history["Updated_By"]),
+    })
+    # Unicite (order_id, status, status_date) : premiere position, dernier updated_by
+    keys = ["order_id", "status", "status_date"]
+    updated_by = history.drop_duplicates(keys, keep="last")
+    history = history.drop_duplicates(keys).drop(columns="updated_by").merge(
+        updated_by, on=keys, how="left")
+    history.insert(0, "id", range(1, len(history) + 1))
+    frames["order_status_history"] = history
+
+    df = _read("orders_transactions.csv")
+    lines = df.drop_duplicates("Row ID", keep="last")
+    frames["order_lines"] = pd.DataFrame({
+        "row_id": _csv_integer(lines["Row ID"]),
+        "order_id": _csv_text(lines["Order ID"]),
+        "product_id": _csv_text(lines["Product ID"]),
+        "quantity": _csv_integer(lines["Quantity"]),
+        "discount": _csv_number(lines["Discount"]),
+        "sales": _csv_number(lines["Sales"]),
+        "unit_price": _csv_number(lines["Unit_Price"]),
+        "cost": _csv_number(lines["Cost"]),
+        "profit": _csv_number(lines["Profit"]),
+    })
+    orders = df.drop_duplicates("Order ID", keep="last")
+    postal = pd.to_numeric(_csv_text(orders["Postal Code"]), errors="coerce")
+    latest = (history.sort_values(["order_id", "status_date", "id"])
+              .drop_duplicates("order_id", keep="last").set_index("order_id")["status"])
+    order_ids = _csv_text(orders["Order ID"])
+    frames["orders"] = pd.DataFrame({
+        "order_id": order_ids,
+        "customer_id": _csv_text(orders["Customer ID"]),
+        "order_date": pd.to_datetime(orders["Order Date"], format="%d/%m/%Y",
+                                     errors="coerce").dt.strftime("%Y-%m-%d"),
+        "ship_date": pd.to_datetime(orders["Ship Date"], format="%d/%m/%Y",
+                                    errors="coerce").dt.strftime("%Y-%m-%d"),
+        "current_status": order_ids.map(latest).fillna("Draft"),
+        "ship_mode": _csv_text(orders["Ship Mode"]),
+        "country": _csv_text(orders["Country"]),
+        "city": _csv_text(orders["City"]),
+        "state": _csv_text(orders["State"]),
+        # Code postal numerique ("42420.0" -> "42420"), texte sinon
+        "postal_code": postal.dropna().astype("int64").astype(str).reindex(postal.index)
+                             .fillna(_csv_text(orders["Postal Code"])),
+        "region": _csv_text(orders["Region"]),
+    })
+    return frames
+
+
+def _iter_csv(data_dir: pathlib.Path,
+              batch_rows: int = CSV_BATCH_ROWS) -> Iterator[Tuple[str, List[Dict]]]:
+    """Source CSV : memes entites et colonnes que la source API, par lots."""
+    frames = _read_csv_frames(data_dir)
+    for entity in ENTITIES:
+        df = frames[entity].reindex(columns=STAGING_COLUMNS[entity][1]).astype(object)
+        df = df.where(df.notna(), None)
+        print(f"[extract]   {entity}: {len(df)} lignes ({data_dir.name}/)")
+        for start in range(0, len(df), batch_rows):
+            yield entity, df.iloc[start:start + batch_rows].to_dict("records")
+
+
+# ---------------------------------------------------------------------------
+# Source DB (lecture directe de la base OLTP erp-api)
+# ---------------------------------------------------------------------------
+
+# Cle de tri de chaque table OLTP (ordre stable pour les checksums)
+DB_ORDER_BY = {
+    "customers": "customer_id",
+    "suppliers": "supplier_id",
+    "products": "product_id",
+    "orders": "order_id",
+    "order_lines": "row_id",
+    "order_status_history": "id",
+}
+
+
+def get_erp_conn():
+    return psycopg2.connect(
+        host=os.getenv("ERP_PGHOST", "localhost"),
+        port=int(os.getenv("ERP_PGPORT", "5432")),
+        dbname=os.getenv("ERP_PGDATABASE", "erp_distribution"),
+        user=os.getenv("ERP_PGUSER"),
+        password=os.getenv("ERP_PGPASSWORD"),
+        application_name="erp-bi-extract",
+    )
+
+
+def _iter_db(fetch_rows: int = DB_FETCH_ROWS) -> Iterator[Tuple[str, List[Dict]]]:
+    """Source DB : lit les tables de erp-api/database/schema.sql (memes noms de
+    colonnes que staging_raw) via des curseurs serveur, par lots de `fetch_rows`.
+
+    Toutes les entites sont lues dans une meme transaction REPEATABLE READ en
+    lecture seule : un instantane coherent, sans bloquer les ecritures OLTP.
+    L'historique de statut garde son id OLTP (unique, pas d'id synthetique).
+    """
+    conn = get_erp_conn()
+    try:
+        conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+        for entity in ENTITIES:
+            cols = STAGING_COLUMNS[entity][1]
+            count = 0
+            with conn.cursor(name=f"etl_{entity}") as cur:
+                cur.itersize = fetch_rows
+                cur.execute(f"SELECT {', '.join(cols)} FROM {entity} "
+                            f"ORDER BY {DB_ORDER_BY[entity]}")
+                while True:
+                    rows = cur.fetchmany(fetch_rows)
+                    if not rows:
+                        break
+                    count += len(rows)
+                    yield entity, [dict(zip(cols, row)) for row in rows]
+            print(f"[extract]   {entity}: {count} lignes ({conn.info.dbname})")
+        conn.rollback()
+    finally:
+        conn.close()
+
+
+def _staging_partition(entity: str, run_id: str, legacy: bool = False) -> str:
+    """Partition staging_raw d'un run : <table>_<run id assaini>_<hash du run id>.
+
+    Le run id est assaini et tronque pour tenir dans un identifiant (63
+    caracteres) ; le hash du run id exact rend le nom propre a chaque run.
+    `legacy` : nom des versions precedentes (sans hash), pour la purge.
+    """
+    schema, table = STAGING_COLUMNS[entity][0].split(".")
+    name = f"{table}_{re.sub(r'[^a-z0-9_]', '_', run_id.lower())}"
+    if legacy:
+        return f"{schema}.{name[:63]}"
+    digest = hashlib.blake2b(run_id.encode("utf-8"), digest_size=4).hexdigest()
+    return f"{schema}.{name[:54]}_{digest}"
+
+
+def _staging_run_id(cur, run_id: str) -> str:
+    """Identifiant du run dans staging_raw : `run_id`, suffixe (`#2`, `#3`...)
+    si un run publie porte deja cet id (replay d'un run conserve, ETL_RUN_ID
+    fixe) : le run publie n'est jamais supprime avant que le nouveau le
+    remplace comme run courant."""
+    cur.execute("SELECT etl_run_id FROM staging_raw.etl_run WHERE status = 'published'")
+    published = {row[0] for row in cur.fetchall()}
+    staging_id, n = run_id, 1
+    while staging_id in published:
+        n += 1
+        staging_id = f"{run_id}#{n}"
+    return staging_id
+
+
+def _current_staging_run(cur, exclude: Optional[str] = None) -> Optional[str]:
+    """Run publie le plus recent de staging_raw (celui que lit transform)."""
+    cur.execute("""
+        SELECT etl_run_id FROM staging_raw.etl_run
+        WHERE status = 'published' AND etl_run_id IS DISTINCT FROM %s
+        ORDER BY loaded_at DESC, etl_run_id DESC
+        LIMIT 1
+    """, (exclude,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _drop_staging_run(cur, run_id: str):
+    """Supprime les partitions (attachees ou non) d'un run et son enregistrement."""
+    for entity in ENTITIES:
+        cur.execute(f"DROP TABLE IF EXISTS {_staging_partition(entity, run_id)}")
+        cur.execute(f"DROP TABLE IF EXISTS {_staging_partition(entity, run_id, legacy=True)}")
+    cur.execute("DELETE FROM staging_raw.etl_run WHERE etl_run_id = %s", (run_id,))
+
+
+class StagingLoader:
+    """Chargement de staging_raw en parallele, en deux phases.
+
+    Phase 1 : chaque entite est copiee (COPY) dans la partition encore detachee
+    du run, sur sa propre connexion (`workers` connexions, un thread chacune,
+    alimente par une file bornee), puis chaque connexion commite. Le run est
+    alors `loading` dans staging_raw.etl_run : invisible des lecteurs.
+    Phase 2 (`publish`, dans la transaction de l'appelant) : les partitions
+    sont attachees et le run passe `published`, en un seul commit. Un run
+    interrompu avant ne laisse que des tables detachees, supprimees par
+    `discard` ou au demarrage du run suivant.
+    """
+
+    QUEUE_DEPTH = 4
+
+    def __init__(self, run_id: str, incremental: bool, source: str, workers: int,
+                 load_stats: Dict[str, List]):
+        self.run_id = run_id
+        self.incremental = incremental
+        self.source = source
+        self.workers = max(1, min(workers, len(ENTITIES)))
+        self.load_stats = load_stats
+        for table, _ in STAGING_COLUMNS.values():
+            load_stats.setdefault(table, [0, 0.0])
+        self.previous: Optional[str] = None
+        self.id_offset = 0
+        self._conns = []
+        self._queues: List[queue.Queue] = []
+        self._threads: List[threading.Thread] = []
+        self._errors: List[BaseException] = []
+        self._stats_lock = threading.Lock()
+
+    def start(self):
+        """Cree les partitions detachees du run (et purge les runs `loading`
+        abandonnes), puis ouvre les connexions de chargement."""
+        with contextlib.closing(get_dwh_conn()) as conn, conn.cursor() as cur:
+            cur.execute("SELECT etl_run_id FROM staging_raw.etl_run WHERE status = 'loading'")
+            for (stale,) in cur.fetchall():
+                _drop_staging_run(cur, stale)
+            # Restes d'un chargement du meme id ; jamais un run publie (voir _staging_run_id)
+            _drop_staging_run(cur, self.run_id)
+            for entity in ENTITIES:
+                cur.execute(f"CREATE TABLE {_staging_partition(entity, self.run_id)} "
+                            f"(LIKE {STAGING_COLUMNS[entity][0]} INCLUDING DEFAULTS)")
+            cur.execute("INSERT INTO staging_raw.etl_run (etl_run_id, source, incremental, status) "
+                        "VALUES (%s, %s, %s, 'loading')",
+                        (self.run_id, self.source, self.incremental))
+            if self.incremental:
+                self.previous = _current_staging_run(cur, exclude=self.run_id)
+            if self.previous is not None:
+                cur.execute("SELECT COALESCE(MAX(id), 0) FROM staging_raw.order_status_history_raw "
+                            "WHERE etl_run_id = %s", (self.previous,))
+                self.id_offset = cur.fetchone()[0]
+            conn.commit()
+
+        for _ in range(self.workers):
+            conn = get_dwh_conn()
+            self._conns.append(conn)
+            self._queues.append(queue.Queue(maxsize=self.QUEUE_DEPTH))
+            thread = threading.Thread(target=self._work, args=(conn, self._queues[-1]),
+                                      name="staging-loader", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+        return self
+
+    def _work(self, conn, rows_queue: queue.Queue):
+        with conn.cursor() as cur:
+            while True:
+                item = rows_queue.get()
+                if item is None:
+                    break
+                if self._errors:
+                    continue  # on vide la file sans charger
+                entity, rows = item
+                try:
+                    table, cols = STAGING_COLUMNS[entity]
+                    started = time.perf_counter()
+                    loaded = copy_rows(cur, _staging_partition(entity, self.run_id), rows, cols,
+                                       self.run_id)
+                    with self._stats_lock:
+                        stats = self.load_stats.setdefault(table, [0, 0.0])
+                        stats[0] += loaded
+                        stats[1] += time.perf_counter() - started
+                except BaseException as e:
+                    self._errors.append(e)
+        if not self._errors:
+            conn.commit()
+
+    def submit(self, entity: str, rows: List[Dict]):
+        if self._errors:
+            raise self._errors[0]
+        if not rows:
+            return
+        if entity == "order_status_history" and self.id_offset:
+            rows = [{**st, "id": st["id"] + self.id_offset} for st in rows]
+        self._queues[ENTITIES.index(entity) % self.workers].put((entity, rows))
+
+    def finish(self):
+        """Fin de la phase 1 : attend la fin des COPY et le commit de chaque connexion."""
+        for rows_queue in self._queues:
+            rows_queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self._errors:
+            raise self._errors[0]
+
+    def publish(self, cur) -> int:
+        """Phase 2 : voir _publish_staging. Retourne le nombre de lignes reprises."""
+        return _publish_staging(cur, self.run_id, self.previous)
+
+    def discard(self):
+        """Abandon du run : supprime ses partitions detachees."""
+        self.close()
+        with contextlib.closing(get_dwh_conn()) as conn, conn.cursor() as cur:
+            _drop_staging_run(cur, self.run_id)
+            conn.commit()
+
+    def close(self):
+        for rows_queue in self._queues if self._threads else ():
+            rows_queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        for conn in self._conns:
+            conn.close()
+        self._conns = []
+
+
+def _publish_staging(cur, run_id: str, previous: Optional[str]) -> int:
+    """Attache les partitions du run a staging_raw et le publie (run courant).
+
+    En incremental, les lignes du run precedent que le delta ne remplace pas
+    (meme cle, voir DELTA_KEYS) sont d'abord recopiees cote serveur : chaque
+    partition reste un etat complet. La contrainte CHECK posee avant l'ATTACH
+    evite a PostgreSQL de reverifier toute la partition. Retourne le nombre
+    de lignes reprises.
+    """
+    carried = 0
+    # Ordre inverse : lignes et historique avant les commandes, qui servent a
+    # identifier les versions remplacees et ne doivent pas encore etre completees
+    if previous is not None:
+        for entity in reversed(ENTITIES):
+            table, cols = STAGING_COLUMNS[entity]
+            col_list = ", ".join(cols + ["etl_loaded_at"])
+            replaced = "".join(
+                f" AND NOT EXISTS (SELECT 1 FROM {_staging_partition(delta, run_id)} d"
+                f" WHERE d.{column} = r.{column})"
+                for delta, (column, targets) in DELTA_KEYS.items() if entity in targets)
+            cur.execute(f"""
+                INSERT INTO {_staging_partition(entity, run_id)} ({col_list}, etl_run_id)
+                SELECT {col_list}, %s FROM {table} r
+                WHERE r.etl_run_id = %s{replaced}
+            """, (run_id, previous))
+            carried += cur.rowcount
+    for entity in ENTITIES:
+        table = STAGING_COLUMNS[entity][0]
+        partition = _staging_partition(entity, run_id)
+        cur.execute(f"ALTER TABLE {partition} ADD CONSTRAINT etl_run_partition "
+                    f"CHECK (etl_run_id = %s)", (run_id,))
+        cur.execute(f"ALTER TABLE {table} ATTACH PARTITION {partition} FOR VALUES IN (%s)",
+                    (run_id,))
+    # Base du changeset ecrit par apply_fingerprints dans la meme transaction
+    cur.execute("UPDATE staging_raw.etl_run SET status = 'published', loaded_at = NOW(), "
+                "changeset_base = %s WHERE etl_run_id = %s",
+                (_current_staging_run(cur, exclude=run_id), run_id))
+    return carried
+
+
+def _prune_staging(cur, keep: int) -> List[str]:
+    """Supprime les runs publies au-dela des `keep` plus recents (DROP des partitions)."""
+    cur.execute("""
+        SELECT etl_run_id FROM staging_raw.etl_run
+        WHERE status = 'published'
+        ORDER BY loaded_at DESC, etl_run_id DESC
+        OFFSET %s
+    """, (max(keep, 1),))
+    dropped = [row[0] for row in cur.fetchall()]
+    for old in dropped:
+        _drop_staging_run(cur, old)
+    return dropped
+
+
+def _print_load_stats(load_stats: Dict[str, List]):
+    for table, (rows, seconds) in load_stats.items():
+        rate = rows / seconds if seconds > 0 else float("inf")
+        print(f"[extract]   {table:<40} {rows:>8} lignes  {seconds:6.2f}s  {rate:>10,.0f} lignes/s")
+
+
+def _copy_fingerprints(cur, trackers: Dict[str, EntityTracker], entities: Iterable[str]):
+    """Charge les empreintes des trackers dans `tmp_row_fingerprint` (temporaire,
+    supprimee au commit) : COPY direct depuis leurs fichiers, sans repasser en memoire.
+
+    Une cle revue dans le run (page decalee pendant la pagination) garde sa
+    derniere empreinte, comme le ferait un dict.
+    """
+    cur.execute("""
+        CREATE TEMP TABLE tmp_row_fingerprint (
+            entity TEXT, natural_key TEXT, row_hash TEXT, seq BIGSERIAL
+        ) ON COMMIT DROP
+    """)
+    for entity in entities:
+        spool = trackers[entity].fingerprints
+        if spool is None:
+            continue
+        spool.flush()
+        spool.seek(0)
+        # Le fichier ne porte que (cle, empreinte) : l'entite vient du defaut
+        cur.execute("ALTER TABLE tmp_row_fingerprint ALTER COLUMN entity SET DEFAULT %s",
+                    (entity,))
+        cur.copy_expert("COPY tmp_row_fingerprint (natural_key, row_hash) FROM STDIN",
+                        spool, size=COPY_BUFFER_SIZE)
+        spool.seek(0, os.SEEK_END)
+    cur.execute("""
+        DELETE FROM tmp_row_fingerprint t
+        USING tmp_row_fingerprint d
+        WHERE d.entity = t.entity AND d.natural_key = t.natural_key AND d.seq > t.seq
+    """)
+    cur.execute("ANALYZE tmp_row_fingerprint")
+
+
+def apply_fingerprints(cur, trackers: Dict[str, EntityTracker], run_id: str,
+                       detect_deletes: bool) -> Dict[str, Dict[str, int]]:
+    """Compare les empreintes du run a `staging_raw.row_fingerprint`, ecrit le
+    changeset explicite dans `staging_raw.row_changeset` puis met a jour l'index.
+
+    Les suppressions ne sont detectables que sur une extraction complete.
+    """
+    _copy_fingerprints(cur, trackers, ENTITIES)
+
+    cur.execute("DELETE FROM staging_raw.row_changeset WHERE etl_run_id <> %s", (run_id,))
+    cur.execute("""
+        INSERT INTO staging_raw.row_changeset (etl_run_id, entity, natural_key, change_type)
+        SELECT %s, t.entity, t.natural_key,
+               CASE WHEN f.natural_key IS NULL THEN 'insert' ELSE 'update' END
+        FROM tmp_row_fingerprint t
+        LEFT JOIN staging_raw.row_fingerprint f
+          ON f.entity = t.entity AND f.natural_key = t.natural_key
+        WHERE f.row_hash IS DISTINCT FROM t.row_hash
+        ON CONFLICT DO NOTHING
+    """, (run_id,))
+    if detect_deletes:
+        cur.execute("""
+            INSERT INTO staging_raw.row_changeset (etl_run_id, entity, natural_key, change_type)
+            SELECT %s, f.entity, f.natural_key, 'delete'
+            FROM staging_raw.row_fingerprint f
+            WHERE NOT EXISTS (SELECT 1 FROM tmp_row_fingerprint t
+                              WHERE t.entity = f.entity AND t.natural_key = f.natural_key)
+            ON CONFLICT DO NOTHING
+        """, (run_id,))
+        cur.execute("""
+            DELETE FROM staging_raw.row_fingerprint f
+            USING staging_raw.row_changeset c
+            WHERE c.etl_run_id = %s AND c.change_type = 'delete'
+              AND c.entity = f.entity AND c.natural_key = f.natural_key
+        """, (run_id,))
+
+    cur.execute("""
+        INSERT INTO staging_raw.row_fingerprint (entity, natural_key, row_hash, etl_run_id)
+        SELECT entity, natural_key, row_hash, %s
+        FROM tmp_row_fingerprint
+        ON CONFLICT (entity, natural_key) DO UPDATE SET
+            row_hash = EXCLUDED.row_hash,
+            etl_run_id = EXCLUDED.etl_run_id
+        WHERE staging_raw.row_fingerprint.row_hash IS DISTINCT FROM EXCLUDED.row_hash
+    """, (run_id,))
+
+    cur.execute("""
+        SELECT entity, change_type, COUNT(*)
+        FROM staging_raw.row_changeset
+        WHERE etl_run_id = %s
+        GROUP BY entity, change_type
+    """, (run_id,))
+    summary = {k: {"insert": 0, "update": 0, "delete": 0} for k in ENTITIES}
+    for entity, change_type, n in cur.fetchall():
+        summary[entity][change_type] = n
+    return summary
+
+
+# ---------------------------------------------------------------------------
+# Sonde de changement (avant extraction)
+# ---------------------------------------------------------------------------
+
+# Resume par table OLTP, identique a `?summary=true` des endpoints de liste
+PROBE_SQL = {
+    "customers": "SELECT COUNT(*), MAX(updated_at) FROM customers",
+    "suppliers": "SELECT COUNT(*), MAX(updated_at) FROM suppliers",
+    "products": "SELECT COUNT(*), MAX(updated_at) FROM products",
+    "orders": """
+        SELECT (SELECT COUNT(*) FROM orders), (SELECT MAX(updated_at) FROM orders),
+               (SELECT COUNT(*) FROM order_lines), (SELECT MAX(updated_at) FROM order_lines),
+               (SELECT COUNT(*) FROM order_status_history),
+               (SELECT MAX(created_at) FROM order_status_history)
+    """,
+}
+PROBE_FIELDS = ("count", "max_updated_at", "line_count", "lines_max_updated_at",
+                "history_count", "history_max_created_at")
+
+
+def probe_source(source: Optional[str] = None) -> Optional[Dict]:
+    """Etat resume de la source : nombre de lignes et `updated_at` max par liste
+    (commandes : aussi lignes et historique de statut).
+
+    Une requete agregee par liste (`?summary=true` sur le gateway, ou SQL sur
+    la base OLTP pour la source `db`), sans pagination ni detail commande.
+    Retourne None pour la source `csv` (pas de sonde : extraction systematique).
+    Sur le gateway, ni retry ni backoff (`ETL_PROBE_TIMEOUT` par requete) : une
+    sonde en echec leve aussitot, et le pipeline extrait comme si tout avait change.
+    """
+    source = (source or os.getenv("ETL_SOURCE", "api")).lower()
+    if source == "db":
+        with contextlib.closing(get_erp_conn()) as conn, conn.cursor() as cur:
+            state = {}
+            for entity, sql in PROBE_SQL.items():
+                cur.execute(sql)
+                state[entity] = {field: str(v) if isinstance(v, datetime) else v
+                                 for field, v in zip(PROBE_FIELDS, cur.fetchone())}
+            return state
+    if source != "api":
+        return None
+    with GatewayClient(pool_size=1, timeout=float(os.getenv("ETL_PROBE_TIMEOUT", "5")),
+                       max_retries=0) as client:
+        client.login()
+        return {entity: client.get(f"{path}?summary=true")["summary"]
+                for entity, path in LIST_ENDPOINTS.items()}
+
+
+def probe_unchanged(state: Optional[Dict], source: Optional[str] = None) -> bool:
+    """Vrai si `state` (voir `probe_source`) est celui du dernier run reussi de
+    la meme source, et que ce run date de moins de `ETL_PROBE_MAX_AGE_MINUTES`.
+
+    La sonde ne voit que les changements qui modifient un nombre de lignes ou
+    un `updated_at` : l'age maximal garantit une vraie extraction reguliere.
+    """
+    if state is None or not PROBE_FILE.exists():
+        return False
+    source = (source or os.getenv("ETL_SOURCE", "api")).lower()
+    stored = json.loads(PROBE_FILE.read_text(encoding="utf-8"))
+    max_age = timedelta(minutes=int(os.getenv("ETL_PROBE_MAX_AGE_MINUTES", "60")))
+    extracted_at = datetime.fromisoformat(stored["extracted_at"])
+    if datetime.now(timezone.utc) - extracted_at > max_age:
+        print(f"[extract] Sonde : derniere extraction du {stored['extracted_at']}, "
+              f"extraction forcee (ETL_PROBE_MAX_AGE_MINUTES)")
+        return False
+    return stored.get("source") == source and stored.get("state") == state
+
+
+def record_probe_skip(source: Optional[str] = None):
+    """Etat orchestrateur d'un run arrete par la sonde : aucun changement, et
+    les comptes du run precedent (la source n'a pas bouge depuis)."""
+    previous = {}
+    if ORCHESTRATOR_STATE_FILE.exists():
+        with contextlib.suppress(ValueError):
+            previous = json.loads(ORCHESTRATOR_STATE_FILE.read_text(encoding="utf-8"))
+    _notify_orchestrator(False, previous.get("counts", {}),
+                         {"source": (source or os.getenv("ETL_SOURCE", "api")).lower(),
+                          "status": "skipped", "skipped_by": "probe"})
+
+
+def save_probe(state: Optional[Dict], source: Optional[str] = None):
+    """Enregistre l'etat sonde avant un pipeline termine avec succes.
+
+    Sans etat (source `csv`, replay, sonde desactivee ou en echec), l'etat
+    precedent est supprime : il ne decrit plus le contenu du DWH.
+    """
+    if state is None:
+        PROBE_FILE.unlink(missing_ok=True)
+        return
+    source = (source or os.getenv("ETL_SOURCE", "api")).lower()
+    PROBE_FILE.write_text(json.dumps({"source": source,
+                                      "extracted_at": datetime.now(timezone.utc).isoformat(),
+                                      "state": state}, indent=2), encoding="utf-8")
+
+
+def _boundary_changes(trackers: Dict[str, EntityTracker], deltas: List[str]) -> List[str]:
+    """Deltas dont les lignes revenues a la borne `updated_since` ont une
+    empreinte differente de celle de `staging_raw.row_fingerprint`."""
+    entities = [e for delta in deltas for e in DELTA_KEYS[delta][1]]
+    with contextlib.closing(get_dwh_conn()) as conn, conn.cursor() as cur:
+        _copy_fingerprints(cur, trackers, entities)
+        cur.execute("""
+            SELECT DISTINCT t.entity
+            FROM tmp_row_fingerprint t
+            LEFT JOIN staging_raw.row_fingerprint f
+              ON f.entity = t.entity AND f.natural_key = t.natural_key
+            WHERE f.row_hash IS DISTINCT FROM t.row_hash
+        """)
+        differing = {row[0] for row in cur.fetchall()}
+        conn.rollback()
+    return [delta for delta in deltas if differing.intersection(DELTA_KEYS[delta][1])]
+
+
+def _detect_changes(trackers: Dict[str, EntityTracker], incremental: bool,
+                    old_checksums: Dict[str, str]) -> List[str]:
+    if incremental:
+        # Le delta est l'ensemble des changements
+        delta = {"customers": "customers", "suppliers": "suppliers",
+                 "products": "products", "orders": "order_summaries"}
+        changed = {k for k, tracked in delta.items() if trackers[tracked].has_newer}
+        boundary = [k for k, tracked in delta.items()
+                    if k not in changed and trackers[tracked].at_boundary]
+        if boundary:
+            changed.update(_boundary_changes(trackers, boundary))
+        return [k for k in delta if k in changed]
+    return [k for k in ENTITIES if trackers[k].hexdigest() != old_checksums.get(k)]
+
+
+def run(run_id: str, full_refresh: bool = False, resume: bool = False,
+        replay: bool = False, source: Optional[str] = None,
+        clean_rows: Optional[Dict[str, List[Dict]]] = None) -> Tuple[Dict[str, int], bool]:
+    """Extrait les donnees source et les charge dans staging_raw.
+
+    Chaque run charge sa propre partition de staging_raw (LIST sur
+    etl_run_id), attachee au commit : les runs precedents restent lisibles
+    pendant le chargement, et disponibles pour comparaison. Seuls les
+    `ETL_STAGING_KEEP` derniers runs sont conserves.
+
+    `source` (defaut `ETL_SOURCE`, sinon `api`) : `api` (gateway REST), `csv`
+    (fichiers de data/, ou `ETL_CSV_DIR`, pour les backfills) ou `db` (lecture
+    directe de la base OLTP `ERP_PG*`). Les sources `csv` et `db` font toujours
+    une extraction complete, sans toucher aux watermarks de l'API.
+
+    En mode `ETL_EXTRACT_MODE=incremental`, seules les lignes modifiees depuis
+    le dernier run reussi (`updated_since`) sont extraites ; la partition du
+    run est completee par les lignes inchangees du run precedent. Une
+    extraction complete est forcee par `full_refresh`, tous les
+    `ETL_FULL_RECONCILE_DAYS` jours, ou si staging_raw est vide.
+
+    Avec `ETL_STREAMING=true`, chaque page est inseree dans staging_raw des sa
+    reception (memoire bornee par quelques pages) ; la transaction est annulee
+    a la fin si aucun changement n'est detecte.
+
+    Sauf `ETL_CHECKPOINTS=false`, les pages extraites sont enregistrees au fil
+    de l'eau (BI/.etl_checkpoints/<run_id>/) ; avec `resume`, un run
+    interrompu reprend apres le dernier bloc termine du meme run id.
+
+    Les reponses brutes de l'API sont conservees dans BI/.etl_cache/<run_id>/
+    (`ETL_RESPONSE_CACHE_KEEP` derniers runs). Avec `replay`, staging_raw est
+    reconstruit hors ligne depuis le cache du run `run_id`, avec les memes
+    parametres ; l'etat orchestrateur est inchange, checksums et watermarks
+    sont effaces (le run live suivant recharge tout).
+
+    Les metriques du run (par endpoint et par table staging_raw) sont ecrites
+    dans BI/.etl_metrics.json, y compris si l'extraction echoue.
+
+    Avec `clean_rows` (moteur de transform `memory`), l'extraction est
+    complete et sans streaming, et staging_raw n'est pas alimente : les lignes
+    extraites sont deposees dans `clean_rows` (par entite), meme sans
+    changement, pour etre normalisees en memoire par le transform.
 
     Returns:
         (counts, data_changed) - nombre de lignes par entite et flag si donnees ont change.
     """
+    source = (source or os.getenv("ETL_SOURCE", "api")).lower()
+    if source not in SOURCES:
+        raise RuntimeError(f"Source inconnue : {source} (attendu : {', '.join(SOURCES)})")
+    if source != "api" and (resume or replay):
+        raise RuntimeError("--resume / --offline / --replay ne concernent que la source api")
+    api = source == "api"
     page_size = int(os.getenv("ETL_API_PAGE_SIZE", "200"))
+    detail_concurrency = int(os.getenv("ETL_DETAIL_CONCURRENCY", "8"))
+    streaming = os.getenv("ETL_STREAMING", "false").lower() == "true"
+    page_prefetch = int(os.getenv("ETL_PAGE_PREFETCH", "4"))
+    pool_size = max(detail_concurrency, 1) + len(LIST_ENDPOINTS) * max(page_prefetch, 1)
 
-    print("[extract] Login gateway...")
-    token = api_login()
-
-    print("[extract] Fetching customers, suppliers, products...")
-    customers = fetch_paginated(token, "/api/v1/customers", page_size)
-    suppliers = api_request("GET", "/api/v1/suppliers", token=token).get("items", [])
-    products = fetch_paginated(token, "/api/v1/catalog/products", page_size)
+    checkpoints = os.getenv("ETL_CHECKPOINTS", "true").lower() == "true"
+    cache_keep = int(os.getenv("ETL_RESPONSE_CACHE_KEEP", "3"))
+    use_detail_cache = os.getenv("ETL_DETAIL_CACHE", "true").lower() == "true"
+    staging_keep = int(os.getenv("ETL_STAGING_KEEP", "3"))
+    staging_workers = int(os.getenv("ETL_STAGING_WORKERS", str(len(STAGING_COLUMNS))))
+    in_memory = clean_rows is not None
+    streaming = streaming and not in_memory
+    engine = "memory" if in_memory else "sql"
 
-    print("[extract] Fetching orders + details (lines, status history)...")
-    order_summaries = fetch_paginated(token, "/api/v1/sales/orders", page_size)
+    # Sans run dans staging_raw (premier run, migration), tout est recharge ;
+    # le moteur memoire ne lit pas staging_raw
+    staging_empty = False
+    staging_id = run_id
+    if not in_memory:
+        with contextlib.closing(get_dwh_conn()) as probe, probe.cursor() as cur:
+            staging_empty = _current_staging_run(cur) is None
+            staging_id = _staging_run_id(cur, run_id)
+        if staging_id != run_id:
+            print(f"[extract] Run {run_id} deja publie dans staging_raw : "
+                  f"chargement sous l'id {staging_id}")
 
-    orders: List[Dict] = []
-    order_lines: List[Dict] = []
-    order_status_history: List[Dict] = []
-    synth_id = 1
+    watermarks = _load_watermarks()
+    cache = None
+    checkpoint = None
+    if api and (checkpoints or resume) and not replay:
+        checkpoint = ExtractCheckpoint(run_id)
+    if not api:
+        incremental, since = False, {}
+        started_at = datetime.now(timezone.utc).isoformat()
+        print(f"[extract] Source : {source}")
+    elif replay:
+        cache = ResponseCache(run_id, offline=True)
+        settings = cache.settings()
+        if settings is None:
+            raise RuntimeError(f"Aucune extraction complete en cache pour le run {run_id}")
+        incremental, since, started_at, page_size = (settings["incremental"], settings["since"],
+                                                     settings["started_at"], settings["page_size"])
+        print(f"[extract] Replay hors ligne du run {run_id} (cache des reponses API)")
+    elif resume and checkpoint.load():
+        # Memes parametres que le run interrompu
+        settings = checkpoint.manifest["settings"]
+        incremental, since, started_at = (settings["incremental"], settings["since"],
+                                          settings["started_at"])
+        m = checkpoint.manifest
+        print(f"[extract] Reprise du run {run_id} : {len(m['segments'])} segments verifies, "
+              f"listes terminees {m['completed']}, {m['order_summaries_done']} commandes")
+    else:
+        if resume:
+            print(f"[extract] Aucun point de reprise valide pour {run_id}, extraction complete")
+            resume = False
+        incremental = (os.getenv("ETL_EXTRACT_MODE", "full").lower() == "incremental"
+                       and not full_refresh and not _reconciliation_due(watermarks)
+                       and not staging_empty and not in_memory)
+        since = watermarks.get("entities", {}) if incremental else {}
+        started_at = datetime.now(timezone.utc).isoformat()
+        if checkpoint is not None:
+            checkpoint.start({"incremental": incremental, "since": since,
+                              "started_at": started_at})
+    if in_memory and incremental:
+        raise RuntimeError("Moteur de transform memoire : le run repris ou rejoue est "
+                           "incremental, relancer avec ETL_TRANSFORM_ENGINE=sql")
+    if api and not replay and cache_keep > 0:
+        ResponseCache.prune(cache_keep, run_id)
+        cache = ResponseCache(run_id)
+    detail_cache = None
+    print(f"[extract] Mode : {'incremental' if incremental else 'full'}"
+          f"{' (streaming)' if streaming else ''}{' (moteur memoire)' if in_memory else ''}")
 
-    for summary in order_summaries:
-        oid = summary.get("order_id")
-        if not oid:
-            continue
-        detail = api_request("GET", f"/api/v1/sales/orders/{oid}", token=token)
-        orders.append(detail.get("order") or {})
-        for line in detail.get("lines", []):
-            line["order_id"] = oid
-            order_lines.append(line)
-        for st in detail.get("status_history", []):
-            st["order_id"] = oid
-            st["id"] = synth_id
-            synth_id += 1
-            order_status_history.append(st)
-
-    # --- Change detection ---
-    new_checksums = {
-        "customers": _compute_checksum(customers),
-        "suppliers": _compute_checksum(suppliers),
-        "products": _compute_checksum(products),
-        "orders": _compute_checksum(orders),
-        "order_lines": _compute_checksum(order_lines),
-        "order_status_history": _compute_checksum(order_status_history),
+    trackers = {
+        "customers": EntityTracker(since.get("customers")),
+        "suppliers": EntityTracker(since.get("suppliers")),
+        "products": EntityTracker(since.get("products")),
+        "order_summaries": EntityTracker(since.get("orders")),
+        "orders": EntityTracker(),
+        "order_lines": EntityTracker(),
+        "order_status_history": EntityTracker(),
     }
-    old_checksums = _load_checksums()
-    data_changed = new_checksums != old_checksums
-
-    if not data_changed:
-        print("[extract] Aucun changement detecte depuis la derniere extraction")
-        counts = {
-            "customers": len(customers), "suppliers": len(suppliers),
-            "products": len(products), "orders": len(orders),
-            "order_lines": len(order_lines), "order_status_history": len(order_status_history),
+    for entity in ENTITIES:
+        # Le moteur memoire n'ecrit pas row_fingerprint
+        trackers[entity].key_cols = None if in_memory else NATURAL_KEYS[entity]
+        trackers[entity].synthetic_cols = SYNTHETIC_COLUMNS.get(entity, ())
+    old_checksums = {} if incremental else _load_checksums(engine)
+    entities: Dict[str, List[Dict]] = {k: [] for k in ENTITIES}
+    load_stats: Dict[str, List] = {}
+    metrics = ExtractMetrics()
+    status = "failed"
+    loader = None
+    conn = None
+    client = None
+    pagination_modes: Dict[str, str] = {}
+    try:
+        # --full re-telecharge aussi le detail de toutes les commandes
+        if api and use_detail_cache and not replay:
+            detail_cache = OrderDetailCache().open(reset=full_refresh)
+        phase_start = time.perf_counter()
+        with contextlib.ExitStack() as stack:
+            if source == "csv":
+                stream = _iter_csv(pathlib.Path(os.getenv("ETL_CSV_DIR", str(CSV_DATA_DIR))))
+            elif source == "db":
+                stream = _iter_db()
+            else:
+                client = stack.enter_context(GatewayClient(pool_size=pool_size, cache=cache,
+                                                               metrics=metrics))
+                if replay:
+                    # Memes requetes que le run d'origine (sondage keyset compris)
+                    client.keyset = settings["keyset"]
+                else:
+                    print("[extract] Login gateway...")
+                    client.login()
+                stream = _iter_extract(client, since, page_size, detail_concurrency,
+                                       checkpoint.resume_state() if resume else None, detail_cache)
+                if checkpoint is not None:
+                    stream = checkpoint.track(stream, client.pagination_modes)
+                if resume:
+                    client.pagination_modes.update(checkpoint.manifest["pagination_modes"])
+                    stream = itertools.chain(checkpoint.replay(), stream)
+
+            if streaming:
+                # Chargement au fil de l'eau (phase 1), publie seulement si changement
+                loader = StagingLoader(staging_id, incremental, source, staging_workers,
+                                       load_stats).start()
+                for entity, batch in stream:
+                    trackers[entity].update(batch)
+                    if entity in entities:
+                        loader.submit(entity, batch)
+                loader.finish()
+            else:
+                for entity, batch in stream:
+                    trackers[entity].update(batch)
+                    if entity in entities:
+                        entities[entity].extend(batch)
+
+            if client is not None:
+                pagination_modes = dict(sorted(client.pagination_modes.items()))
+                print(f"[extract] Pagination : {pagination_modes}")
+            if detail_cache is not None:
+                print(f"[extract] Details commandes : {detail_cache.hits} depuis le cache, "
+                      f"{detail_cache.misses} telecharges")
+        metrics.phase("extract", time.perf_counter() - phase_start)
+        if cache is not None and not replay:
+            cache.save_settings({"incremental": incremental, "since": since,
+                                 "started_at": started_at, "page_size": page_size,
+                                 "keyset": client.keyset})
+
+        counts = {k: trackers[k].count for k in ENTITIES}
+        if replay or staging_empty:
+            # Rechargement systematique : le cache ne dit rien de l'etat courant
+            changed_entities = ENTITIES
+        else:
+            changed_entities = _detect_changes(trackers, incremental, old_checksums)
+        data_changed = bool(changed_entities)
+        if in_memory:
+            clean_rows.update(entities)
+        new_watermarks = {
+            "entities": {
+                "customers": trackers["customers"].max_updated_at,
+                "suppliers": trackers["suppliers"].max_updated_at,
+                "products": trackers["products"].max_updated_at,
+                "orders": trackers["order_summaries"].max_updated_at,
+            },
+            "last_run_id": run_id,
+            "last_run_at": started_at,
+            "last_full_run_at": watermarks.get("last_full_run_at") if incremental else started_at,
         }
-        # Notifier l'orchestrateur même sans changements
-        _notify_orchestrator(data_changed, counts)
-        return counts, False
 
-    changed_entities = [k for k in new_checksums if new_checksums[k] != old_checksums.get(k)]
-    print(f"[extract] Changements detectes sur : {', '.join(changed_entities)}")
+        if not data_changed:
+            print("[extract] Aucun changement detecte depuis la derniere extraction")
+            if loader is not None:
+                loader.discard()
+            if api and not in_memory:
+                _save_watermarks(new_watermarks)
+            if detail_cache is not None:
+                detail_cache.save(prune=not incremental and not resume)
+            if checkpoint is not None:
+                checkpoint.discard()
+            # Notifier l'orchestrateur même sans changements
+            _notify_orchestrator(data_changed, counts,
+                                 {"source": source, "status": "unchanged",
+                                  "pagination_modes": pagination_modes})
+            status = "unchanged"
+            return counts, False
 
-    # Chargement staging_raw (full refresh : truncate + insert)
-    conn = get_dwh_conn()
-    counts = {}
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                TRUNCATE TABLE
-                    staging_raw.customers_raw,
-                    staging_raw.suppliers_raw,
-                    staging_raw.products_raw,
-                    staging_raw.orders_raw,
-                    staging_raw.order_lines_raw,
-                    staging_raw.order_status_history_raw;
-            """)
-
-            counts["customers"] = insert_rows(cur, "staging_raw.customers_raw", customers,
-                ["customer_id","customer_name","segment","city","state","region","email","created_at","updated_at"], run_id)
-
-            counts["suppliers"] = insert_rows(cur, "staging_raw.suppliers_raw", suppliers,
-                ["supplier_id","supplier_name","country","contact_email","contact_phone",
-                 "rating","lead_time_days","payment_terms","active","created_at","updated_at"], run_id)
-
-            counts["products"] = insert_rows(cur, "staging_raw.products_raw", products,
-                ["product_id","product_name","category","sub_category","unit_cost","unit_price",
-                 "supplier_id","stock_quantity","reorder_level","reorder_quantity","warehouse_location",
-                 "created_at","updated_at"], run_id)
-
-            counts["orders"] = insert_rows(cur, "staging_raw.orders_raw", orders,
-                ["order_id","customer_id","order_date","ship_date","current_status","ship_mode",
-                 "country","city","state","postal_code","region","created_at","updated_at"], run_id)
-
-            counts["order_lines"] = insert_rows(cur, "staging_raw.order_lines_raw", order_lines,
-                ["row_id","order_id","product_id","quantity","discount","sales","unit_price","cost","profit",
-                 "created_at","updated_at"], run_id)
-
-            counts["order_status_history"] = insert_rows(cur, "staging_raw.order_status_history_raw", order_status_history,
-                ["id","order_id","status","status_date","updated_by","created_at"], run_id)
-
-        conn.commit()
+        print(f"[extract] Changements detectes sur : {', '.join(changed_entities)}")
+
+        # Chargement staging_raw : nouvelle partition du run (complete ou delta +
+        # reprise du run precedent), chargee en parallele puis publiee en un commit
+        if not in_memory:
+            phase_start = time.perf_counter()
+            if loader is None:
+                loader = StagingLoader(staging_id, incremental, source, staging_workers,
+                                       load_stats).start()
+                for entity in ENTITIES:
+                    loader.submit(entity, entities[entity])
+                    entities[entity] = []
+                loader.finish()
+            conn = get_dwh_conn()
+            with conn.cursor() as cur:
+                carried = loader.publish(cur)
+                dropped = _prune_staging(cur, staging_keep)
+                changeset = apply_fingerprints(cur, trackers, staging_id,
+                                               detect_deletes=not incremental)
+            conn.commit()
+            metrics.phase("load", time.perf_counter() - phase_start)
+        if detail_cache is not None:
+            detail_cache.save(prune=not incremental and not resume)
+        status = "changed"
     finally:
-        conn.close()
+        for tracker in trackers.values():
+            tracker.close()
+        if detail_cache is not None:
+            detail_cache.close()
+        if conn is not None:
+            conn.close()
+        if loader is not None:
+            loader.close()
+            if status == "failed":
+                with contextlib.suppress(psycopg2.Error):
+                    loader.discard()
+        metrics.save(run_id, source, status, load_stats)
+
+    # Sauvegarder checksums / watermarks apres chargement reussi
+    if not replay:
+        if not incremental:
+            _save_checksums(trackers, engine)
+        # Les watermarks restent ceux du dernier run SQL : une extraction
+        # incrementale reprend les lignes inchangees de staging_raw
+        if api and not in_memory:
+            _save_watermarks(new_watermarks)
+        if checkpoint is not None:
+            checkpoint.discard()
+
+        # Notifier l'orchestrateur des changements
+        _notify_orchestrator(data_changed, counts,
+                             {"source": source, "status": "changed",
+                              "pagination_modes": pagination_modes})
+    else:
+        # Le snapshot rejoue est publie comme run courant : les checksums et
+        # watermarks du dernier run live ne decrivent plus staging_raw ni le DWH
+        _invalidate_change_state()
+        print("[extract] Replay : checksums et watermarks effaces, "
+              "le prochain run fera une extraction complete")
 
-    # Sauvegarder les checksums apres chargement reussi
-    _save_checksums(new_checksums)
-    
-    # Notifier l'orchestrateur des changements
-    _notify_orchestrator(data_changed, counts)
+    if in_memory:
+        print(f"[extract] Moteur memoire : staging_raw non alimente, "
+              f"{sum(counts.values())} lignes remises au transform")
+        print(f"[extract] Done: {counts}")
+        return counts, data_changed
 
+    print("[extract] Changeset (+insert ~update -delete) : " + ", ".join(
+        f"{k} +{c['insert']} ~{c['update']} -{c['delete']}" for k, c in changeset.items()))
+    print("[extract] Chargement staging_raw (COPY) :")
+    _print_load_stats(load_stats)
+    if loader.previous is not None:
+        print(f"[extract]   {carried} lignes inchangees reprises du run {loader.previous}")
+    if dropped:
+        print(f"[extract] Runs retires de staging_raw : {', '.join(dropped)}")
     print(f"[extract] Done: {counts}")
     return counts, data_changed
 
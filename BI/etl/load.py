@@ -14,6 +14,11 @@ Deux phases :
    - fact_sales_order_line        : grain = ligne de commande
    - fact_order_status_transition : grain = changement de statut commande
    - fact_inventory_snapshot      : grain = stock produit a la date du jour
+
+   Les dimensions SCD2 (client, fournisseur, produit) sont resolues a la
+   version valide a la date de l'evenement (date de commande, date du
+   statut) : valid_from <= date < valid_to. Le snapshot de stock, photo
+   du jour, pointe sur la version courante.
 """
 
 import os
@@ -100,9 +105,13 @@ def load_facts(cur, run_id: str):
             l.unit_price, l.cost, l.profit, %s
         FROM staging_clean.orders_clean o
         JOIN staging_clean.order_lines_clean l ON l.order_id = o.order_id
-        LEFT JOIN dwh.dim_customer dc   ON dc.customer_id = o.customer_id AND dc.is_current = TRUE
-        LEFT JOIN dwh.dim_product dp    ON dp.product_id = l.product_id AND dp.is_current = TRUE
-        LEFT JOIN dwh.dim_supplier ds   ON ds.supplier_id = dp.supplier_id AND ds.is_current = TRUE
+        CROSS JOIN LATERAL (SELECT COALESCE(o.order_date::timestamp, 'infinity') AS ts) at_
+        LEFT JOIN dwh.dim_customer dc   ON dc.customer_id = o.customer_id
+                                       AND at_.ts >= dc.valid_from AND (dc.valid_to IS NULL OR at_.ts < dc.valid_to)
+        LEFT JOIN dwh.dim_product dp    ON dp.product_id = l.product_id
+                                       AND at_.ts >= dp.valid_from AND (dp.valid_to IS NULL OR at_.ts < dp.valid_to)
+        LEFT JOIN dwh.dim_supplier ds   ON ds.supplier_id = dp.supplier_id
+                                       AND at_.ts >= ds.valid_from AND (ds.valid_to IS NULL OR at_.ts < ds.valid_to)
         LEFT JOIN dwh.dim_geography dg  ON dg.geography_hash = md5(concat_ws('|', o.country, o.region, o.state, o.city, o.postal_code))
         LEFT JOIN dwh.dim_order_status st ON st.status_code = o.current_status
         LEFT JOIN dwh.dim_ship_mode sm    ON sm.ship_mode_code = o.ship_mode
@@ -139,7 +148,9 @@ def load_facts(cur, run_id: str):
         FROM staging_clean.order_status_history_clean h
         LEFT JOIN staging_clean.orders_clean o  ON o.order_id = h.order_id
         LEFT JOIN dwh.dim_order_status st       ON st.status_code = h.status
-        LEFT JOIN dwh.dim_customer dc           ON dc.customer_id = o.customer_id AND dc.is_current = TRUE
+        LEFT JOIN dwh.dim_customer dc           ON dc.customer_id = o.customer_id
+                                               AND h.status_date >= dc.valid_from
+                                               AND (dc.valid_to IS NULL OR h.status_date < dc.valid_to)
         ON CONFLICT (order_id, status_key, status_date) DO UPDATE SET
             customer_key     = EXCLUDED.customer_key,
             transition_count = EXCLUDED.transition_count,
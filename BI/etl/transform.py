@@ -3,12 +3,14 @@ ETL - Transform
 ================
 Transformation des donnees brutes (staging_raw) vers staging_clean.
 
-Trois phases appliquees sequentiellement :
+Trois phases, decoupees en taches SQL executees en graphe (voir TaskGraph) :
 
 1. NORMALISATION
    - Suppression espaces superflus (trim)
    - Mise en minuscule des champs texte de comparaison (noms, emails)
    - Deduplication par cle naturelle (DISTINCT ON ... ORDER BY updated_at DESC)
+   - Incrementale par defaut : seules les cles du changeset du run sont
+     upsertees dans staging_clean (ON CONFLICT ... IS DISTINCT FROM)
    - Justification : assure la coherence inter-modules (clients, produits,
      fournisseurs provenant de services ERP differents) et prepare la
      conformite dimensionnelle.
@@ -17,23 +19,57 @@ Trois phases appliquees sequentiellement :
    - Detection des doublons clients (meme nom normalise + email)
    - Detection des doublons produits (meme nom normalise + fournisseur)
    - Suppression des commandes incoherentes (ship_date < order_date)
+   - Doublons approches clients / produits (fautes de frappe, mots inverses) :
+     blocage phonetique + MinHash LSH, score des seules paires candidates,
+     clusters ecrits dans staging_clean.duplicate_review pour revue
    - Justification : gestion des doublons et incoherences comme requis
      par la gouvernance des donnees (Partie B).
 
 3. CONFORMATION DIMENSIONNELLE
-   - Insertion des nouvelles entites dans les dimensions DWH (Type-1 upsert)
+   - Historisation SCD2 des dimensions clients, fournisseurs, produits :
+     comparaison des hash, fermeture de la version changee, ouverture d'une
+     nouvelle (une requete ensembliste par dimension)
    - Population des dimensions de reference (statuts, modes de livraison)
    - Justification : prepare le chargement des faits en garantissant que
      chaque cle etrangere dimensionnelle est resolue.
+
+Les taches sans dependance entre elles (une par entite, par controle, par
+dimension) s'executent en parallele sur des connexions poolees
+(ETL_TRANSFORM_WORKERS) ; la conformation des dimensions dwh est validee
+d'un bloc en fin de graphe.
+
+Avec ETL_TRANSFORM_ENGINE=memory, la phase 1 est faite en memoire (pandas)
+sur les lignes remises par l'extraction, sans passer par staging_raw : seul
+le resultat normalise est copie dans staging_clean (voir normalize_frame).
 """
 
+import hashlib
+import io
 import os
+import random
+import re
+import time
+import unicodedata
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from difflib import SequenceMatcher
+from functools import partial
+from itertools import combinations
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 
 import psycopg2
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
 
+# Meme definition que les empreintes de l'extraction (ignorees aussi par
+# l'upsert incremental) ; `python BI/etl/transform.py` n'a pas BI/ dans le path
+try:
+    from etl.extract import SYNTHETIC_COLUMNS
+except ImportError:
+    from extract import SYNTHETIC_COLUMNS
 
-def get_dwh_conn():
-    return psycopg2.connect(
+
+def _dwh_params() -> dict:
+    return dict(
         host=os.getenv("DWH_PGHOST", "localhost"),
         port=int(os.getenv("DWH_PGPORT", "5432")),
         dbname=os.getenv("DWH_PGDATABASE"),
@@ -42,251 +78,916 @@ def get_dwh_conn():
     )
 
 
+def get_dwh_conn():
+    return psycopg2.connect(**_dwh_params())
+
+
 # ---------------------------------------------------------------------------
-# Phase 1 : Normalisation  (staging_raw -> staging_clean)
+# Execution : graphe de taches SQL
 # ---------------------------------------------------------------------------
 
-def normalize(cur, run_id: str):
-    """Full-refresh : truncate clean puis insertion normalisee."""
+# Prefixe des transactions preparees (2PC) du transform ; celles qu'un run
+# interrompu a laissees sont annulees au run suivant
+PREPARED_PREFIX = "etl_transform:"
+
+
+class TaskGraph:
+    """Graphe de taches SQL executees sur des connexions poolees.
+
+    Chaque tache declare les tables qu'elle lit et ecrit. Elle depend des
+    taches declarees avant elle qui ecrivent une table qu'elle lit ou ecrit,
+    ou qui lisent une table qu'elle ecrit ; les taches independantes
+    s'executent en parallele, chacune dans sa transaction.
+
+    Visibilite : une tache dont d'autres dependent valide des qu'elle se
+    termine, pour que ses successeurs voient ses ecritures (staging_clean,
+    interne au pipeline). Une tache terminale qui ecrit (dimensions dwh,
+    clean_state) garde sa transaction ouverte jusqu'a la fin du graphe : les
+    terminales sont alors validees ensemble, ou toutes annulees si une tache
+    a echoue. Si le serveur l'autorise (max_prepared_transactions), chacune
+    est preparee (PREPARE TRANSACTION) avant le premier COMMIT PREPARED.
+    Sinon (defaut PostgreSQL : 0), les terminales s'executent l'une apres
+    l'autre sur une seule connexion, dans une seule transaction : elles ne
+    sont plus paralleles entre elles, mais restent validees d'un bloc.
+
+    Avec un seul worker, le graphe s'execute dans l'ordre de declaration
+    dans la transaction du coordinateur, comme un script sequentiel.
+    """
+
+    def __init__(self):
+        self.tasks = []  # (nom, fonction(cur), tables lues, tables ecrites)
+
+    def add(self, name: str, fn: Callable, reads: Iterable[str] = (),
+            writes: Iterable[str] = ()):
+        self.tasks.append((name, fn, frozenset(reads), frozenset(writes)))
+
+    def dependencies(self) -> Dict[str, set]:
+        deps = {}
+        for i, (name, _, reads, writes) in enumerate(self.tasks):
+            deps[name] = {other for other, _, r, w in self.tasks[:i]
+                          if w & (reads | writes) or r & writes}
+        return deps
+
+    def run(self, conn, workers: int) -> Tuple[dict, str]:
+        """Execute le graphe ; retourne (resultat par tache, description du
+        mode d'execution). `conn` est la connexion du coordinateur : sa
+        transaction en cours est validee avant le lancement en parallele."""
+        if workers <= 1 or len(self.tasks) <= 1:
+            results = {}
+            with conn.cursor() as cur:
+                for name, fn, _, _ in self.tasks:
+                    results[name] = fn(cur)
+            conn.commit()
+            return results, "sequentiel, 1 transaction"
+
+        deps = self.dependencies()
+        has_successors = set().union(*deps.values())
+        held = {name for name, _, _, writes in self.tasks
+                if writes and name not in has_successors}
 
-    cur.execute("""
-        TRUNCATE TABLE
-            staging_clean.customers_clean,
-            staging_clean.suppliers_clean,
-            staging_clean.products_clean,
-            staging_clean.orders_clean,
-            staging_clean.order_lines_clean,
-            staging_clean.order_status_history_clean;
-    """)
+        conn.commit()
+        with conn.cursor() as cur:
+            cur.execute("SHOW max_prepared_transactions")
+            two_phase = bool(held) and int(cur.fetchone()[0]) >= len(held)
+        conn.rollback()
+        if two_phase:
+            for xid in conn.tpc_recover():
+                if xid.gtrid.startswith(PREPARED_PREFIX):
+                    print(f"[transform] Transaction preparee orpheline annulee : {xid.gtrid}")
+                    conn.tpc_rollback(xid)
+
+        run_tag = f"{PREPARED_PREFIX}{os.getpid()}:{int(time.time())}:"
+        pool = ThreadedConnectionPool(1, workers + len(held), **_dwh_params())
+        results, held_conns, error = {}, [], None
+        # Sans 2PC : une transaction commune, servie par un seul thread
+        shared = pool.getconn() if held and not two_phase else None
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor, \
+                    ThreadPoolExecutor(max_workers=1) as terminal:
+                pending = {name: (fn, name in held) for name, fn, _, _ in self.tasks}
+                running = {}
+                while (pending or running) and error is None:
+                    for name in [n for n in pending if deps[n] <= results.keys()]:
+                        fn, hold = pending.pop(name)
+                        if hold and shared is not None:
+                            running[terminal.submit(self._execute_shared, shared, fn)] = name
+                            continue
+                        gid = run_tag + name if hold and two_phase else None
+                        running[executor.submit(self._execute, pool, fn, hold, gid)] = name
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        name = running.pop(future)
+                        try:
+                            results[name], held_conn = future.result()
+                        except Exception as exc:
+                            error = error or exc
+                            continue
+                        if held_conn is not None:
+                            held_conns.append(held_conn)
+                # En cas d'echec, les taches deja lancees se terminent (sortie du with)
+                for future in running:
+                    try:
+                        _, held_conn = future.result()
+                    except Exception:
+                        continue
+                    if held_conn is not None:
+                        held_conns.append(held_conn)
+
+            # Validation commune : toutes les terminales sont deja preparees en 2PC
+            for held_conn in held_conns:
+                _end(held_conn, two_phase, commit=error is None)
+            if shared is not None:
+                _end(shared, False, commit=error is None)
+        finally:
+            pool.closeall()
+        if error is not None:
+            raise error
+        return results, (f"{workers} connexions, {len(held)} taches validees ensemble"
+                         + (" (2PC)" if two_phase else " (1 transaction, sans 2PC)"))
+
+    @staticmethod
+    def _execute_shared(conn, fn: Callable):
+        """Execute une tache terminale dans la transaction commune (sans 2PC) ;
+        validee ou annulee en fin de graphe."""
+        with conn.cursor() as cur:
+            return fn(cur), None
+
+    @staticmethod
+    def _execute(pool, fn: Callable, hold: bool, gid: Optional[str]):
+        """Execute une tache sur une connexion du pool. Retourne (resultat,
+        connexion retenue si la tache attend la validation commune)."""
+        conn = pool.getconn()
+        try:
+            if gid is not None:
+                conn.tpc_begin(gid)
+            with conn.cursor() as cur:
+                result = fn(cur)
+            if not hold:
+                conn.commit()
+            elif gid is not None:
+                conn.tpc_prepare()
+        except BaseException:
+            _end(conn, gid is not None, commit=False)
+            pool.putconn(conn)
+            raise
+        if hold:
+            return result, conn
+        pool.putconn(conn)
+        return result, None
+
+
+def _end(conn, two_phase: bool, commit: bool):
+    if two_phase:
+        if commit:
+            conn.tpc_commit()
+        else:
+            conn.tpc_rollback()
+    elif commit:
+        conn.commit()
+    else:
+        conn.rollback()
 
-    # Customers : normalise nom + email, derniere version par customer_id
-    cur.execute("""
-        INSERT INTO staging_clean.customers_clean (
-            customer_id, customer_name, customer_name_normalized,
-            segment, city, state, region,
-            email, email_normalized, source_updated_at, etl_run_id
-        )
-        SELECT DISTINCT ON (customer_id)
-            customer_id, customer_name, lower(trim(customer_name)),
-            segment, city, state, region,
-            email, lower(trim(email)), updated_at, %s
-        FROM staging_raw.customers_raw
-        WHERE customer_id IS NOT NULL
-        ORDER BY customer_id, updated_at DESC
-    """, (run_id,))
 
-    # Suppliers : normalise nom + email contact
-    cur.execute("""
-        INSERT INTO staging_clean.suppliers_clean (
-            supplier_id, supplier_name, supplier_name_normalized,
-            country, contact_email, contact_email_normalized,
-            rating, lead_time_days, active, source_updated_at, etl_run_id
-        )
-        SELECT DISTINCT ON (supplier_id)
-            supplier_id, supplier_name, lower(trim(supplier_name)),
-            country, contact_email, lower(trim(contact_email)),
-            rating, lead_time_days, active, updated_at, %s
-        FROM staging_raw.suppliers_raw
-        WHERE supplier_id IS NOT NULL
-        ORDER BY supplier_id, updated_at DESC NULLS LAST
-    """, (run_id,))
+# ---------------------------------------------------------------------------
+# Phase 1 : Normalisation  (staging_raw -> staging_clean)
+# ---------------------------------------------------------------------------
 
-    # Orders : derniere version par order_id
+def current_staging_run(cur) -> str:
+    """Run publie le plus recent de staging_raw (voir staging_raw.etl_run)."""
     cur.execute("""
-        INSERT INTO staging_clean.orders_clean (
-            order_id, customer_id, order_date, ship_date,
-            current_status, ship_mode, country, city, state,
-            postal_code, region, source_updated_at, etl_run_id
-        )
-        SELECT DISTINCT ON (order_id)
-            order_id, customer_id, order_date, ship_date,
-            current_status, ship_mode, country, city, state,
-            postal_code, region, updated_at, %s
-        FROM staging_raw.orders_raw
-        WHERE order_id IS NOT NULL
-        ORDER BY order_id, updated_at DESC
-    """, (run_id,))
-
-    # Products : normalise nom
+        SELECT etl_run_id FROM staging_raw.etl_run
+        WHERE status = 'published'
+        ORDER BY loaded_at DESC, etl_run_id DESC
+        LIMIT 1
+    """)
+    row = cur.fetchone()
+    if row is None:
+        raise RuntimeError("staging_raw est vide : lancer d'abord l'extraction")
+    return row[0]
+
+
+# Normalisation par entite : table clean, cle naturelle, colonnes clean avec
+# leur expression sur la ligne raw, et tri de deduplication (version retenue
+# en tete). Les lignes et l'historique sont synchronises par commande.
+CLEAN_TABLES = {
+    "customers": ("staging_clean.customers_clean", ("customer_id",), [
+        ("customer_id", "customer_id"),
+        ("customer_name", "customer_name"),
+        ("customer_name_normalized", "lower(trim(customer_name))"),
+        ("segment", "segment"), ("city", "city"), ("state", "state"), ("region", "region"),
+        ("email", "email"),
+        ("email_normalized", "lower(trim(email))"),
+        ("source_updated_at", "updated_at"),
+    ], "updated_at DESC"),
+    "suppliers": ("staging_clean.suppliers_clean", ("supplier_id",), [
+        ("supplier_id", "supplier_id"),
+        ("supplier_name", "supplier_name"),
+        ("supplier_name_normalized", "lower(trim(supplier_name))"),
+        ("country", "country"),
+        ("contact_email", "contact_email"),
+        ("contact_email_normalized", "lower(trim(contact_email))"),
+        ("rating", "rating"), ("lead_time_days", "lead_time_days"), ("active", "active"),
+        ("source_updated_at", "updated_at"),
+    ], "updated_at DESC NULLS LAST"),
+    "products": ("staging_clean.products_clean", ("product_id",), [
+        ("product_id", "product_id"),
+        ("product_name", "product_name"),
+        ("product_name_normalized", "lower(trim(product_name))"),
+        ("category", "category"), ("sub_category", "sub_category"),
+        ("unit_cost", "unit_cost"), ("unit_price", "unit_price"),
+        ("supplier_id", "supplier_id"), ("stock_quantity", "stock_quantity"),
+        ("source_updated_at", "updated_at"),
+    ], "updated_at DESC"),
+    "orders": ("staging_clean.orders_clean", ("order_id",), [
+        ("order_id", "order_id"), ("customer_id", "customer_id"),
+        ("order_date", "order_date"), ("ship_date", "ship_date"),
+        ("current_status", "current_status"), ("ship_mode", "ship_mode"),
+        ("country", "country"), ("city", "city"), ("state", "state"),
+        ("postal_code", "postal_code"), ("region", "region"),
+        ("source_updated_at", "updated_at"),
+    ], "updated_at DESC"),
+    "order_lines": ("staging_clean.order_lines_clean", ("row_id",), [
+        ("row_id", "row_id"), ("order_id", "order_id"), ("product_id", "product_id"),
+        ("quantity", "quantity"), ("discount", "discount"), ("sales", "sales"),
+        ("unit_price", "unit_price"), ("cost", "cost"), ("profit", "profit"),
+        ("source_updated_at", "updated_at"),
+    ], "updated_at DESC NULLS LAST"),
+    # L'id de l'historique est synthetique (renumerote par l'extraction API) :
+    # la cle est (order_id, status, status_date), unique dans l'ERP
+    "order_status_history": ("staging_clean.order_status_history_clean",
+                             ("order_id", "status", "status_date"), [
+        ("id", "id"), ("order_id", "order_id"), ("status", "status"),
+        ("status_date", "status_date"), ("updated_by", "updated_by"),
+        ("source_updated_at", "created_at"),
+    ], "created_at DESC NULLS LAST, id DESC"),
+}
+
+# Entites synchronisees par commande (voir collect_changed_orders)
+ORDER_CHILDREN = ("orders", "order_lines", "order_status_history")
+
+
+def _select_latest(entity: str, scope: str = "") -> str:
+    """SELECT de la derniere version par cle naturelle dans la partition du run."""
+    _, key, columns, order = CLEAN_TABLES[entity]
+    return f"""
+        SELECT DISTINCT ON ({', '.join(key)})
+            {', '.join(expr for _, expr in columns)}, %(run_id)s
+        FROM staging_raw.{entity}_raw r
+        WHERE r.etl_run_id = %(staging_run)s
+          AND {' AND '.join(f'r.{k} IS NOT NULL' for k in key)}{scope}
+        ORDER BY {', '.join(key)}, {order}
+    """
+
+
+def normalize_entity(cur, entity: str, params: dict) -> int:
+    """Full-refresh d'une entite : truncate de sa table clean puis insertion
+    normalisee depuis la partition staging_raw du run `staging_run`."""
+    table, _, columns, _ = CLEAN_TABLES[entity]
+    cur.execute(f"TRUNCATE TABLE {table}")
+    cur.execute(f"INSERT INTO {table} ({', '.join(c for c, _ in columns)}, etl_run_id)"
+                + _select_latest(entity), params)
+    return cur.rowcount
+
+
+def incremental_base(cur, staging_run: str) -> Optional[str]:
+    """Run que reflete staging_clean si `staging_run` peut y etre applique en
+    incremental, sinon None (normalisation complete).
+
+    Le changeset (`staging_raw.row_changeset`) du run decrit ses differences
+    avec le run publie avant lui (`changeset_base`) : il ne s'applique qu'a un
+    staging_clean issu de ce run-la, ou deja a jour.
+    """
     cur.execute("""
-        INSERT INTO staging_clean.products_clean (
-            product_id, product_name, product_name_normalized, category, sub_category,
-            unit_cost, unit_price, supplier_id, stock_quantity, source_updated_at, etl_run_id
-        )
-        SELECT DISTINCT ON (product_id)
-            product_id, product_name, lower(trim(product_name)),
-            category, sub_category, unit_cost, unit_price,
-            supplier_id, stock_quantity, updated_at, %s
-        FROM staging_raw.products_raw
-        WHERE product_id IS NOT NULL
-        ORDER BY product_id, updated_at DESC
-    """, (run_id,))
-
-    # Order lines : derniere version par row_id
+        SELECT r.changeset_base, s.staging_run
+        FROM staging_raw.etl_run r
+        LEFT JOIN staging_clean.clean_state s ON TRUE
+        WHERE r.etl_run_id = %s
+    """, (staging_run,))
+    row = cur.fetchone()
+    if row is None or row[1] is None:
+        return None
+    base, clean_run = row
+    if clean_run == staging_run:
+        return clean_run
+    if base is None or base != clean_run:
+        return None
+    # Cles du changeset absentes du run (format de cle inattendu) : pas d'incremental
+    for entity, (_, key, _, _) in CLEAN_TABLES.items():
+        if len(key) > 1:
+            continue
+        cur.execute(f"""
+            SELECT COUNT(*) FROM staging_raw.row_changeset c
+            WHERE c.etl_run_id = %(staging_run)s AND c.entity = %(entity)s
+              AND c.change_type <> 'delete'
+              AND NOT EXISTS (SELECT 1 FROM staging_raw.{entity}_raw r
+                              WHERE r.etl_run_id = %(staging_run)s
+                                AND r.{key[0]}::text = c.natural_key)
+        """, {"staging_run": staging_run, "entity": entity})
+        if cur.fetchone()[0]:
+            return None
+    return clean_run
+
+
+def collect_changed_orders(cur, params: dict):
+    """Commandes touchees par le changeset du run (la commande, une de ses
+    lignes ou un de ses statuts) : perimetre de resynchronisation des lignes
+    et de l'historique, ecrit dans staging_clean.changed_orders."""
+    cur.execute("TRUNCATE TABLE staging_clean.changed_orders")
     cur.execute("""
-        INSERT INTO staging_clean.order_lines_clean (
-            row_id, order_id, product_id, quantity, discount, sales,
-            unit_price, cost, profit, source_updated_at, etl_run_id
-        )
-        SELECT DISTINCT ON (row_id)
-            row_id, order_id, product_id, quantity, discount, sales,
-            unit_price, cost, profit, updated_at, %s
-        FROM staging_raw.order_lines_raw
-        WHERE row_id IS NOT NULL
-        ORDER BY row_id, updated_at DESC NULLS LAST
-    """, (run_id,))
-
-    # Order status history : derniere version par id
+        INSERT INTO staging_clean.changed_orders (order_id)
+        SELECT natural_key FROM staging_raw.row_changeset
+        WHERE etl_run_id = %(staging_run)s AND entity = 'orders'
+        UNION
+        SELECT split_part(natural_key, '|', 1) FROM staging_raw.row_changeset
+        WHERE etl_run_id = %(staging_run)s AND entity = 'order_status_history'
+        UNION
+        SELECT l.order_id
+        FROM staging_raw.row_changeset c
+        JOIN staging_raw.order_lines_raw l
+          ON l.etl_run_id = %(staging_run)s AND l.row_id::text = c.natural_key
+        WHERE c.etl_run_id = %(staging_run)s AND c.entity = 'order_lines'
+        UNION
+        SELECT l.order_id
+        FROM staging_raw.row_changeset c
+        JOIN staging_clean.order_lines_clean l ON l.row_id::text = c.natural_key
+        WHERE c.etl_run_id = %(staging_run)s AND c.entity = 'order_lines'
+    """, params)
+    cur.execute("ANALYZE staging_clean.changed_orders")
+    return cur.rowcount
+
+
+def normalize_entity_incremental(cur, entity: str, params: dict) -> Tuple[int, int]:
+    """Applique a la table clean de `entity` les seules cles changees du run
+    `staging_run`.
+
+    Les cles viennent du changeset du run ; les lignes et l'historique sont
+    resynchronises pour chaque commande de staging_clean.changed_orders.
+    Chaque cle est upsertee (`ON CONFLICT ... DO UPDATE ... WHERE ... IS
+    DISTINCT FROM`) : une ligne identique n'est pas reecrite ; les colonnes
+    synthetiques ne sont ni comparees ni mises a jour. Les cles absentes du
+    run sont supprimees. Retourne (upserts, suppressions).
+    """
+    table, key, columns, _ = CLEAN_TABLES[entity]
+    if entity in ORDER_CHILDREN:
+        scope = " AND {a}.order_id IN (SELECT order_id FROM staging_clean.changed_orders)"
+    else:
+        scope = (f" AND {{a}}.{key[0]}::text IN (SELECT natural_key FROM staging_raw.row_changeset"
+                 f" WHERE etl_run_id = %(staging_run)s AND entity = '{entity}')")
+    names = [c for c, _ in columns]
+    data = [c for c in names if c not in key and c not in SYNTHETIC_COLUMNS.get(entity, ())]
+    cur.execute(f"""
+        INSERT INTO {table} AS t ({', '.join(names)}, etl_run_id)
+        {_select_latest(entity, scope.format(a="r"))}
+        ON CONFLICT ({', '.join(key)}) DO UPDATE SET
+            {', '.join(f'{c} = EXCLUDED.{c}' for c in data)},
+            etl_run_id = EXCLUDED.etl_run_id
+        WHERE ({', '.join(f't.{c}' for c in data)})
+              IS DISTINCT FROM ({', '.join(f'EXCLUDED.{c}' for c in data)})
+    """, params)
+    upserted = cur.rowcount
+    cur.execute(f"""
+        DELETE FROM {table} t
+        WHERE TRUE{scope.format(a="t")}
+          AND NOT EXISTS (SELECT 1 FROM staging_raw.{entity}_raw r
+                          WHERE r.etl_run_id = %(staging_run)s
+                            AND {' AND '.join(f'r.{k} = t.{k}' for k in key)})
+    """, params)
+    return upserted, cur.rowcount
+
+
+def _set_clean_run(cur, staging_run: str):
     cur.execute("""
-        INSERT INTO staging_clean.order_status_history_clean (
-            id, order_id, status, status_date, updated_by, source_updated_at, etl_run_id
-        )
-        SELECT DISTINCT ON (id)
-            id, order_id, status, status_date, updated_by, created_at, %s
-        FROM staging_raw.order_status_history_raw
-        WHERE id IS NOT NULL
-        ORDER BY id, created_at DESC NULLS LAST
-    """, (run_id,))
+        INSERT INTO staging_clean.clean_state (staging_run) VALUES (%s)
+        ON CONFLICT (singleton) DO UPDATE SET
+            staging_run = EXCLUDED.staging_run,
+            normalized_at = NOW()
+    """, (staging_run,))
 
 
 # ---------------------------------------------------------------------------
-# Phase 2 : Deduplication et controles qualite
+# Phase 1 en memoire (ETL_TRANSFORM_ENGINE=memory)
 # ---------------------------------------------------------------------------
 
-def deduplicate(cur):
-    """Detecte les doublons et supprime les donnees incoherentes."""
-    issues = {}
+# Expressions de CLEAN_TABLES evaluees sur un DataFrame : colonne raw telle
+# quelle, ou lower(trim(colonne)). trim() de PostgreSQL ne retire que les espaces.
+_FRAME_EXPR = re.compile(r"(\w+)|lower\(trim\((\w+)\)\)")
+_ORDER_TERM = re.compile(r"(\w+)( ASC| DESC)?( NULLS FIRST| NULLS LAST)?")
+_TZ_SUFFIX = r"(\d\d:\d\d(?::\d\d(?:\.\d+)?)?) ?(?:Z|[+-]\d\d(?::?\d\d)?)$"
 
-    # Doublons clients (meme nom normalise + email)
+
+def raw_column_types(cur) -> Dict[str, Dict[str, str]]:
+    """Type PostgreSQL de chaque colonne staging_raw, par entite."""
     cur.execute("""
-        SELECT customer_name_normalized, COALESCE(email_normalized, ''), COUNT(*)
-        FROM staging_clean.customers_clean
-        GROUP BY customer_name_normalized, COALESCE(email_normalized, '')
-        HAVING COUNT(*) > 1
+        SELECT table_name, column_name, data_type
+        FROM information_schema.columns
+        WHERE table_schema = 'staging_raw' AND table_name LIKE '%\\_raw'
     """)
-    issues["customer_duplicates"] = cur.rowcount
+    types: Dict[str, Dict[str, str]] = {}
+    for table, column, data_type in cur.fetchall():
+        types.setdefault(table[:-len("_raw")], {})[column] = data_type
+    return types
+
+
+def _frame_expr(frame, expr: str):
+    match = _FRAME_EXPR.fullmatch(expr)
+    if match is None:
+        raise ValueError(f"Expression non supportee par le moteur memoire : {expr}")
+    if match.group(1):
+        return frame[match.group(1)]
+    return frame[match.group(2)].str.strip(" ").str.lower()
+
+
+def _typed(series, data_type: str):
+    """Valeurs comparables comme dans staging_raw : horodatages lus sans
+    fuseau (l'heure murale, comme le cast en TIMESTAMP), dates tronquees au
+    jour, nombres ; le texte reste tel quel."""
+    import pandas as pd
+    if data_type.startswith("timestamp") or data_type == "date":
+        text = series.astype("string").str.replace(_TZ_SUFFIX, r"\1", regex=True)
+        values = pd.to_datetime(text, errors="coerce", format="ISO8601")
+        return values.dt.normalize() if data_type == "date" else values
+    if data_type in ("integer", "bigint", "smallint", "numeric", "double precision", "real"):
+        return pd.to_numeric(series, errors="coerce")
+    return series
+
+
+def normalize_frame(entity: str, rows: List[Dict], run_id: str,
+                    types: Dict[str, str]) -> Tuple[object, int]:
+    """Normalisation de `entity` en memoire, equivalente a _select_latest :
+    expressions de CLEAN_TABLES, derniere version par cle naturelle selon le
+    tri de deduplication ; pour les commandes, rejet de ship_date < order_date
+    (remove_invalid_orders). Retourne (DataFrame des colonnes clean, rejets)."""
+    import pandas as pd
+    _, key, columns, order = CLEAN_TABLES[entity]
+    raw = pd.DataFrame(rows, columns=list(types), dtype=object)
+    raw = raw[raw[list(key)].notna().all(axis=1)]
+
+    # Tri de deduplication : un indicateur de NULL par terme, place comme
+    # PostgreSQL (NULLS FIRST par defaut en DESC), puis la valeur typee
+    by, ascending = [], []
+    for n, term in enumerate(order.split(",")):
+        col, direction, nulls = _ORDER_TERM.fullmatch(term.strip()).groups()
+        desc = direction == " DESC"
+        nulls_first = nulls == " NULLS FIRST" if nulls else desc
+        values = _typed(raw[col], types[col])
+        raw = raw.assign(**{f"_null{n}": values.isna(), f"_sort{n}": values})
+        by += [f"_null{n}", f"_sort{n}"]
+        ascending += [not nulls_first, not desc]
+    latest = raw.sort_values(by, ascending=ascending, kind="stable").drop_duplicates(list(key))
+
+    rejected = 0
+    if entity == "orders":
+        order_date = _typed(latest["order_date"], types["order_date"])
+        ship_date = _typed(latest["ship_date"], types["ship_date"])
+        invalid = (ship_date < order_date).fillna(False)
+        rejected = int(invalid.sum())
+        latest = latest[~invalid]
+
+    frame = pd.DataFrame({name: _frame_expr(latest, expr) for name, expr in columns})
+    frame["etl_run_id"] = run_id
+    return frame, rejected
+
+
+def copy_clean_frame(cur, entity: str, frame) -> int:
+    """Full-refresh d'une table clean depuis un DataFrame normalise (COPY)."""
+    table = CLEAN_TABLES[entity][0]
+    cur.execute(f"TRUNCATE TABLE {table}")
+    data = frame.to_csv(index=False, header=False, na_rep="\\N", lineterminator="\n")
+    cur.copy_expert(f"COPY {table} ({', '.join(frame.columns)}) FROM STDIN "
+                    "WITH (FORMAT csv, NULL '\\N')", io.StringIO(data))
+    return len(frame)
+
+
+# ---------------------------------------------------------------------------
+# Phase 2 : Deduplication et controles qualite
+# ---------------------------------------------------------------------------
 
+# Controles de doublons : table clean et cle de regroupement
+DUPLICATE_CHECKS = {
+    # Doublons clients (meme nom normalise + email)
+    "customer_duplicates": ("staging_clean.customers_clean",
+                            "customer_name_normalized, COALESCE(email_normalized, '')"),
     # Doublons produits (meme nom normalise + fournisseur)
-    cur.execute("""
-        SELECT product_name_normalized, COALESCE(supplier_id, ''), COUNT(*)
-        FROM staging_clean.products_clean
-        GROUP BY product_name_normalized, COALESCE(supplier_id, '')
+    "product_duplicates": ("staging_clean.products_clean",
+                           "product_name_normalized, COALESCE(supplier_id, '')"),
+}
+
+
+def count_duplicates(cur, check: str) -> int:
+    """Nombre de groupes de doublons detectes par le controle `check`."""
+    table, group = DUPLICATE_CHECKS[check]
+    cur.execute(f"""
+        SELECT {group}, COUNT(*)
+        FROM {table}
+        GROUP BY {group}
         HAVING COUNT(*) > 1
     """)
-    issues["product_duplicates"] = cur.rowcount
+    return cur.rowcount
 
-    # Commandes incoherentes : ship_date avant order_date
+
+def remove_invalid_orders(cur) -> int:
+    """Supprime les commandes incoherentes : ship_date avant order_date."""
     cur.execute("""
         DELETE FROM staging_clean.orders_clean
         WHERE order_date IS NOT NULL AND ship_date IS NOT NULL AND ship_date < order_date
     """)
-    issues["invalid_order_dates_removed"] = cur.rowcount
-
-    return issues
+    return cur.rowcount
+
+
+# Doublons approches : table clean, cle, nom compare, attribut secondaire et
+# regle de score de l'attribut ("similarity" : texte proche, "equal" : egalite)
+FUZZY_MATCH = {
+    "customers": ("staging_clean.customers_clean", "customer_id", "customer_name",
+                  "email_normalized", "similarity"),
+    "products": ("staging_clean.products_clean", "product_id", "product_name",
+                 "supplier_id", "equal"),
+}
+# Poids du nom dans le score quand l'attribut secondaire est renseigne des deux cotes
+FUZZY_NAME_WEIGHT = 0.7
+# MinHash LSH : 8 bandes de 4 hash (paire candidate a ~98 % pour une similarite
+# de Jaccard de 0.8, ~6 % pour 0.3)
+MINHASH_BANDS, MINHASH_ROWS = 8, 4
+_MINHASH_PRIME = (1 << 61) - 1
+
+
+def _minhash_permutations(seed: int = 2024) -> List[Tuple[int, int]]:
+    """Fonctions de hachage (a*x + b mod p), fixes d'un run a l'autre."""
+    rng = random.Random(seed)
+    return [(rng.randrange(1, _MINHASH_PRIME), rng.randrange(_MINHASH_PRIME))
+            for _ in range(MINHASH_BANDS * MINHASH_ROWS)]
+
+
+_MINHASH_PERMUTATIONS = _minhash_permutations()
+# Un bloc plus grand (prenom frequent, mot generique) n'est pas compare :
+# le nombre de paires reste lineaire
+FUZZY_MAX_BLOCK = 50
+_has_digit = re.compile(r"\d").search
+_SOUNDEX_CODES = {c: str(d) for d, letters in enumerate(
+    ("aeiouyhw", "bfpv", "cgjkqsxz", "dt", "l", "mn", "r")) for c in letters}
+
+
+def _soundex(token: str) -> str:
+    """Code Soundex (americain) d'un mot en minuscules."""
+    codes = [_SOUNDEX_CODES.get(c, "") for c in token]
+    out, previous = token[0], codes[0]
+    for c, code in zip(token[1:], codes[1:]):
+        if code not in ("0", previous):
+            out += code
+        if c not in "hw":
+            previous = code
+    return (out + "000")[:4]
+
+
+def _minhash(text: str) -> List[int]:
+    """Signature MinHash des trigrammes de caracteres de `text`."""
+    padded = f" {text} "
+    hashes = {int.from_bytes(hashlib.blake2b(padded[i:i + 3].encode(), digest_size=8).digest(), "big")
+              for i in range(max(1, len(padded) - 2))}
+    return [min((a * h + b) % _MINHASH_PRIME for h in hashes) for a, b in _MINHASH_PERMUTATIONS]
+
+
+def _blocking_keys(tokens: List[str], secondary: Optional[str], rule: str) -> List[tuple]:
+    """Cles de blocage d'un enregistrement : deux enregistrements ne sont
+    compares que s'ils partagent au moins une cle."""
+    keys = [("phonetique", " ".join(sorted(t if _has_digit(t) else _soundex(t) for t in tokens)))]
+    signature = _minhash(" ".join(tokens))
+    keys += [("minhash", band, tuple(signature[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS]))
+             for band in range(MINHASH_BANDS)]
+    if secondary and rule == "similarity":
+        keys.append(("email", secondary.split("@")[0]))
+    return keys
+
+
+def _match_score(a: tuple, b: tuple, rule: str) -> float:
+    """Score d'une paire candidate (nom trie, jetons numeriques, attribut
+    secondaire). Des references ou tailles differentes (jetons numeriques)
+    ne sont jamais des doublons."""
+    (key_a, digits_a, sec_a), (key_b, digits_b, sec_b) = a, b
+    if digits_a != digits_b:
+        return 0.0
+    score = SequenceMatcher(None, key_a, key_b).ratio()
+    if sec_a and sec_b:
+        if rule == "equal":
+            similarity = float(sec_a == sec_b)
+        else:
+            similarity = SequenceMatcher(None, sec_a, sec_b).ratio()
+        score = FUZZY_NAME_WEIGHT * score + (1 - FUZZY_NAME_WEIGHT) * similarity
+    return score
+
+
+def fuzzy_threshold() -> float:
+    """Seuil de score des doublons approches (ETL_FUZZY_THRESHOLD, dans ]0, 1])."""
+    value = os.getenv("ETL_FUZZY_THRESHOLD", "0.9")
+    try:
+        threshold = float(value)
+    except ValueError:
+        threshold = None
+    if threshold is None or not 0 < threshold <= 1:
+        raise RuntimeError(f"ETL_FUZZY_THRESHOLD invalide : {value} (attendu : ]0, 1])")
+    return threshold
+
+
+def detect_fuzzy_duplicates(cur, entity: str, run_id: str, threshold: float) -> int:
+    """Doublons approches d'une entite, ecrits dans staging_clean.duplicate_review.
+
+    Les noms sont decoupes en jetons tries (mots inverses), puis bloques par
+    code phonetique des jetons, par bandes MinHash LSH des trigrammes et, pour
+    les clients, par partie locale de l'email : seules les paires d'un meme
+    bloc sont scorees, en temps quasi lineaire. Les paires au-dessus de
+    `threshold` forment des clusters (composantes connexes) ; chaque
+    membre est ecrit avec son meilleur candidat. Retourne le nombre de clusters.
+    """
+    table, key, name, secondary, rule = FUZZY_MATCH[entity]
+    cur.execute(f"SELECT {key}::text, {name}, {secondary}::text FROM {table} WHERE {name} IS NOT NULL")
+    records, blocks = {}, {}
+    for record_id, raw_name, sec in cur.fetchall():
+        ascii_name = unicodedata.normalize("NFKD", raw_name).encode("ascii", "ignore").decode()
+        tokens = sorted(re.findall(r"[a-z0-9]+", ascii_name.lower()))
+        if not tokens:
+            continue
+        records[record_id] = (" ".join(tokens), [t for t in tokens if _has_digit(t)], sec)
+        for block in _blocking_keys(tokens, sec, rule):
+            blocks.setdefault(block, []).append(record_id)
+
+    pairs = {}
+    for block, members in blocks.items():
+        if len(members) > FUZZY_MAX_BLOCK:
+            continue
+        for a, b in combinations(sorted(members), 2):
+            if (a, b) not in pairs:
+                pairs[(a, b)] = (_match_score(records[a], records[b], rule), block[0])
+
+    # Clusters : union-find sur les paires retenues, represente par la plus petite cle
+    parent, best = {}, {}
+
+    def find(x):
+        while parent.setdefault(x, x) != x:
+            parent[x] = x = parent[parent[x]]
+        return x
+
+    for (a, b), (score, blocking) in pairs.items():
+        if score < threshold:
+            continue
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+        for record, other in ((a, b), (b, a)):
+            if score > best.get(record, (0.0,))[0]:
+                best[record] = (score, other, blocking)
+
+    clusters = {}
+    for record in best:
+        clusters.setdefault(find(record), []).append(record)
+    rows = [(entity, record, cluster_id, len(members), best[record][1],
+             round(best[record][0], 4), best[record][2], run_id)
+            for cluster_id, members in clusters.items() for record in members]
+    cur.execute("DELETE FROM staging_clean.duplicate_review WHERE entity = %s", (entity,))
+    execute_values(cur, """
+        INSERT INTO staging_clean.duplicate_review (
+            entity, record_id, cluster_id, cluster_size, matched_id, score,
+            blocking_key, etl_run_id
+        ) VALUES %s
+    """, rows)
+    return len(clusters)
 
 
 # ---------------------------------------------------------------------------
 # Phase 3 : Conformation dimensionnelle
 # ---------------------------------------------------------------------------
 
-def conform_dimensions(cur, run_id: str):
-    """Insere les nouvelles entites dans les dimensions DWH."""
-
-    # dim_customer (Type-1 insert pour nouvelles entrees)
-    cur.execute("""
-        INSERT INTO dwh.dim_customer (
-            customer_id, customer_name, segment, city, state, region, email,
-            valid_from, valid_to, is_current, customer_hash
-        )
-        SELECT
-            c.customer_id, c.customer_name, c.segment, c.city, c.state, c.region, c.email,
-            NOW(), NULL, TRUE,
-            md5(concat_ws('|', c.customer_name, c.segment, c.city, c.state, c.region, c.email))
-        FROM staging_clean.customers_clean c
-        LEFT JOIN dwh.dim_customer d ON d.customer_id = c.customer_id AND d.is_current = TRUE
-        WHERE d.customer_id IS NULL
-    """)
-
-    # dim_supplier
-    cur.execute("""
-        INSERT INTO dwh.dim_supplier (
-            supplier_id, supplier_name, country, contact_email, rating, lead_time_days,
-            active, valid_from, valid_to, is_current, supplier_hash
+# Dimensions SCD2 : table clean, cle metier, attributs versionnes, colonne de
+# hash. Le hash (md5 des attributs) est celui calcule depuis la creation du DWH.
+SCD2_DIMENSIONS = {
+    "dwh.dim_customer": ("staging_clean.customers_clean", "customer_id",
+                         ("customer_name", "segment", "city", "state", "region", "email"),
+                         "customer_hash"),
+    "dwh.dim_supplier": ("staging_clean.suppliers_clean", "supplier_id",
+                         ("supplier_name", "country", "contact_email", "rating",
+                          "lead_time_days", "active"),
+                         "supplier_hash"),
+    "dwh.dim_product": ("staging_clean.products_clean", "product_id",
+                        ("product_name", "category", "sub_category", "unit_cost",
+                         "unit_price", "supplier_id"),
+                        "product_hash"),
+}
+# Debut de validite de la premiere version d'une cle (defaut de valid_from)
+SCD2_INITIAL_VALID_FROM = "1900-01-01"
+
+
+def apply_scd2(cur, run_id: str, dimension: str) -> Tuple[int, int]:
+    """SCD Type 2 ensembliste : une requete par dimension.
+
+    Les lignes clean du run (`etl_run_id` : toutes apres une normalisation
+    complete, les cles changees sinon), plus les cles sans version courante,
+    sont comparees par hash a la version courante. Une version dont le hash differe est fermee (`valid_to`,
+    `is_current = FALSE`) et une nouvelle est ouverte a la meme date : le
+    `source_updated_at` de la ligne (a defaut NOW()), toujours posterieur au
+    debut de la version fermee. Une cle inconnue recoit une premiere version
+    valide depuis SCD2_INITIAL_VALID_FROM, pour que les faits
+    anterieurs a sa premiere extraction la retrouvent.
+
+    Retourne (nouvelles cles, versions ouvertes sur changement).
+    """
+    clean, key, attrs, hash_col = SCD2_DIMENSIONS[dimension]
+    attr_list = ", ".join(attrs)
+    cur.execute(f"""
+        WITH incoming AS (
+            SELECT c.{key}, {', '.join(f'c.{a}' for a in attrs)},
+                   md5(concat_ws('|', {', '.join(f'c.{a}' for a in attrs)})) AS row_hash,
+                   COALESCE(c.source_updated_at, NOW()) AS changed_at
+            FROM {clean} c
+            WHERE c.etl_run_id = %s
+               OR NOT EXISTS (SELECT 1 FROM {dimension} d WHERE d.{key} = c.{key} AND d.is_current)
+        ),
+        closed AS (
+            UPDATE {dimension} d SET
+                valid_to = GREATEST(i.changed_at, d.valid_from + INTERVAL '1 millisecond'),
+                is_current = FALSE
+            FROM incoming i
+            WHERE d.{key} = i.{key} AND d.is_current
+              AND d.{hash_col} IS DISTINCT FROM i.row_hash
+            RETURNING d.{key}, d.valid_to
+        ),
+        opened AS (
+            INSERT INTO {dimension} ({key}, {attr_list}, valid_from, is_current, {hash_col})
+            SELECT i.{key}, {', '.join(f'i.{a}' for a in attrs)},
+                   COALESCE(cl.valid_to, TIMESTAMP '{SCD2_INITIAL_VALID_FROM}'), TRUE, i.row_hash
+            FROM incoming i
+            LEFT JOIN closed cl ON cl.{key} = i.{key}
+            WHERE cl.{key} IS NOT NULL
+               OR NOT EXISTS (SELECT 1 FROM {dimension} d WHERE d.{key} = i.{key})
+            RETURNING {key}, valid_from
         )
-        SELECT
-            s.supplier_id, s.supplier_name, s.country, s.contact_email, s.rating, s.lead_time_days,
-            s.active, NOW(), NULL, TRUE,
-            md5(concat_ws('|', s.supplier_name, s.country, s.contact_email, s.rating, s.lead_time_days, s.active))
-        FROM staging_clean.suppliers_clean s
-        LEFT JOIN dwh.dim_supplier d ON d.supplier_id = s.supplier_id AND d.is_current = TRUE
-        WHERE d.supplier_id IS NULL
-    """)
+        SELECT COUNT(*) FILTER (WHERE valid_from = TIMESTAMP '{SCD2_INITIAL_VALID_FROM}'),
+               COUNT(*) FILTER (WHERE valid_from > TIMESTAMP '{SCD2_INITIAL_VALID_FROM}')
+        FROM opened
+    """, (run_id,))
+    return cur.fetchone()
 
-    # dim_product
-    cur.execute("""
-        INSERT INTO dwh.dim_product (
-            product_id, product_name, category, sub_category, unit_cost, unit_price,
-            supplier_id, valid_from, valid_to, is_current, product_hash
-        )
-        SELECT
-            p.product_id, p.product_name, p.category, p.sub_category, p.unit_cost, p.unit_price,
-            p.supplier_id, NOW(), NULL, TRUE,
-            md5(concat_ws('|', p.product_name, p.category, p.sub_category, p.unit_cost, p.unit_price, p.supplier_id))
-        FROM staging_clean.products_clean p
-        LEFT JOIN dwh.dim_product d ON d.product_id = p.product_id AND d.is_current = TRUE
-        WHERE d.product_id IS NULL
-    """)
 
-    # dim_order_status (reference)
-    cur.execute("""
-        INSERT INTO dwh.dim_order_status(status_code)
-        SELECT DISTINCT current_status
-        FROM staging_clean.orders_clean
-        WHERE current_status IS NOT NULL
-        ON CONFLICT (status_code) DO NOTHING
-    """)
+# Dimensions de reference : colonne de code et ses sources dans staging_clean
+REFERENCE_DIMENSIONS = {
+    "dwh.dim_order_status": ("status_code", (("staging_clean.orders_clean", "current_status"),
+                                             ("staging_clean.order_status_history_clean", "status"))),
+    "dwh.dim_ship_mode": ("ship_mode_code", (("staging_clean.orders_clean", "ship_mode"),)),
+}
 
-    # Ajouter aussi les statuts provenant de l'historique
-    cur.execute("""
-        INSERT INTO dwh.dim_order_status(status_code)
-        SELECT DISTINCT status
-        FROM staging_clean.order_status_history_clean
-        WHERE status IS NOT NULL
-        ON CONFLICT (status_code) DO NOTHING
-    """)
 
-    # dim_ship_mode (reference)
-    cur.execute("""
-        INSERT INTO dwh.dim_ship_mode(ship_mode_code)
-        SELECT DISTINCT ship_mode
-        FROM staging_clean.orders_clean
-        WHERE ship_mode IS NOT NULL
-        ON CONFLICT (ship_mode_code) DO NOTHING
+def conform_reference(cur, dimension: str) -> int:
+    """Ajoute a une dimension de reference les codes inconnus."""
+    code, sources = REFERENCE_DIMENSIONS[dimension]
+    cur.execute(f"""
+        INSERT INTO {dimension} ({code})
+        {' UNION '.join(f'SELECT DISTINCT {col} FROM {table} WHERE {col} IS NOT NULL'
+                        for table, col in sources)}
+        ON CONFLICT ({code}) DO NOTHING
     """)
+    return cur.rowcount
 
 
 # ---------------------------------------------------------------------------
 # Main
 # ---------------------------------------------------------------------------
 
-def run(run_id: str):
+def build_graph(run_id: str, staging_run: Optional[str], mode: Optional[str],
+                threshold: float, frames: Optional[Dict] = None) -> TaskGraph:
+    """Taches du transform et tables qu'elles lisent / ecrivent. `mode` :
+    normalisation "full", "incremental", "memory" (`frames` normalises en
+    memoire, copies dans staging_clean) ou None (staging_clean a jour) ;
+    `threshold` : seuil des doublons approches (voir fuzzy_threshold)."""
+    params = {"run_id": run_id, "staging_run": staging_run}
+    clean = {entity: table for entity, (table, *_) in CLEAN_TABLES.items()}
+    graph = TaskGraph()
+
+    if mode == "incremental":
+        graph.add("changed_orders", partial(collect_changed_orders, params=params),
+                  reads=("staging_raw.row_changeset", "staging_raw.order_lines_raw",
+                         clean["order_lines"]),
+                  writes=("staging_clean.changed_orders",))
+    if mode == "memory":
+        for entity, table in clean.items():
+            graph.add(f"normalize:{entity}",
+                      partial(copy_clean_frame, entity=entity, frame=frames[entity]),
+                      writes=(table,))
+    elif mode is not None:
+        for entity, table in clean.items():
+            reads = [f"staging_raw.{entity}_raw"]
+            if mode == "incremental":
+                reads.append("staging_raw.row_changeset")
+                if entity in ORDER_CHILDREN:
+                    reads.append("staging_clean.changed_orders")
+                fn = normalize_entity_incremental
+            else:
+                fn = normalize_entity
+            graph.add(f"normalize:{entity}", partial(fn, entity=entity, params=params),
+                      reads=reads, writes=(table,))
+
+    for check, (table, _) in DUPLICATE_CHECKS.items():
+        graph.add(f"quality:{check}", partial(count_duplicates, check=check), reads=(table,))
+    for entity, (table, *_) in FUZZY_MATCH.items():
+        # Ecritures dans la meme table : les entites passent l'une apres
+        # l'autre (le scoring, en Python, ne gagnait rien en parallele)
+        graph.add(f"quality:{entity[:-1]}_fuzzy_clusters",
+                  partial(detect_fuzzy_duplicates, entity=entity, run_id=run_id,
+                          threshold=threshold),
+                  reads=(table,), writes=("staging_clean.duplicate_review",))
+    if mode != "memory":
+        # En memoire, les commandes incoherentes sont ecartees avant la copie
+        graph.add("quality:invalid_order_dates_removed", remove_invalid_orders,
+                  writes=(clean["orders"],))
+
+    if mode in ("full", "incremental"):
+        graph.add("clean_state", partial(_set_clean_run, staging_run=staging_run),
+                  reads=clean.values(), writes=("staging_clean.clean_state",))
+
+    for dimension, (table, *_) in SCD2_DIMENSIONS.items():
+        graph.add(f"scd2:{dimension}", partial(apply_scd2, run_id=run_id, dimension=dimension),
+                  reads=(table,), writes=(dimension,))
+    for dimension, (_, sources) in REFERENCE_DIMENSIONS.items():
+        graph.add(f"reference:{dimension}", partial(conform_reference, dimension=dimension),
+                  reads=[table for table, _ in sources], writes=(dimension,))
+    return graph
+
+
+def run(run_id: str, full_refresh: bool = False, rows: Optional[Dict[str, List[Dict]]] = None):
+    """Transform du run `run_id`.
+
+    La normalisation est incrementale (`normalize_entity_incremental`) si
+    staging_clean reflete le run dont le run courant de staging_raw est le
+    changeset, sauf `full_refresh` ou `ETL_NORMALIZE_MODE=full`. Le marqueur
+    staging_clean.clean_state est efface avant le graphe et reecrit avec la
+    validation commune : un transform interrompu force une normalisation
+    complete au run suivant.
+
+    Avec `rows` (lignes extraites par entite, ETL_TRANSFORM_ENGINE=memory),
+    la phase 1 se fait en memoire (`normalize_frame`) sans lire staging_raw :
+    seul le resultat normalise est copie dans staging_clean. clean_state
+    reste vide, le run suivant en SQL normalise donc tout.
+    """
+    incremental = (os.getenv("ETL_NORMALIZE_MODE", "incremental").lower() == "incremental"
+                   and not full_refresh)
+    workers = int(os.getenv("ETL_TRANSFORM_WORKERS", "4"))
+    threshold = fuzzy_threshold()
+    frames, rejected = None, 0
     conn = get_dwh_conn()
     try:
         with conn.cursor() as cur:
-            print("[transform] Phase 1 : normalisation...")
-            normalize(cur, run_id)
-
-            print("[transform] Phase 2 : deduplication / qualite...")
-            issues = deduplicate(cur)
-            print(f"[transform]   -> {issues}")
-
-            print("[transform] Phase 3 : conformation dimensionnelle...")
-            conform_dimensions(cur, run_id)
-
-        conn.commit()
+            if rows is not None:
+                staging_run, mode = None, "memory"
+                started = time.perf_counter()
+                types = raw_column_types(cur)
+                frames = {}
+                for entity in CLEAN_TABLES:
+                    frames[entity], dropped = normalize_frame(entity, rows[entity], run_id,
+                                                              types[entity])
+                    rejected += dropped
+                print(f"[transform] Phase 1 : normalisation en memoire de "
+                      f"{sum(len(r) for r in rows.values())} lignes extraites "
+                      f"({time.perf_counter() - started:.2f}s)")
+            else:
+                staging_run = current_staging_run(cur)
+                base = incremental_base(cur, staging_run) if incremental else None
+                if base == staging_run:
+                    mode = None
+                    print(f"[transform] Phase 1 : staging_clean deja normalise "
+                          f"depuis le run {staging_run}")
+                elif base is not None:
+                    mode = "incremental"
+                    print(f"[transform] Phase 1 : normalisation incrementale "
+                          f"(staging_raw : run {staging_run}, changeset depuis {base})...")
+                else:
+                    mode = "full"
+                    print(f"[transform] Phase 1 : normalisation "
+                          f"(staging_raw : run {staging_run})...")
+            if mode is not None:
+                cur.execute("DELETE FROM staging_clean.clean_state")
+            if mode == "incremental":
+                # Changeset du run fraichement publie : sans statistiques, le
+                # planificateur l'estime a une ligne et choisit des boucles imbriquees
+                cur.execute("ANALYZE staging_raw.row_changeset")
+        graph = build_graph(run_id, staging_run, mode, threshold, frames)
+        started = time.perf_counter()
+        results, execution = graph.run(conn, workers)
+        print(f"[transform] Phases 1-3 : {len(graph.tasks)} taches en "
+              f"{time.perf_counter() - started:.2f}s ({execution})")
     finally:
         conn.close()
 
+    if mode == "incremental":
+        print("[transform]   -> normalisation (upserts, suppressions) " + ", ".join(
+            f"{entity} {upserted}/{deleted}" for entity in CLEAN_TABLES
+            for upserted, deleted in [results[f"normalize:{entity}"]]))
+    elif mode in ("full", "memory"):
+        print("[transform]   -> normalisation (lignes) " + ", ".join(
+            f"{entity} {results[f'normalize:{entity}']}" for entity in CLEAN_TABLES))
+    issues = {name.split(":", 1)[1]: value for name, value in results.items()
+              if name.startswith("quality:")}
+    if mode == "memory":
+        issues["invalid_order_dates_removed"] = rejected
+    print(f"[transform]   -> qualite {issues}")
+    print("[transform]   -> SCD2 (nouvelles cles, nouvelles versions) " + ", ".join(
+        f"{dimension.split('.')[1]} {new}/{changed}" for dimension in SCD2_DIMENSIONS
+        for new, changed in [results[f"scd2:{dimension}"]]))
     print("[transform] Done")
 
 
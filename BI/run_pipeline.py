@@ -6,6 +6,14 @@ Point d'entree unique pour executer le processus ETL complet.
 Usage :
     python BI/run_pipeline.py            # pipeline complet
     python BI/run_pipeline.py --force    # forcer meme si aucun changement
+    python BI/run_pipeline.py --no-probe # ignorer la sonde de changement (extraction complete)
+    python BI/run_pipeline.py --full     # extraction complete (mode incremental)
+    python BI/run_pipeline.py --resume   # reprendre une extraction interrompue
+    python BI/run_pipeline.py --offline  # rejouer le dernier run depuis le cache API
+    python BI/run_pipeline.py --replay <run_id>  # rejouer un run donne depuis le cache
+    python BI/run_pipeline.py --source csv       # backfill depuis data/*.csv (sans gateway)
+    python BI/run_pipeline.py --source db        # lecture directe de la base OLTP (ERP_PG*)
+    python BI/run_pipeline.py --engine memory    # transform en memoire (pandas), sans staging_raw
 
 Flux :
   Donnees brutes (API ERP)
@@ -20,18 +28,22 @@ Flux :
 
 Ce script :
   1. Charge la configuration depuis BI/.env
-  2. Cree automatiquement la base DWH PostgreSQL si elle n'existe pas
-  3. Applique le schema (staging + dimensions + faits + index)
-  4. Execute les 3 etapes ETL (avec detection de changement) :
+  2. Sonde la source (nombre de lignes + updated_at max par liste) : si rien
+     n'a change depuis le dernier run, s'arrete la (ni schema ni extraction)
+  3. Cree automatiquement la base DWH PostgreSQL si elle n'existe pas
+  4. Applique le schema (staging + dimensions + faits + index)
+  5. Execute les 3 etapes ETL (avec detection de changement) :
        Extract  -> donnees ERP via API REST gateway (auth JWT)
        Transform -> normalisation, deduplication, conformation
        Load     -> chargement dimensions et faits (schema etoile)
-  5. Analyse et rapport (KPIs, tendances, alertes stock)
+  6. Analyse et rapport (KPIs, tendances, alertes stock)
 """
 
+import json
 import os
 import sys
 import pathlib
+import time
 from datetime import datetime
 
 import psycopg2
@@ -145,7 +157,8 @@ def run_analysis(run_id: str):
                 SELECT dp.product_name, dp.category,
                        SUM(f.sales_amount) AS ca, SUM(f.profit_amount) AS profit
                 FROM dwh.fact_sales_order_line f
-                JOIN dwh.dim_product dp ON f.product_key = dp.product_key AND dp.is_current = TRUE
+                JOIN dwh.dim_product v ON f.product_key = v.product_key
+                JOIN dwh.dim_product dp ON dp.product_id = v.product_id AND dp.is_current = TRUE
                 GROUP BY dp.product_name, dp.category
                 ORDER BY ca DESC LIMIT 5
             """)
@@ -156,7 +169,8 @@ def run_analysis(run_id: str):
                 SELECT dc.customer_name, dc.segment,
                        SUM(f.sales_amount) AS ca
                 FROM dwh.fact_sales_order_line f
-                JOIN dwh.dim_customer dc ON f.customer_key = dc.customer_key AND dc.is_current = TRUE
+                JOIN dwh.dim_customer v ON f.customer_key = v.customer_key
+                JOIN dwh.dim_customer dc ON dc.customer_id = v.customer_id AND dc.is_current = TRUE
                 GROUP BY dc.customer_name, dc.segment
                 ORDER BY ca DESC LIMIT 5
             """)
@@ -168,7 +182,8 @@ def run_analysis(run_id: str):
                        COUNT(DISTINCT f.order_id) AS commandes,
                        SUM(f.sales_amount) AS ca
                 FROM dwh.fact_sales_order_line f
-                JOIN dwh.dim_customer dc ON f.customer_key = dc.customer_key AND dc.is_current = TRUE
+                JOIN dwh.dim_customer v ON f.customer_key = v.customer_key
+                JOIN dwh.dim_customer dc ON dc.customer_id = v.customer_id AND dc.is_current = TRUE
                 WHERE dc.segment IS NOT NULL
                 GROUP BY dc.segment ORDER BY ca DESC
             """)
@@ -178,7 +193,8 @@ def run_analysis(run_id: str):
             cur.execute("""
                 SELECT dp.product_name, fi.quantity_on_hand, fi.stock_value
                 FROM dwh.fact_inventory_snapshot fi
-                JOIN dwh.dim_product dp ON fi.product_key = dp.product_key AND dp.is_current = TRUE
+                JOIN dwh.dim_product v ON fi.product_key = v.product_key
+                JOIN dwh.dim_product dp ON dp.product_id = v.product_id AND dp.is_current = TRUE
                 JOIN dwh.dim_date dd ON fi.snapshot_date_key = dd.date_key
                 WHERE dd.full_date = (SELECT MAX(d2.full_date) FROM dwh.dim_date d2
                                       WHERE EXISTS (SELECT 1 FROM dwh.fact_inventory_snapshot f2
@@ -303,12 +319,59 @@ def print_report(results: dict):
     print("\n" + "=" * W)
 
 
+def print_extract_metrics():
+    """Resume des metriques de l'extraction (BI/.etl_metrics.json)."""
+    from etl.extract import METRICS_FILE
+    if not METRICS_FILE.exists():
+        return
+    metrics = json.loads(METRICS_FILE.read_text(encoding="utf-8"))
+
+    def _ms(value):
+        return "-" if value is None else f"{value:,.0f}"
+
+    print(f"\n--- Metriques extraction ({METRICS_FILE.name}) ---")
+    phases = ", ".join(f"{k} {v:.2f}s" for k, v in metrics.get("phases_s", {}).items())
+    print(f"  Source : {metrics.get('source')}  |  duree {metrics.get('duration_s', 0):.2f}s"
+          f"{'  (' + phases + ')' if phases else ''}")
+    endpoints = metrics.get("endpoints", {})
+    if endpoints:
+        print(f"  {'Endpoint':<28} {'Req':>6} {'Err':>4} {'Retry':>5} {'Pages':>6} {'Ko':>8} "
+              f"{'p50':>6} {'p95':>6} {'p99':>6} (ms)")
+        for name, e in endpoints.items():
+            lat = e["latency_ms"]
+            print(f"  {name:<28} {e['requests']:>6,} {e['errors']:>4} {e['retries']:>5} "
+                  f"{e['pages']:>6,} {e['bytes'] / 1024:>8,.0f} "
+                  f"{_ms(lat['p50']):>6} {_ms(lat['p95']):>6} {_ms(lat['p99']):>6}")
+    staging = metrics.get("staging", {})
+    if staging:
+        print(f"  {'Table staging_raw':<40} {'Lignes':>8} {'Duree':>8} {'Lignes/s':>10}")
+        for table, t in staging.items():
+            rate = "-" if t["rows_per_s"] is None else f"{t['rows_per_s']:,}"
+            print(f"  {table:<40} {t['rows']:>8,} {t['seconds']:>7.2f}s {rate:>10}")
+
+
 # ---------------------------------------------------------------------------
 # Pipeline
 # ---------------------------------------------------------------------------
 
 def main():
     force = "--force" in sys.argv
+    no_probe = "--no-probe" in sys.argv
+    full_refresh = "--full" in sys.argv
+    resume = "--resume" in sys.argv
+    replay = "--offline" in sys.argv or "--replay" in sys.argv
+    source = None
+    if "--source" in sys.argv:
+        idx = sys.argv.index("--source")
+        if idx + 1 >= len(sys.argv):
+            raise RuntimeError("--source attend api, csv ou db")
+        source = sys.argv[idx + 1]
+    engine = None
+    if "--engine" in sys.argv:
+        idx = sys.argv.index("--engine")
+        if idx + 1 >= len(sys.argv):
+            raise RuntimeError("--engine attend sql ou memory")
+        engine = sys.argv[idx + 1]
 
     # 1. Charger environnement
     if ENV_PATH.exists():
@@ -317,33 +380,81 @@ def main():
         print(f"[pipeline] ATTENTION: {ENV_PATH} introuvable, "
               "utilisation des variables d'environnement systeme")
 
-    run_id = datetime.utcnow().strftime("run_%Y%m%d_%H%M%S")
+    run_id = None
+    if "--replay" in sys.argv:
+        idx = sys.argv.index("--replay")
+        if idx + 1 >= len(sys.argv):
+            raise RuntimeError("--replay attend un run_id (voir BI/.etl_cache/)")
+        run_id = sys.argv[idx + 1]
+    elif replay:
+        from etl.extract import ResponseCache
+        run_id = ResponseCache.latest_run_id()
+        if run_id is None:
+            raise RuntimeError("--offline : aucune extraction en cache (BI/.etl_cache/)")
+    elif resume:
+        # Reprise : meme run_id que l'extraction interrompue
+        from etl.extract import ExtractCheckpoint
+        run_id = ExtractCheckpoint.latest_run_id()
+        if run_id is None:
+            print("[pipeline] --resume : aucun point de reprise, nouveau run")
+    run_id = run_id or datetime.utcnow().strftime("run_%Y%m%d_%H%M%S")
     os.environ["ETL_RUN_ID"] = run_id
+    engine = (engine or os.getenv("ETL_TRANSFORM_ENGINE", "sql")).lower()
+    if engine not in ("sql", "memory"):
+        raise RuntimeError(f"Moteur de transform inconnu : {engine} (attendu : sql, memory)")
 
     print("=" * 60)
     print(f"  ETL Pipeline  |  run_id = {run_id}")
     if force:
         print("  Mode : --force (ignore la detection de changement)")
+    if source:
+        print(f"  Source : {source}")
+    if engine == "memory":
+        print("  Transform : en memoire (staging_raw non alimente)")
+    if replay:
+        print("  Mode : replay hors ligne (cache des reponses API)")
+    if resume:
+        print("  Mode : --resume (reprise depuis le dernier point de reprise)")
     print("=" * 60)
 
-    # 2. Bootstrap base + schema
+    # 2. Sonde de changement : s'arrete avant tout bootstrap si la source n'a pas change
+    probe_state = None
+    if (not no_probe and not resume and not replay
+            and os.getenv("ETL_CHANGE_PROBE", "true").lower() == "true"):
+        from etl.extract import probe_source, probe_unchanged, record_probe_skip
+        started = time.perf_counter()
+        try:
+            probe_state = probe_source(source)
+        except Exception as exc:
+            print(f"[pipeline] Sonde de changement indisponible ({exc}), extraction complete")
+        if not (force or full_refresh) and probe_unchanged(probe_state, source):
+            print(f"\n[pipeline] Sonde : aucun changement depuis le dernier run "
+                  f"({time.perf_counter() - started:.2f}s), ETL et rapport ignores")
+            print("  Utilisez --no-probe ou --force pour forcer l'extraction")
+            record_probe_skip(source)
+            return
+
+    # 3. Bootstrap base + schema
     print("\n--- Preparation base de donnees ---")
     ensure_database_exists()
     apply_schema()
 
-    # 3. Extract
+    # 4. Extract
     print("\n--- Etape 1/3 : Extract (API ERP) ---")
     from etl.extract import run as run_extract
-    counts, data_changed = run_extract(run_id)
+    # Moteur memoire : les lignes extraites passent directement au transform
+    clean_rows = {} if engine == "memory" else None
+    counts, data_changed = run_extract(run_id, full_refresh=full_refresh, resume=resume,
+                                      replay=replay, source=source, clean_rows=clean_rows)
 
-    # 4. Transform + Load (skip si aucun changement sauf --force)
+    # 5. Transform + Load (skip si aucun changement sauf --force)
     if data_changed or force:
         if not data_changed and force:
             print("\n[pipeline] --force : transform+load malgre aucun changement")
 
         print("\n--- Etape 2/3 : Transform (normaliser, deduplicer, conformer) ---")
         from etl.transform import run as run_transform
-        run_transform(run_id)
+        run_transform(run_id, full_refresh=force, rows=clean_rows)
 
         print("\n--- Etape 3/3 : Load (dimensions + faits) ---")
         from etl.load import run as run_load
@@ -352,15 +463,20 @@ def main():
         print("\n--- Etapes 2-3 ignorees (aucun changement dans les donnees source) ---")
         print("  Utilisez --force pour forcer le rechargement complet")
 
-    # 5. Analyse + Rapport
+    # Etat sonde avant l'extraction : le DWH est a jour pour cet etat
+    from etl.extract import save_probe
+    save_probe(None if replay else probe_state, source)
+
+    # 6. Analyse + Rapport
     print("\n--- Etape 4 : Analyse et rapport ---")
     try:
         results = run_analysis(run_id)
         print_report(results)
     except Exception as exc:
         print(f"[pipeline] Rapport non disponible : {exc}")
+    print_extract_metrics()
 
-    # 6. Resume
+    # 7. Resume
     print("\n" + "=" * 60)
     print(f"  Pipeline termine avec succes  |  run_id = {run_id}")
     print(f"  Donnees extraites : {counts}")
@@ -89,7 +89,8 @@ def _top_products(conn, limit=10) -> list:
                SUM(f.sales_amount) AS ca, SUM(f.profit_amount) AS profit,
                SUM(f.quantity) AS qty
         FROM dwh.fact_sales_order_line f
-        JOIN dwh.dim_product dp ON f.product_key = dp.product_key AND dp.is_current = TRUE
+        JOIN dwh.dim_product v ON f.product_key = v.product_key
+        JOIN dwh.dim_product dp ON dp.product_id = v.product_id AND dp.is_current = TRUE
         GROUP BY dp.product_name, dp.category
         ORDER BY ca DESC LIMIT %s
     """, (limit,))
@@ -106,7 +107,8 @@ def _top_customers(conn, limit=10) -> list:
                SUM(f.sales_amount) AS ca,
                COUNT(DISTINCT f.order_id) AS commandes
         FROM dwh.fact_sales_order_line f
-        JOIN dwh.dim_customer dc ON f.customer_key = dc.customer_key AND dc.is_current = TRUE
+        JOIN dwh.dim_customer v ON f.customer_key = v.customer_key
+        JOIN dwh.dim_customer dc ON dc.customer_id = v.customer_id AND dc.is_current = TRUE
         GROUP BY dc.customer_name, dc.segment
         ORDER BY ca DESC LIMIT %s
     """, (limit,))
@@ -122,7 +124,8 @@ def _segments(conn) -> list:
         SELECT dc.segment, COUNT(DISTINCT f.order_id) AS commandes,
                SUM(f.sales_amount) AS ca, SUM(f.profit_amount) AS profit
         FROM dwh.fact_sales_order_line f
-        JOIN dwh.dim_customer dc ON f.customer_key = dc.customer_key AND dc.is_current = TRUE
+        JOIN dwh.dim_customer v ON f.customer_key = v.customer_key
+        JOIN dwh.dim_customer dc ON dc.customer_id = v.customer_id AND dc.is_current = TRUE
         WHERE dc.segment IS NOT NULL
         GROUP BY dc.segment ORDER BY ca DESC
     """)
@@ -137,7 +140,8 @@ def _stock_alerts(conn) -> list:
     cur.execute("""
         SELECT dp.product_name, fi.quantity_on_hand, fi.stock_value
         FROM dwh.fact_inventory_snapshot fi
-        JOIN dwh.dim_product dp ON fi.product_key = dp.product_key AND dp.is_current = TRUE
+        JOIN dwh.dim_product v ON fi.product_key = v.product_key
+        JOIN dwh.dim_product dp ON dp.product_id = v.product_id AND dp.is_current = TRUE
         JOIN dwh.dim_date dd ON fi.snapshot_date_key = dd.date_key
         WHERE dd.full_date = (SELECT MAX(d2.full_date) FROM dwh.dim_date d2
                               WHERE EXISTS (SELECT 1 FROM dwh.fact_inventory_snapshot f2
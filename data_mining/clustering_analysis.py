@@ -44,11 +44,12 @@ class ClusteringAnalysis:
                 AVG(fol.quantity) AS quantite_moyenne,
                 COUNT(*) AS nb_lignes_total
             FROM dwh.dim_customer dc
-            LEFT JOIN dwh.fact_sales_order_line fol ON dc.customer_key = fol.customer_key
+            LEFT JOIN dwh.dim_customer v ON v.customer_id = dc.customer_id
+            LEFT JOIN dwh.fact_sales_order_line fol ON v.customer_key = fol.customer_key
             LEFT JOIN dwh.dim_date dd ON fol.order_date_key = dd.date_key
             LEFT JOIN dwh.dim_product dp ON fol.product_key = dp.product_key
             LEFT JOIN dwh.dim_geography dg ON fol.geography_key = dg.geography_key
-            WHERE fol.sales_amount > 0
+            WHERE dc.is_current = TRUE AND fol.sales_amount > 0
             GROUP BY dc.customer_key, dc.customer_name, dc.email
             HAVING COUNT(DISTINCT fol.order_id) > 0
             {limit_clause}
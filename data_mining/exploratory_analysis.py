@@ -61,7 +61,8 @@ class ExploratoryAnalysis:
                     COUNT(DISTINCT fol.customer_key) AS unique_customers,
                     COUNT(*) AS transactions_count
                 FROM dwh.fact_sales_order_line fol
-                JOIN dwh.dim_product dp ON fol.product_key = dp.product_key
+                JOIN dwh.dim_product v ON fol.product_key = v.product_key
+                JOIN dwh.dim_product dp ON dp.product_id = v.product_id AND dp.is_current = TRUE
                 GROUP BY dp.product_name, dp.category, dp.sub_category
                 {limit_clause}
             """,
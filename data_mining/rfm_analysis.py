@@ -38,9 +38,10 @@ class RFMAnalysis:
                 fol.order_date_key,
                 dd.full_date
             FROM dwh.dim_customer dc
-            JOIN dwh.fact_sales_order_line fol ON dc.customer_key = fol.customer_key
+            JOIN dwh.dim_customer v ON v.customer_id = dc.customer_id
+            JOIN dwh.fact_sales_order_line fol ON v.customer_key = fol.customer_key
             JOIN dwh.dim_date dd ON fol.order_date_key = dd.date_key
-            WHERE fol.sales_amount > 0
+            WHERE dc.is_current = TRUE AND fol.sales_amount > 0
             {limit_clause}
         ),
         customer_stats AS (
@@ -237,6 +237,9 @@ CREATE INDEX IF NOT EXISTS idx_order_status_history_order_id ON order_status_his
 CREATE INDEX IF NOT EXISTS idx_user_roles_user_id ON user_roles(user_id);
 CREATE INDEX IF NOT EXISTS idx_role_permissions_role_id ON role_permissions(role_id);
 CREATE INDEX IF NOT EXISTS idx_orders_current_status ON orders(current_status);
+CREATE INDEX IF NOT EXISTS idx_orders_updated_at ON orders(updated_at);
+CREATE INDEX IF NOT EXISTS idx_customers_updated_at ON customers(updated_at);
+CREATE INDEX IF NOT EXISTS idx_products_updated_at ON products(updated_at);
 CREATE INDEX IF NOT EXISTS idx_accounting_periods_dates ON accounting_periods(start_date, end_date);
 CREATE INDEX IF NOT EXISTS idx_audit_logs_entity ON audit_logs(entity_type, entity_id);
 CREATE INDEX IF NOT EXISTS idx_audit_logs_actor ON audit_logs(actor_username, actor_user_id);
@@ -1,7 +1,9 @@
 const express = require('express');
 const { pool } = require('../../database/connection');
 const { buildAuditActor, recordAudit } = require('../../utils/audit');
-const { sendServiceError } = require('../../utils/service-http');
+const {
+  buildPagination, isSummaryRequest, parseKeysetParam, parseTimestampParam, sendServiceError,
+} = require('../../utils/service-http');
 
 const app = express();
 app.use(express.json());
@@ -378,9 +380,24 @@ app.patch('/products/:productId', async (req, res, next) => {
 });
 
 app.get('/products', async (req, res, next) => {
+  if (isSummaryRequest(req.query)) {
+    try {
+      const result = await pool.query('SELECT COUNT(*)::int AS count, MAX(updated_at) AS max_updated_at FROM products');
+      return res.status(200).json({ summary: result.rows[0] });
+    } catch (error) {
+      return next(error);
+    }
+  }
+
   const limit = parsePositiveInt(req.query.limit, 20);
   const offset = Math.max(Number(req.query.offset) || 0, 0);
   const category = req.query.category || null;
+  const updatedSince = parseTimestampParam(req.query.updated_since);
+  const after = parseKeysetParam(req.query.after);
+
+  if (updatedSince === undefined) {
+    return res.status(400).json({ message: 'updated_since doit etre un timestamp ISO 8601.' });
+  }
 
   try {
     const query = `
@@ -396,19 +413,23 @@ app.get('/products', async (req, res, next) => {
         p.reorder_quantity,
         p.warehouse_location,
         p.supplier_id,
-        s.supplier_name
+        s.supplier_name,
+        p.created_at,
+        p.updated_at
       FROM products p
       LEFT JOIN suppliers s ON s.supplier_id = p.supplier_id
       WHERE ($1::text IS NULL OR p.category = $1)
+        AND ($4::timestamptz IS NULL OR p.updated_at >= $4)
+        AND ($5::text IS NULL OR p.product_id > $5)
       ORDER BY p.product_id
       LIMIT $2 OFFSET $3
     `;
 
-    const result = await pool.query(query, [category, limit, offset]);
+    const result = await pool.query(query, [category, limit, after === null ? offset : 0, updatedSince, after]);
     res.status(200).json({
       items: result.rows,
-      pagination: { limit, offset },
-      filters: { category },
+      pagination: buildPagination(result.rows, limit, offset, after, 'product_id'),
+      filters: { category, updated_since: updatedSince },
     });
   } catch (error) {
     next(error);
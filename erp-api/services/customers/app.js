@@ -1,7 +1,9 @@
 const express = require('express');
 const { pool } = require('../../database/connection');
 const { buildAuditActor, recordAudit } = require('../../utils/audit');
-const { sendServiceError } = require('../../utils/service-http');
+const {
+  buildPagination, isSummaryRequest, parseKeysetParam, parseTimestampParam, sendServiceError,
+} = require('../../utils/service-http');
 
 const app = express();
 app.use(express.json());
@@ -45,24 +47,46 @@ app.get('/health', async (_req, res) => {
 });
 
 app.get('/customers', async (req, res, next) => {
+  if (isSummaryRequest(req.query)) {
+    try {
+      const result = await pool.query('SELECT COUNT(*)::int AS count, MAX(updated_at) AS max_updated_at FROM customers');
+      return res.status(200).json({ summary: result.rows[0] });
+    } catch (error) {
+      return next(error);
+    }
+  }
+
   const limit = parsePositiveInt(req.query.limit, 20);
   const offset = Math.max(Number(req.query.offset) || 0, 0);
   const segment = req.query.segment || null;
+  const updatedSince = parseTimestampParam(req.query.updated_since);
+  const after = parseKeysetParam(req.query.after);
+
+  if (updatedSince === undefined) {
+    return res.status(400).json({ message: 'updated_since doit etre un timestamp ISO 8601.' });
+  }
 
   try {
     const result = await pool.query(
       `
       SELECT customer_id, customer_name, segment, city, state, region, email,
-             total_sales, total_profit, total_orders, average_order_value
+             total_sales, total_profit, total_orders, average_order_value,
+             created_at, updated_at
       FROM customers
       WHERE ($1::text IS NULL OR segment = $1)
+        AND ($4::timestamptz IS NULL OR updated_at >= $4)
+        AND ($5::text IS NULL OR customer_id > $5)
       ORDER BY customer_id
       LIMIT $2 OFFSET $3
       `,
-      [segment, limit, offset]
+      [segment, limit, after === null ? offset : 0, updatedSince, after]
     );
 
-    res.status(200).json({ items: result.rows, pagination: { limit, offset }, filters: { segment } });
+    res.status(200).json({
+      items: result.rows,
+      pagination: buildPagination(result.rows, limit, offset, after, 'customer_id'),
+      filters: { segment, updated_since: updatedSince },
+    });
   } catch (error) {
     next(error);
   }
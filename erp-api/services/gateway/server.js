@@ -2,6 +2,8 @@ const express = require('express');
 const cookieParser = require('cookie-parser');
 const jwt = require('jsonwebtoken');
 const { randomUUID } = require('crypto');
+const { promisify } = require('util');
+const zlib = require('zlib');
 const { pool } = require('../../database/connection');
 const { hashPassword, verifyPassword } = require('../../utils/password');
 const { recordAudit } = require('../../utils/audit');
@@ -35,6 +37,10 @@ if (hasWeakJwtSecret) {
   console.warn('[gateway] Weak or missing GATEWAY_JWT_SECRET detected (dev mode only).');
 }
 
+const gzip = promisify(zlib.gzip);
+// Reponses relayees compressees (gzip) au-dela de ce seuil si le client l'accepte
+const GZIP_MIN_BYTES = Number(process.env.GATEWAY_GZIP_MIN_BYTES || 1024);
+
 const SERVICE_URLS = {
   sales: process.env.SALES_SERVICE_URL || 'http://localhost:4001',
   catalog: process.env.CATALOG_SERVICE_URL || 'http://localhost:4002',
@@ -186,10 +192,15 @@ async function forwardRequest(req, res, serviceUrl, gatewayPrefix, upstreamBaseP
 
     const response = await fetch(targetUrl, options);
     const contentType = response.headers.get('content-type') || 'application/json';
-    const raw = await response.text();
+    const raw = Buffer.from(await response.arrayBuffer());
 
     res.status(response.status);
     res.setHeader('content-type', contentType);
+    res.setHeader('vary', 'accept-encoding');
+    if (raw.length >= GZIP_MIN_BYTES && /\bgzip\b/.test(req.headers['accept-encoding'] || '')) {
+      res.setHeader('content-encoding', 'gzip');
+      return res.send(await gzip(raw));
+    }
     return res.send(raw);
   } catch (error) {
     return res.status(502).json({
@@ -1,7 +1,9 @@
 const express = require('express');
 const { pool } = require('../../database/connection');
 const { buildAuditActor, recordAudit } = require('../../utils/audit');
-const { sendServiceError } = require('../../utils/service-http');
+const {
+  buildPagination, isSummaryRequest, parseKeysetParam, parseTimestampParam, sendServiceError,
+} = require('../../utils/service-http');
 
 const app = express();
 app.use(express.json());
@@ -193,8 +195,31 @@ app.get('/health', async (_req, res) => {
 });
 
 app.get('/orders', async (req, res, next) => {
+  if (isSummaryRequest(req.query)) {
+    try {
+      const result = await pool.query(`
+        SELECT
+          (SELECT COUNT(*)::int FROM orders) AS count,
+          (SELECT MAX(updated_at) FROM orders) AS max_updated_at,
+          (SELECT COUNT(*)::int FROM order_lines) AS line_count,
+          (SELECT MAX(updated_at) FROM order_lines) AS lines_max_updated_at,
+          (SELECT COUNT(*)::int FROM order_status_history) AS history_count,
+          (SELECT MAX(created_at) FROM order_status_history) AS history_max_created_at
+      `);
+      return res.status(200).json({ summary: result.rows[0] });
+    } catch (error) {
+      return next(error);
+    }
+  }
+
   const limit = parsePositiveInt(req.query.limit, 20);
   const offset = Math.max(Number(req.query.offset) || 0, 0);
+  const updatedSince = parseTimestampParam(req.query.updated_since);
+  const after = parseKeysetParam(req.query.after);
+
+  if (updatedSince === undefined) {
+    return res.status(400).json({ message: 'updated_since doit etre un timestamp ISO 8601.' });
+  }
 
   try {
     const query = `
@@ -206,20 +231,25 @@ app.get('/orders', async (req, res, next) => {
         o.current_status,
         o.ship_mode,
         o.region,
+        o.created_at,
+        o.updated_at,
         COUNT(ol.row_id)::int AS line_count,
         COALESCE(SUM(ol.sales), 0)::numeric(14,4) AS total_sales,
         COALESCE(SUM(ol.profit), 0)::numeric(14,4) AS total_profit
       FROM orders o
       LEFT JOIN order_lines ol ON ol.order_id = o.order_id
+      WHERE ($3::timestamptz IS NULL OR o.updated_at >= $3)
+        AND ($4::text IS NULL OR o.order_id > $4)
       GROUP BY o.order_id
-      ORDER BY o.order_date DESC NULLS LAST, o.order_id DESC
+      ORDER BY ${after === null ? 'o.order_date DESC NULLS LAST, o.order_id DESC' : 'o.order_id'}
       LIMIT $1 OFFSET $2
     `;
 
-    const result = await pool.query(query, [limit, offset]);
+    const result = await pool.query(query, [limit, after === null ? offset : 0, updatedSince, after]);
     res.status(200).json({
       items: result.rows,
-      pagination: { limit, offset },
+      pagination: buildPagination(result.rows, limit, offset, after, 'order_id'),
+      filters: { updated_since: updatedSince },
     });
   } catch (error) {
     next(error);
@@ -1,7 +1,7 @@
 const express = require('express');
 const { pool } = require('../../database/connection');
 const { buildAuditActor, recordAudit } = require('../../utils/audit');
-const { sendServiceError } = require('../../utils/service-http');
+const { isSummaryRequest, parseTimestampParam, sendServiceError } = require('../../utils/service-http');
 
 const app = express();
 app.use(express.json());
@@ -44,18 +44,35 @@ app.get('/health', async (_req, res) => {
   }
 });
 
-app.get('/suppliers', async (_req, res, next) => {
+app.get('/suppliers', async (req, res, next) => {
+  if (isSummaryRequest(req.query)) {
+    try {
+      const result = await pool.query('SELECT COUNT(*)::int AS count, MAX(updated_at) AS max_updated_at FROM suppliers');
+      return res.status(200).json({ summary: result.rows[0] });
+    } catch (error) {
+      return next(error);
+    }
+  }
+
+  const updatedSince = parseTimestampParam(req.query.updated_since);
+
+  if (updatedSince === undefined) {
+    return res.status(400).json({ message: 'updated_since doit etre un timestamp ISO 8601.' });
+  }
+
   try {
     const result = await pool.query(
       `
       SELECT supplier_id, supplier_name, country, contact_email, contact_phone,
-             rating, lead_time_days, payment_terms, active
+             rating, lead_time_days, payment_terms, active, created_at, updated_at
       FROM suppliers
+      WHERE ($1::timestamptz IS NULL OR updated_at >= $1)
       ORDER BY supplier_name
-      `
+      `,
+      [updatedSince]
     );
 
-    res.status(200).json({ items: result.rows });
+    res.status(200).json({ items: result.rows, filters: { updated_since: updatedSince } });
   } catch (error) {
     next(error);
   }
@@ -20,7 +20,39 @@ function sendServiceError(res, serviceLabel, error) {
   });
 }
 
+// Filtre incremental `updated_since` des endpoints de liste (timestamp ISO 8601).
+// Retourne null si absent, undefined si invalide.
+function parseTimestampParam(value) {
+  if (value === undefined || value === null || value === '') return null;
+  const parsed = new Date(String(value));
+  return Number.isNaN(parsed.getTime()) ? undefined : parsed.toISOString();
+}
+
+// Pagination keyset (`?after=<cle>`) des endpoints de liste : `after` vide = premiere page.
+// Retourne null si le client utilise la pagination limit/offset.
+function parseKeysetParam(value) {
+  return value === undefined ? null : String(value);
+}
+
+// Sonde de changement de l'ETL (`?summary=true`) : les endpoints de liste renvoient
+// alors un resume (nombre de lignes, updated_at max) au lieu des lignes.
+function isSummaryRequest(query) {
+  return query.summary === 'true';
+}
+
+function buildPagination(rows, limit, offset, after, keyColumn) {
+  if (after === null) {
+    return { limit, offset };
+  }
+  const last = rows[rows.length - 1];
+  return { limit, after, next_cursor: rows.length === limit && last ? String(last[keyColumn]) : null };
+}
+
 module.exports = {
+  buildPagination,
+  isSummaryRequest,
+  parseKeysetParam,
+  parseTimestampParam,
   resolveDatabaseErrorStatus,
   resolveHttpStatus,
   sendServiceError,
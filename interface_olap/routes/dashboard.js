@@ -47,11 +47,12 @@ router.get('/strategic', async (req, res) => {
         ORDER BY dd.year_number, dd.month_number
       `),
       pool.query(`
-        SELECT dc.segment, COUNT(DISTINCT dc.customer_key) AS nb_clients,
+        SELECT dc.segment, COUNT(DISTINCT dc.customer_id) AS nb_clients,
                SUM(f.sales_amount) AS ca, SUM(f.profit_amount) AS profit,
                COUNT(DISTINCT f.order_id) AS orders
         FROM dwh.fact_sales_order_line f
-        JOIN dwh.dim_customer dc ON f.customer_key = dc.customer_key AND dc.is_current = TRUE
+        JOIN dwh.dim_customer v ON f.customer_key = v.customer_key
+        JOIN dwh.dim_customer dc ON dc.customer_id = v.customer_id AND dc.is_current = TRUE
         WHERE dc.segment IS NOT NULL
         GROUP BY dc.segment ORDER BY ca DESC
       `),
@@ -67,7 +68,8 @@ router.get('/strategic', async (req, res) => {
         SELECT dp.product_name, dp.category,
                SUM(f.sales_amount) AS ca, SUM(f.quantity) AS qty, SUM(f.profit_amount) AS profit
         FROM dwh.fact_sales_order_line f
-        JOIN dwh.dim_product dp ON f.product_key = dp.product_key AND dp.is_current = TRUE
+        JOIN dwh.dim_product v ON f.product_key = v.product_key
+        JOIN dwh.dim_product dp ON dp.product_id = v.product_id AND dp.is_current = TRUE
         GROUP BY dp.product_name, dp.category ORDER BY ca DESC LIMIT 10
       `),
     ]);
@@ -107,7 +109,8 @@ router.get('/tactical', async (req, res) => {
                     THEN ROUND(SUM(f.profit_amount) / SUM(f.sales_amount) * 100, 1)
                     ELSE 0 END AS margin_pct
         FROM dwh.fact_sales_order_line f
-        JOIN dwh.dim_product dp ON f.product_key = dp.product_key AND dp.is_current = TRUE
+        JOIN dwh.dim_product v ON f.product_key = v.product_key
+        JOIN dwh.dim_product dp ON dp.product_id = v.product_id AND dp.is_current = TRUE
         WHERE dp.category IS NOT NULL
         GROUP BY dp.category ORDER BY ca DESC
       `),
@@ -150,7 +153,7 @@ router.get('/operational', async (req, res) => {
                dos.status_code AS status, sm.ship_mode_code AS ship_mode,
                dd.full_date AS order_date, SUM(f.sales_amount) AS total
         FROM dwh.fact_sales_order_line f
-        JOIN dwh.dim_customer dc ON f.customer_key = dc.customer_key AND dc.is_current = TRUE
+        JOIN dwh.dim_customer dc ON f.customer_key = dc.customer_key
         JOIN dwh.dim_geography dg ON f.geography_key = dg.geography_key
         JOIN dwh.dim_order_status dos ON f.status_key = dos.status_key
         JOIN dwh.dim_ship_mode sm ON f.ship_mode_key = sm.ship_mode_key
@@ -163,8 +166,10 @@ router.get('/operational', async (req, res) => {
         SELECT dp.product_name, dp.category, ds.supplier_name,
                fi.quantity_on_hand, fi.stock_value
         FROM dwh.fact_inventory_snapshot fi
-        JOIN dwh.dim_product dp ON fi.product_key = dp.product_key AND dp.is_current = TRUE
-        JOIN dwh.dim_supplier ds ON fi.supplier_key = ds.supplier_key AND ds.is_current = TRUE
+        JOIN dwh.dim_product vp ON fi.product_key = vp.product_key
+        JOIN dwh.dim_product dp ON dp.product_id = vp.product_id AND dp.is_current = TRUE
+        JOIN dwh.dim_supplier vs ON fi.supplier_key = vs.supplier_key
+        JOIN dwh.dim_supplier ds ON ds.supplier_id = vs.supplier_id AND ds.is_current = TRUE
         JOIN dwh.dim_date dd ON fi.snapshot_date_key = dd.date_key
         WHERE dd.full_date = (SELECT MAX(d2.full_date) FROM dwh.dim_date d2
                               WHERE EXISTS (SELECT 1 FROM dwh.fact_inventory_snapshot f2 WHERE f2.snapshot_date_key = d2.date_key))